@@ -0,0 +1,23 @@
+# Generated by Django 3.1 on 2026-10-17 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garpix_order', '0005_auto_20240807_1557'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='baseorder',
+            name='pending_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='В процессе оплаты'),
+        ),
+        migrations.AddField(
+            model_name='baseorder',
+            name='refunded_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Возвращено'),
+        ),
+    ]
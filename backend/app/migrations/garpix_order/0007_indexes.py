@@ -0,0 +1,32 @@
+# Generated by Django 3.1 on 2026-10-17 23:01
+
+from django.db import migrations, models
+import garpix_order.models.payments.cloudpayments
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garpix_order', '0006_auto_20261018_0200'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cloudpayment',
+            name='order_number',
+            field=models.CharField(db_index=True, max_length=200, verbose_name='Номер заказа'),
+        ),
+        migrations.AlterField(
+            model_name='cloudpayment',
+            name='payment_uuid',
+            field=models.CharField(default=garpix_order.models.payments.cloudpayments.generate_uuid, max_length=64, unique=True, verbose_name='UUID'),
+        ),
+        migrations.AddIndex(
+            model_name='baseorder',
+            index=models.Index(condition=models.Q(recurring__isnull=False), fields=['recurring', 'next_payment_date'], name='garpix_order_recurring_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='basepayment',
+            index=models.Index(fields=['order', 'status'], name='garpix_order_pay_order_st_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-17 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garpix_order', '0007_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basepayment',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name='Ключ идемпотентности'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1 on 2026-10-17 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garpix_order', '0008_basepayment_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedWebhook',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=32, verbose_name='Провайдер')),
+                ('transaction_id', models.CharField(max_length=255, verbose_name='Id транзакции')),
+                ('status', models.CharField(max_length=64, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата обработки')),
+            ],
+            options={
+                'verbose_name': 'Обработанное уведомление',
+                'verbose_name_plural': 'Обработанные уведомления',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='processedwebhook',
+            constraint=models.UniqueConstraint(fields=('provider', 'transaction_id', 'status'), name='garpix_order_webhook_uniq'),
+        ),
+    ]
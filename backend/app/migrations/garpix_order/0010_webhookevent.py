@@ -0,0 +1,38 @@
+# Generated by Django 3.1 on 2026-10-17 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garpix_order', '0009_processedwebhook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=32, verbose_name='Провайдер')),
+                ('order_key', models.CharField(help_text='Номер заказа у провайдера, события одного заказа применяются по порядку', max_length=255, verbose_name='Ключ заказа')),
+                ('payload', models.JSONField(verbose_name='Данные уведомления')),
+                ('status', models.CharField(choices=[('received', 'Получено'), ('processed', 'Обработано'), ('failed', 'Ошибка')], default='received', max_length=16, verbose_name='Статус')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата получения')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата обработки')),
+            ],
+            options={
+                'verbose_name': 'Уведомление провайдера',
+                'verbose_name_plural': 'Уведомления провайдеров',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['provider', 'order_key', 'status'], name='garpix_order_webhook_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['status', 'created_at'], name='garpix_order_webhook_st_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-17 23:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garpix_order', '0010_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='baseorder',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Версия'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1 on 2026-10-17 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garpix_order', '0011_baseorder_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='basepayment',
+            index=models.Index(fields=['created_at', 'id'], name='garpix_order_pay_created_idx'),
+        ),
+    ]
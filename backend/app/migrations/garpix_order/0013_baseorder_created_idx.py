@@ -0,0 +1,17 @@
+# Generated by Django 3.1 on 2026-10-17 23:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garpix_order', '0012_basepayment_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='baseorder',
+            index=models.Index(fields=['created_at', 'id'], name='garpix_order_order_created_idx'),
+        ),
+    ]
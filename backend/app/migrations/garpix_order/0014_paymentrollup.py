@@ -0,0 +1,34 @@
+# Generated by Django 3.1 on 2026-10-17 23:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('garpix_order', '0013_baseorder_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('status', models.CharField(max_length=64, verbose_name='Статус')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Количество')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=18, verbose_name='Сумма')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype', verbose_name='Тип платежа')),
+            ],
+            options={
+                'verbose_name': 'Сводка по платежам',
+                'verbose_name_plural': 'Сводки по платежам',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='paymentrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'content_type', 'status'), name='garpix_order_rollup_uniq'),
+        ),
+    ]
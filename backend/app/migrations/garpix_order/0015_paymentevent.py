@@ -0,0 +1,41 @@
+# Generated by Django 3.1 on 2026-10-17 23:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garpix_order', '0014_paymentrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('transition', 'Переход статуса'), ('provider_data', 'Данные провайдера')], max_length=16, verbose_name='Тип записи')),
+                ('name', models.CharField(blank=True, default='', max_length=64, verbose_name='Переход')),
+                ('source', models.CharField(blank=True, default='', max_length=64, verbose_name='Исходный статус')),
+                ('target', models.CharField(blank=True, default='', max_length=64, verbose_name='Новый статус')),
+                ('data', models.JSONField(blank=True, null=True, verbose_name='Данные')),
+                ('compressed_data', models.BinaryField(blank=True, null=True, verbose_name='Сжатые данные')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='garpix_order.basepayment', verbose_name='Платеж')),
+            ],
+            options={
+                'verbose_name': 'Запись журнала платежа',
+                'verbose_name_plural': 'Журнал платежей',
+            },
+        ),
+        migrations.AddField(
+            model_name='basepayment',
+            name='provider_event',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='garpix_order.paymentevent', verbose_name='Последние данные провайдера'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(fields=['payment', 'id'], name='garpix_order_event_pay_idx'),
+        ),
+    ]
@@ -5,6 +5,7 @@ from polymorphic.admin import PolymorphicParentModelAdmin, PolymorphicChildModel
 from garpix_order.models import BaseOrder, BaseOrderItem, BasePayment, RobokassaPayment
 from ..models.example_page import Service, Order, Invoice
 from fsm_admin.mixins import FSMTransitionMixin
+from garpix_order.admin import ExportActionsMixin, FastChangeListMixin
 
 
 @admin.register(ExamplePage)
@@ -15,6 +16,7 @@ class ExamplePageAdmin(BasePageAdmin):
 @admin.register(Invoice)
 class InvoiceAdmin(FSMTransitionMixin, admin.ModelAdmin):
     readonly_fields = ('status',)
+    raw_id_fields = ('order',)
     fsm_field = ('status',)
     child_models = ()
 
@@ -22,27 +24,33 @@ class InvoiceAdmin(FSMTransitionMixin, admin.ModelAdmin):
 @admin.register(Order)
 class OrderAdmin(PolymorphicChildModelAdmin):
     child_models = ()
+    raw_id_fields = ('user', 'recurring')
 
 
 @admin.register(Service)
 class ServiceAdmin(PolymorphicChildModelAdmin):
     child_models = ()
+    raw_id_fields = ('order',)
 
 
 @admin.register(BaseOrder)
-class BaseOrderAdmin(PolymorphicParentModelAdmin):
+class BaseOrderAdmin(FastChangeListMixin, ExportActionsMixin, PolymorphicParentModelAdmin):
+    list_display = ('number', 'user', 'status', 'total_amount', 'created_at')
     base_model = BaseOrder
     child_models = (Order,)
 
 
 @admin.register(BaseOrderItem)
-class BaseOrderItemAdmin(PolymorphicParentModelAdmin):
+class BaseOrderItemAdmin(FastChangeListMixin, ExportActionsMixin, PolymorphicParentModelAdmin):
+    list_display = ('__str__', 'order', 'amount', 'quantity')
     base_model = BaseOrderItem
     child_models = (Service,)
 
 
 @admin.register(BasePayment)
-class BasePaymentAdmin(PolymorphicParentModelAdmin, FSMTransitionMixin, admin.ModelAdmin):
+class BasePaymentAdmin(FastChangeListMixin, ExportActionsMixin, PolymorphicParentModelAdmin, FSMTransitionMixin,
+                       admin.ModelAdmin):
+    list_display = ('title', 'order', 'amount', 'status', 'created_at')
     fsm_field = ('status',)
     readonly_fields = ('status',)
     base_model = BasePayment
@@ -51,4 +59,4 @@ class BasePaymentAdmin(PolymorphicParentModelAdmin, FSMTransitionMixin, admin.Mo
 
 @admin.register(RobokassaPayment)
 class RobokassaAdmin(PolymorphicChildModelAdmin):
-    pass
+    raw_id_fields = ('order',)
@@ -0,0 +1,33 @@
+# Generated by Django 3.1 on 2026-10-17 23:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garpix_order', '0007_indexes'),
+        ('example', '0002_invoice_order_service'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SberPayment',
+            fields=[
+                ('basepayment_ptr', models.OneToOneField(auto_created=True, on_delete=django.db.models.deletion.CASCADE, parent_link=True, primary_key=True, serialize=False, to='garpix_order.basepayment')),
+                ('external_payment_id', models.CharField(db_index=True, default='', max_length=255, verbose_name='Внешний идентификатор платежа')),
+                ('payment_link', models.CharField(default='', max_length=255, verbose_name='Ссылка на оплату')),
+            ],
+            options={
+                'verbose_name': 'Платеж в Сбере',
+                'verbose_name_plural': 'Платежи в Сбере',
+                'abstract': False,
+            },
+            bases=('garpix_order.basepayment',),
+        ),
+        migrations.AddConstraint(
+            model_name='sberpayment',
+            constraint=models.UniqueConstraint(condition=models.Q(_negated=True, external_payment_id=''), fields=('external_payment_id',), name='example_sberpayment_external_id_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-17 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('example', '0003_sberpayment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sberpayment',
+            name='status_checked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата последней проверки статуса'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('example', '0004_sberpayment_status_checked_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sberpayment',
+            name='external_payment_id',
+            field=models.CharField(default='', max_length=255, verbose_name='Внешний идентификатор платежа'),
+        ),
+    ]
@@ -1 +1 @@
-from .example_page import ExamplePage, Order, Service, Invoice
+from .example_page import ExamplePage, Order, Service, Invoice, SberPayment
@@ -1,6 +1,6 @@
 from django.db import models
 from garpix_page.models import BasePage
-from garpix_order.models import BaseOrder, BaseOrderItem, BasePayment
+from garpix_order.models import BaseOrder, BaseOrderItem, BasePayment, AbstractSberPayment
 
 
 class ExamplePage(BasePage):
@@ -25,6 +25,10 @@ class Service(BaseOrderItem):
         self.is_paid = True
         self.save()
 
+    @classmethod
+    def bulk_pay(cls, items):
+        items.update(is_paid=True)
+
     class Meta:
         verbose_name = 'Услуга'
         verbose_name_plural = 'Услуги'
@@ -34,3 +38,9 @@ class Invoice(BasePayment):
     class Meta:
         verbose_name = 'Платеж'
         verbose_name_plural = 'Платежи'
+
+
+class SberPayment(AbstractSberPayment):
+    class Meta(AbstractSberPayment.Meta):
+        verbose_name = 'Платеж в Сбере'
+        verbose_name_plural = 'Платежи в Сбере'
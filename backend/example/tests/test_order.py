@@ -1,3 +1,5 @@
+from unittest import mock
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from ..models import Order, Service, Invoice
@@ -12,8 +14,8 @@ class OrderTestCase(TestCase):
         self.user.save()
         self.total_price = 1000
         self.quantity = 2
-        self.order = Order.objects.create(number='#test', user=self.user, total_amount=self.total_price * self.quantity)
-        self.service = Service.objects.create(order=self.order, amount=self.total_price, quantity=self.quantity)
+        self.order = Order.objects.create(number='#test', user=self.user)
+        self.service, = self.order.add_items([Service(amount=self.total_price, quantity=self.quantity)])
 
     def test_amount(self):
         order = self.order
@@ -25,3 +27,29 @@ class OrderTestCase(TestCase):
         invoice.pending()
         invoice.succeeded()
         self.assertEqual(order.payed_amount, self.total_price * self.quantity)
+
+    def test_bulk_items(self):
+        order = Order.objects.create(number='#bulk', user=self.user)
+        services = order.add_items(Service(amount=10, quantity=i + 1) for i in range(50))
+        self.assertEqual(order.total_amount, 10 * sum(range(1, 51)))
+        self.assertEqual(Service.objects.filter(order=order).count(), 50)
+        self.assertTrue(all(service.pk for service in services))
+
+        order.remove_items(services[10:])
+        self.assertEqual(order.total_amount, 10 * sum(range(1, 11)))
+
+        services[0].amount = 100
+        order.replace_items([services[0], Service(amount=5, quantity=2)])
+        self.assertEqual(order.total_amount, 110)
+        self.assertEqual(set(order.items_all().values_list('amount', flat=True)), {100, 5})
+        self.assertTrue(all(isinstance(item, Service) for item in order.items_all()))
+
+    def test_fulfillment(self):
+        """Проверяем, что при полной оплате все услуги отмечаются оплаченными одним UPDATE"""
+        order = Order.objects.create(number='#fulfillment', user=self.user)
+        order.add_items(Service(amount=10) for _ in range(20))
+        invoice = Invoice.objects.create(title='fulfillment', order=order, amount=order.total_amount)
+        with mock.patch.object(Service, 'pay') as pay:
+            invoice.succeeded()
+        pay.assert_not_called()
+        self.assertFalse(Service.objects.filter(order=order, is_paid=False).exists())
@@ -0,0 +1,3 @@
+from .changelist import FastChangeListMixin  # noqa
+from .export import ExportActionsMixin  # noqa
+from .home_page import PaymentRollupAdmin  # noqa
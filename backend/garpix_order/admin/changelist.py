@@ -0,0 +1,130 @@
+import json
+
+from django.conf import settings
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.utils.functional import cached_property
+
+
+CURSOR_VAR = 'cursor'
+
+DEFAULT_ADMIN_SETTINGS = {
+    # Начиная с какой оценки количество строк в списке не пересчитывается точно (только PostgreSQL)
+    'estimate_count_threshold': 10000,
+}
+
+
+def get_admin_settings() -> dict:
+    return {**DEFAULT_ADMIN_SETTINGS, **getattr(settings, 'GARPIX_ORDER_ADMIN', {})}
+
+
+def estimate_count(queryset):
+    """
+    Оценка количества строк выборки по статистике PostgreSQL: для выборки без фильтров - reltuples таблицы,
+    иначе - оценка планировщика из EXPLAIN. Для других СУБД возвращает None.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            return int(row[0]) if row else None
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator, который для больших выборок берет количество строк из статистики PostgreSQL вместо COUNT(*).
+    Небольшие выборки (и выборки на других СУБД) считаются точно.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < get_admin_settings()['estimate_count_threshold']:
+            return super().count
+        return estimate
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Список с переходом к следующей странице по ключу: параметр cursor ограничивает выборку условием pk < cursor,
+    поэтому дальние страницы читаются по индексу, без OFFSET. Работает, пока список не отсортирован
+    по колонке (параметр o), иначе используются обычные номера страниц.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_cursor(self):
+        if ORDER_VAR in self.params:
+            return None
+        try:
+            return int(self.params[CURSOR_VAR])
+        except (KeyError, ValueError):
+            return None
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        cursor = self.get_cursor()
+        if cursor is not None:
+            queryset = queryset.filter(pk__lt=cursor)
+        return queryset
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.next_cursor_url = None
+        if ORDER_VAR in self.params or not self.multi_page:
+            return
+        self.result_list = list(self.result_list)
+        if len(self.result_list) == self.list_per_page:
+            self.next_cursor_url = self.get_query_string({CURSOR_VAR: self.result_list[-1].pk}, [PAGE_VAR])
+
+
+class FastChangeListMixin:
+    """
+    Быстрый список объектов для больших таблиц (BasePayment, BaseOrder и т.п.):
+
+    - количество строк для больших выборок оценивается по статистике PostgreSQL, полный COUNT(*) без фильтров
+      не выполняется (show_full_result_count = False);
+    - ссылка «Следующие» переходит к следующей странице по ключу (pk < последнего на странице) без OFFSET;
+    - полиморфные объекты в списке не приводятся к классам наследников (polymorphic_list = False),
+      объект наследника загружается только на странице редактирования;
+    - по умолчанию select_related выполняется только для внешних ключей из list_display,
+      а все внешние ключи в формах редактируются виджетом raw_id.
+    """
+    show_full_result_count = False
+    polymorphic_list = False
+    paginator = EstimatedCountPaginator
+    ordering = ('-pk',)
+    change_list_template = 'admin/garpix_order/fast_change_list.html'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.raw_id_fields:
+            self.raw_id_fields = tuple(
+                field.name for field in self.model._meta.fields
+                if isinstance(field, models.ForeignKey) and not field.remote_field.parent_link
+                and field.name != 'polymorphic_ctype'
+            )
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_list_select_related(self, request):
+        if self.list_select_related is not False:
+            return self.list_select_related
+        foreign_keys = {
+            field.name for field in self.model._meta.fields if isinstance(field, models.ForeignKey)
+        }
+        return [name for name in self.get_list_display(request) if name in foreign_keys]
@@ -0,0 +1,69 @@
+import tempfile
+
+from django.contrib import messages
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from garpix_order.services.export import data_exporter
+
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def _filename(queryset, fmt: str) -> str:
+    return f'{queryset.model._meta.model_name}_{timezone.now():%Y%m%d_%H%M%S}.{fmt}'
+
+
+def export_queryset_response(modeladmin, request, queryset, fmt: str):
+    """
+    Ответ с выгрузкой выбранных объектов. CSV и JSONL отдаются потоком по мере чтения из БД,
+    Parquet собирается во временном файле (в памяти держится не больше 10 МБ) и отдается файлом.
+    """
+    queryset = queryset.order_by('pk')
+    if fmt == 'parquet':
+        output = tempfile.SpooledTemporaryFile(max_size=10 * 1024 * 1024)
+        try:
+            data_exporter.export(queryset, fmt, output)
+        except ImproperlyConfigured as e:
+            output.close()
+            modeladmin.message_user(request, str(e), messages.ERROR)
+            return None
+        output.seek(0)
+        return FileResponse(output, as_attachment=True, filename=_filename(queryset, fmt))
+
+    response = StreamingHttpResponse(data_exporter.iter_export(queryset, fmt), content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{_filename(queryset, fmt)}"'
+    return response
+
+
+def export_csv(modeladmin, request, queryset):
+    return export_queryset_response(modeladmin, request, queryset, 'csv')
+
+
+export_csv.short_description = 'Выгрузить в CSV'
+
+
+def export_jsonl(modeladmin, request, queryset):
+    return export_queryset_response(modeladmin, request, queryset, 'jsonl')
+
+
+export_jsonl.short_description = 'Выгрузить в JSONL'
+
+
+def export_parquet(modeladmin, request, queryset):
+    return export_queryset_response(modeladmin, request, queryset, 'parquet')
+
+
+export_parquet.short_description = 'Выгрузить в Parquet'
+
+
+class ExportActionsMixin:
+    """
+    Действия выгрузки для админки платежей, заказов и позиций заказов.
+    Полиморфные наследники выгружаются вместе с полями своих таблиц.
+    """
+    actions = (export_csv, export_jsonl, export_parquet)
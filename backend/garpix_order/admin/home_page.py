@@ -1,2 +1,33 @@
-from garpix_page.admin import BasePageAdmin
 from django.contrib import admin
+from django.template.response import TemplateResponse
+
+from garpix_order.models import PaymentRollup
+from garpix_order.services.rollup import payment_rollups
+
+
+@admin.register(PaymentRollup)
+class PaymentRollupAdmin(admin.ModelAdmin):
+    """
+    Панель показателей по платежам вместо списка сводок. Все показатели считаются по таблице PaymentRollup,
+    поэтому время построения страницы не зависит от количества платежей.
+    """
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': self.model._meta.verbose_name_plural,
+            'enabled': payment_rollups.enabled,
+            **payment_rollups.get_dashboard(),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'admin/garpix_order/paymentrollup/dashboard.html', context)
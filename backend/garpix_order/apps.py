@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class GarpixOrderConfig(AppConfig):
     name = 'garpix_order'
     verbose_name = 'Garpix Order'
+
+    def ready(self):
+        from . import receivers  # noqa
+        from .registry import payment_registry
+        payment_registry.configure()
@@ -0,0 +1,342 @@
+import gc
+import json
+import math
+import platform
+import statistics
+import subprocess
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from urllib.parse import urlencode
+
+import django
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.http import JsonResponse
+from django.test import Client
+from django.utils import timezone
+
+from .models import BaseOrder, BaseOrderItem, CashPayment, CloudPayment, Config
+from .registry import payment_registry
+from .services.robokassa import RobokassaService
+from .utils import bulk_create_polymorphic, hmac_sha256
+from .views import cloudpayments as cloudpayments_views
+
+
+BENCHMARKS = {}
+
+
+def register(benchmark_class):
+    """Добавляет замер в набор, который выполняет команда run_benchmarks"""
+    BENCHMARKS[benchmark_class.name] = benchmark_class
+    return benchmark_class
+
+
+class Benchmark:
+    """
+    Замер горячего пути. setup готовит данные для runs вызовов run (прогрев и замеры),
+    каждый вызов run(i) использует свои данные с индексом i, поэтому состояние между замерами не переносится.
+    Один замер - number вызовов run подряд, в результат попадает время одного вызова.
+    """
+    name = ''
+    description = ''
+    number = 1
+
+    def __init__(self, user) -> None:
+        self.user = user
+        self.prefix = uuid.uuid4().hex[:8]
+
+    def setup(self, runs: int) -> None:
+        pass
+
+    def run(self, i: int) -> None:
+        raise NotImplementedError
+
+    def teardown(self) -> None:
+        pass
+
+    def make_orders(self, count: int, items: int = 0, amount: int = 100) -> list:
+        """Заказы на сумму amount с items позициями каждый"""
+        orders = [BaseOrder(number=f'{self.prefix}-{i}', user=self.user, total_amount=amount) for i in range(count)]
+        bulk_create_polymorphic(orders)
+        if items:
+            bulk_create_polymorphic([
+                BaseOrderItem(order=order, amount=Decimal(amount) / items) for order in orders for _ in range(items)
+            ])
+        return orders
+
+
+@register
+class OrderPayBenchmark(Benchmark):
+    name = 'order_pay'
+    description = 'Полная оплата заказа с 5 позициями: BasePayment.succeeded -> BaseOrder.pay'
+
+    def setup(self, runs: int) -> None:
+        orders = self.make_orders(runs, items=5)
+        self.payments = bulk_create_polymorphic([
+            CashPayment(title=f'{self.prefix}-{i}', order=order, amount=order.total_amount)
+            for i, order in enumerate(orders)
+        ])
+
+    def run(self, i: int) -> None:
+        payment = self.payments[i]
+        payment.succeeded()
+        payment.save()
+
+
+@register
+class SplitOrderBenchmark(Benchmark):
+    name = 'split_order'
+    description = 'Выделение позиции из заказа с 5 позициями в новый заказ: BaseOrder.split_order'
+
+    def setup(self, runs: int) -> None:
+        orders = self.make_orders(runs, items=5)
+        items = {}
+        for item in BaseOrderItem.objects.filter(order__in=orders).order_by('pk'):
+            items.setdefault(item.order_id, item)
+        self.items = [items[order.pk] for order in orders]
+
+    def run(self, i: int) -> None:
+        if BaseOrder.split_order(f'{self.prefix}-split-{i}', self.items[i]) is None:
+            raise RuntimeError('split_order не выделил позицию')
+
+
+@register
+class CloudPaymentsWebhookBenchmark(Benchmark):
+    name = 'cloudpayments_webhook'
+    description = 'Уведомление CloudPayments Pay через тестовый клиент Django: подпись, блокировка, переход статуса'
+    url = '/cloudpayments/pay/'
+    password = 'benchmark'
+
+    signature_header = 'HTTP_CONTENT_HMAC'
+
+    def setup(self, runs: int) -> None:
+        config = Config.get_solo()
+        config.cloudpayments_password_api = self.password
+        config.save()
+        Config.invalidate_cache()
+
+        orders = self.make_orders(runs)
+        bulk_create_polymorphic([
+            CloudPayment(title=order.number, order=order, order_number=order.number, payment_uuid=order.number,
+                         amount=order.total_amount)
+            for order in orders
+        ])
+        self.notifications = []
+        for order in orders:
+            body = urlencode({
+                'InvoiceId': order.number,
+                'Amount': '100.00',
+                'TransactionId': order.number,
+                'Status': CloudPayment.PAYMENT_STATUS_COMPLETED,
+            })
+            self.notifications.append((body, hmac_sha256(body, self.password).decode('utf-8')))
+        self.client = Client()
+
+    def run(self, i: int) -> None:
+        body, signature = self.notifications[i]
+        response = self.client.post(
+            self.url, body, content_type='application/x-www-form-urlencoded', **{self.signature_header: signature}
+        )
+        if response.status_code != 200 or response.json().get('code') != 0:
+            raise RuntimeError(f'Unexpected response: {response.status_code} {response.content!r}')
+
+    def teardown(self) -> None:
+        Config.invalidate_cache()
+
+
+def baseline_cloudpayments_pay_view(request) -> JsonResponse:
+    """
+    Обработка уведомления Pay до однопроходного обработчика (CloudpaymentView.pay_view через _get_response_data
+    и _default_view): настройки читаются из БД, подпись считается по параметрам request.POST, ответ кодируется в JSON
+    и разбирается обратно, платеж загружается второй раз. Чтобы замер выполнял ту же работу, что и текущий
+    обработчик, статус меняется переходом succeeded (раньше в поле записывался статус CloudPayments и заказ
+    не оплачивался), а сумма берется из amount (раньше - из несуществующего поля price).
+    """
+    config = Config.get_solo()
+    hmac_data = '&'.join(f'{item}={request.POST[item]}' for item in request.POST)
+    local_hmac = hmac_sha256(hmac_data, config.cloudpayments_password_api).decode('utf-8')
+    response = JsonResponse({'code': 13, 'order_number': None})
+    if len(request.POST) > 1 and local_hmac == request.headers.get('x-content-hmac'):
+        payment = CloudPayment.objects.get(payment_uuid=request.POST.get('InvoiceId'))
+        if payment.amount != Decimal(request.POST.get('Amount')):
+            response = JsonResponse({'code': 12, 'order_number': payment.order_number})
+        else:
+            payment.succeeded()
+            payment.is_test = request.POST.get('TestMode') == '1'
+            payment.transaction_id = request.POST.get('TransactionId', '')
+            payment.save()
+            response = JsonResponse({'code': 0, 'order_number': payment.order_number})
+
+    response_data = json.loads(response.content.decode('utf8'))
+    if response_data['code'] != 0:
+        return JsonResponse({'code': 13, 'order_number': None})
+    payment = CloudPayment.objects.get(order_number=response_data['order_number'])
+    callback = payment_registry.status_changed_callback
+    if callback is not None:
+        callback(payment)
+    return JsonResponse({'code': 0, 'detail': 'Платеж проведен.', 'order_number': payment.order_number})
+
+
+@register
+class CloudPaymentsWebhookBaselineBenchmark(CloudPaymentsWebhookBenchmark):
+    name = 'cloudpayments_webhook_baseline'
+    description = 'То же уведомление, обработанное по пути до однопроходного обработчика: ' \
+                  'для сравнения с cloudpayments_webhook'
+    signature_header = 'HTTP_X_CONTENT_HMAC'
+
+    def setup(self, runs: int) -> None:
+        super().setup(runs)
+        # Запрос проходит тот же адрес и middleware, меняется только обработчик
+        self.handler = cloudpayments_views.handle_notification
+        cloudpayments_views.handle_notification = lambda request, status=None: baseline_cloudpayments_pay_view(request)
+
+    def teardown(self) -> None:
+        cloudpayments_views.handle_notification = self.handler
+        super().teardown()
+
+
+@register
+class RobokassaSignatureBenchmark(Benchmark):
+    name = 'robokassa_signature'
+    description = 'Подпись ссылки Robokassa: RobokassaService.calculate_signature'
+    number = 1000
+
+    def run(self, i: int) -> None:
+        RobokassaService.calculate_signature(RobokassaService.login, '1234.50', i, RobokassaService.password_1)
+
+
+@contextmanager
+def execute_on_commit(using: str = None):
+    """
+    Выполняет функции transaction.on_commit, добавленные в блоке, при выходе из него, как
+    TestCase.captureOnCommitCallbacks(execute=True) из Django 3.2. Замеры идут в транзакции, которая откатывается,
+    поэтому без этого работа после фиксации (сводки, callback статуса, сброс кэша настроек) не выполнялась бы.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    start = len(connection.run_on_commit)
+    try:
+        yield
+    finally:
+        # Функция может добавить новые функции, выполняем и их
+        while len(connection.run_on_commit) > start:
+            callbacks = connection.run_on_commit[start:]
+            del connection.run_on_commit[start:]
+            for callback in callbacks:
+                callback[1]()
+
+
+def percentile(values: list, q: float) -> float:
+    """Перцентиль q (0..100) по методу ближайшего ранга, values отсортированы"""
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+def summarize(timings: list) -> dict:
+    """Статистика замеров в секундах на вызов"""
+    timings = sorted(timings)
+    mean = statistics.mean(timings)
+    return {
+        'samples': len(timings),
+        'min': timings[0],
+        'max': timings[-1],
+        'mean': mean,
+        'median': statistics.median(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'ops_per_sec': 1 / mean if mean else 0.0,
+    }
+
+
+def get_environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+        'created_at': timezone.now().isoformat(),
+    }
+
+
+class BenchmarkRunner:
+    """
+    Выполняет замеры на фоновых данных объемом scale заказов с платежами. Все данные создаются в транзакции,
+    которая откатывается по завершении, каждый замер (number вызовов run) выполняется в своей точке сохранения.
+    Функции transaction.on_commit, добавленные вызовами run, выполняются сразу после них и входят во время замера.
+    """
+
+    def __init__(self, samples: int = 200, warmup: int = 20, scale: int = 10000) -> None:
+        self.samples = samples
+        self.warmup = warmup
+        self.scale = scale
+
+    def make_background(self, user) -> None:
+        orders = [BaseOrder(number=f'background-{i}', user=user, total_amount=100) for i in range(self.scale)]
+        for start in range(0, len(orders), 1000):
+            chunk = bulk_create_polymorphic(orders[start:start + 1000])
+            bulk_create_polymorphic([CashPayment(title=order.number, order=order, amount=100) for order in chunk])
+
+    def run_benchmark(self, benchmark: Benchmark) -> dict:
+        runs = self.warmup + self.samples
+        try:
+            with transaction.atomic():
+                with execute_on_commit():
+                    benchmark.setup(runs)
+                for i in range(self.warmup):
+                    self.measure(benchmark, i)
+                gc.collect()
+                timings = [self.measure(benchmark, i) for i in range(self.warmup, runs)]
+                transaction.set_rollback(True)
+        finally:
+            benchmark.teardown()
+        return {'description': benchmark.description, 'number': benchmark.number, **summarize(timings)}
+
+    @staticmethod
+    def measure(benchmark: Benchmark, i: int) -> float:
+        """Время одного вызова run(i) вместе с его функциями on_commit"""
+        with transaction.atomic():
+            started_at = time.perf_counter()
+            with execute_on_commit():
+                for _ in range(benchmark.number):
+                    benchmark.run(i)
+            return (time.perf_counter() - started_at) / benchmark.number
+
+    def run(self, names: list = None, on_result=None) -> dict:
+        """Выполняет замеры names (все, если не заданы) и возвращает результаты для сохранения в JSON"""
+        results = {}
+        with transaction.atomic():
+            user = get_user_model().objects.create(username=f'garpix-order-benchmark-{uuid.uuid4().hex[:8]}')
+            self.make_background(user)
+            for name in names or BENCHMARKS:
+                results[name] = self.run_benchmark(BENCHMARKS[name](user))
+                if on_result is not None:
+                    on_result(name, results[name])
+            transaction.set_rollback(True)
+        return {
+            'environment': get_environment(),
+            'parameters': {'samples': self.samples, 'warmup': self.warmup, 'scale': self.scale},
+            'results': results,
+        }
+
+
+def compare(results: dict, baseline: dict, metric: str = 'median') -> dict:
+    """Относительное изменение metric по замерам, которые есть в обоих результатах (0.1 - на 10% медленнее)"""
+    changes = {}
+    for name, result in results['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if previous and previous.get(metric):
+            changes[name] = result[metric] / previous[metric] - 1
+    return changes
+
+
+def load_results(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
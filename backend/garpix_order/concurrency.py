@@ -0,0 +1,47 @@
+import threading
+
+from django.conf import settings
+
+
+def get_optimistic_retries() -> int:
+    return getattr(settings, 'GARPIX_ORDER_OPTIMISTIC_RETRIES', 5)
+
+
+class ConflictStats:
+    """
+    Счетчики оптимистичных изменений заказов в текущем процессе: попытки, конфликты версий
+    и операции, для которых не хватило повторов.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.attempts = 0
+            self.conflicts = 0
+            self.exhausted = 0
+
+    def add(self, attempts: int = 0, conflicts: int = 0, exhausted: int = 0) -> None:
+        with self._lock:
+            self.attempts += attempts
+            self.conflicts += conflicts
+            self.exhausted += exhausted
+
+    @property
+    def conflict_rate(self) -> float:
+        if not self.attempts:
+            return 0.0
+        return self.conflicts / self.attempts
+
+    def as_dict(self) -> dict:
+        return {
+            'attempts': self.attempts,
+            'conflicts': self.conflicts,
+            'exhausted': self.exhausted,
+            'conflict_rate': round(self.conflict_rate, 4),
+        }
+
+
+conflict_stats = ConflictStats()
@@ -15,3 +15,8 @@ class InvalidModelPaymentException(BasePaymentException):
 class InvalidOrderStatusPaymentException(BasePaymentException):
     def __init__(self, message="Неподдерживаемый статус заказа."):
         super().__init__(message)
+
+
+class OrderVersionConflictException(Exception):
+    def __init__(self, message="Заказ был изменен параллельно, версия не совпадает."):
+        super().__init__(message)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from garpix_order.services.rollup import payment_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводки по платежам (PaymentRollup) за период или за все время'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='Первый день периода, YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', help='Последний день периода, YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        days = {}
+        for option in ('date_from', 'date_to'):
+            if options[option]:
+                days[option] = parse_date(options[option])
+                if days[option] is None:
+                    raise CommandError(f'Неверная дата: {options[option]}')
+        created = payment_rollups.backfill(**days)
+        self.stdout.write(self.style.SUCCESS(f'Строк сводки: {created}'))
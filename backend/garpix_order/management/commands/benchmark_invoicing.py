@@ -0,0 +1,54 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from garpix_order.models import BaseOrder, RobokassaPayment
+from garpix_order.services.invoicing import MassInvoicingService
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает выставление счетов Robokassa по одному заказу и пакетно (заказов в секунду). ' \
+           'Данные создаются в транзакции, которая откатывается по завершении замера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000, help='Количество заказов')
+        parser.add_argument('--chunk-size', type=int, help='Размер порции пакетного выставления')
+
+    def make_orders(self, count: int, prefix: str):
+        user = get_user_model().objects.create(username=f'garpix-order-{prefix}')
+        BaseOrder.objects.bulk_create([
+            BaseOrder(number=f'{prefix}-{i}', user=user, total_amount=100 + i % 100) for i in range(count)
+        ])
+        return BaseOrder.objects.filter(user=user)
+
+    def invoice_one_by_one(self, orders) -> int:
+        links = []
+        for order in orders.non_polymorphic().order_by('pk'):
+            payment = RobokassaPayment.objects.create(
+                title=f'Платеж по заказу № {order.pk}', order=order, amount=order.total_amount
+            )
+            links.append(payment.generate_payment_link())
+        return len(links)
+
+    def handle(self, *args, **options):
+        count = options['orders']
+        with transaction.atomic():
+            orders = self.make_orders(count, 'loop')
+            started_at = time.perf_counter()
+            self.invoice_one_by_one(orders)
+            loop_elapsed = time.perf_counter() - started_at
+
+            orders = self.make_orders(count, 'batch')
+            started_at = time.perf_counter()
+            result = MassInvoicingService(chunk_size=options['chunk_size']).invoice_robokassa(orders)
+            batch_elapsed = time.perf_counter() - started_at
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f'orders: {count}, one by one: {count / loop_elapsed:.1f} orders/s, '
+            f'batch: {len(result.links) / batch_elapsed:.1f} orders/s, '
+            f'speedup: {loop_elapsed / batch_elapsed:.1f}x'
+        )
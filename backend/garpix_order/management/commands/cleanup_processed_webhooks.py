@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from garpix_order.services.deduplication import webhook_deduplicator
+
+
+class Command(BaseCommand):
+    help = 'Удаляет записи об обработанных уведомлениях провайдеров старше срока хранения ' \
+           '(GARPIX_ORDER_WEBHOOK_DEDUP["retention"])'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, help='Срок хранения в днях вместо значения из настроек')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество записей, удаляемых за раз')
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['retention_days']) if options['retention_days'] is not None else None
+        deleted = webhook_deduplicator.cleanup(retention=retention, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено уведомлений: {deleted}'))
@@ -0,0 +1,57 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from garpix_order.services.export import data_exporter
+
+
+def parse_border(value: str):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'Неверная дата: {value}')
+        moment = timezone.datetime(day.year, day.month, day.day)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка платежей, заказов или позиций заказов в CSV, JSONL или Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(data_exporter.models), help='Что выгружать')
+        parser.add_argument('--format', default='csv', choices=sorted(data_exporter.writers), help='Формат выгрузки')
+        parser.add_argument('--output', help='Файл для выгрузки (по умолчанию stdout, кроме parquet)')
+        parser.add_argument('--from', dest='created_from', help='Дата создания от (включительно), YYYY-MM-DD[THH:MM]')
+        parser.add_argument('--to', dest='created_to', help='Дата создания до (не включительно), YYYY-MM-DD[THH:MM]')
+        parser.add_argument('--chunk-size', type=int, help='Количество строк, читаемых из БД за раз')
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        writer_class = data_exporter.writers[fmt]
+        if writer_class.binary and not options['output']:
+            raise CommandError(f'Для формата {fmt} укажите --output')
+
+        queryset = data_exporter.get_queryset(
+            options['model'],
+            created_from=parse_border(options['created_from']) if options['created_from'] else None,
+            created_to=parse_border(options['created_to']) if options['created_to'] else None,
+        )
+        if options['output']:
+            mode, kwargs = ('wb', {}) if writer_class.binary else ('w', {'encoding': 'utf-8', 'newline': ''})
+            stream = open(options['output'], mode, **kwargs)
+        else:
+            stream = self.stdout._out  # пишем в поток напрямую, без обработки строк OutputWrapper
+
+        try:
+            count = data_exporter.export(queryset, fmt, stream, chunk_size=options['chunk_size'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        finally:
+            if options['output']:
+                stream.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f'Выгружено строк: {count}'))
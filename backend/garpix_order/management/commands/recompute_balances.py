@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from garpix_order.models import BaseOrder, BasePayment
+
+
+PaymentStatus = BasePayment.PaymentStatus
+
+
+def payments_sum(*statuses):
+    return Coalesce(
+        Sum('payments__amount', filter=Q(payments__status__in=statuses)),
+        Value(0),
+        output_field=DecimalField(**BaseOrder.decimalfield_kwargs)
+    )
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счетчики оплаты заказов (payed_amount, refunded_amount, pending_amount) ' \
+           'с агрегатами по платежам и исправляет расхождения'
+
+    fields = ('payed_amount', 'refunded_amount', 'pending_amount')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество заказов в одной пачке')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения, ничего не сохраняя')
+
+    def get_queryset(self):
+        return BaseOrder.objects.non_polymorphic().annotate(
+            succeeded_total=payments_sum(PaymentStatus.SUCCEEDED),
+            refunded_total=payments_sum(PaymentStatus.REFUNDED),
+            pending_total=payments_sum(*PaymentStatus.IN_PROGRESS),
+        ).order_by('pk')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        checked = repaired = 0
+        last_pk = 0
+
+        while True:
+            batch = list(self.get_queryset().filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            checked += len(batch)
+
+            drifted = []
+            for order in batch:
+                expected = {
+                    'payed_amount': order.succeeded_total - order.refunded_total,
+                    'refunded_amount': order.refunded_total,
+                    'pending_amount': order.pending_total,
+                }
+                if all(getattr(order, field) == value for field, value in expected.items()):
+                    continue
+                self.stdout.write(f'Заказ {order.pk}{" (будет исправлен)" if dry_run else ""}: ' + ', '.join(
+                    f'{field} {getattr(order, field)} -> {value}' for field, value in expected.items()
+                ))
+                for field, value in expected.items():
+                    setattr(order, field, value)
+                drifted.append(order)
+
+            repaired += len(drifted)
+            if drifted and not dry_run:
+                with transaction.atomic():
+                    BaseOrder.objects.bulk_update(drifted, self.fields)
+
+        result = 'будет исправлено (--dry-run, изменения не сохранены)' if dry_run else 'исправлено'
+        self.stdout.write(self.style.SUCCESS(f'Проверено заказов: {checked}, {result}: {repaired}'))
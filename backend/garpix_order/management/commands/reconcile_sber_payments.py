@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from garpix_order.services.sber_reconciliation import SberReconciliationService
+
+
+class Command(BaseCommand):
+    help = 'Запрашивает в Сбере статусы незавершенных платежей и применяет изменения (на случай потерянных callback)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help='Количество платежей, загружаемых из БД за один раз')
+        parser.add_argument('--concurrency', type=int, help='Максимальное количество одновременных запросов')
+        parser.add_argument('--rate-limit', type=float, help='Максимальное количество запросов в секунду')
+
+    def handle(self, *args, **options):
+        report = SberReconciliationService(
+            chunk_size=options['chunk_size'],
+            concurrency=options['concurrency'],
+            rate_limit=options['rate_limit'],
+        ).run()
+        self.stdout.write(self.style.SUCCESS(
+            'Проверено: {checked}, изменено: {changed}, ошибок: {failed}, время: {elapsed} с, '
+            'платежей в секунду: {throughput}, максимальное отставание: {max_lag} с'.format(**report.as_dict())
+        ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from garpix_order.services.settlement import SettlementReconciliationService
+
+
+class Command(BaseCommand):
+    help = 'Сверяет платежи с суточным реестром провайдера (CloudPayments, Robokassa) и выводит расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('provider', choices=sorted(SettlementReconciliationService.providers), help='Провайдер')
+        parser.add_argument('registry', help='Файл реестра (CSV)')
+        parser.add_argument('--date', required=True, help='Дата реестра, YYYY-MM-DD')
+        parser.add_argument('--output', help='Файл для расхождений (CSV)')
+        parser.add_argument('--apply', action='store_true',
+                            help='Перевести в SUCCEEDED платежи, найденные в реестре, но не оплаченные у нас')
+        parser.add_argument('--apply-batch-size', type=int, help='Количество платежей, исправляемых в одной транзакции')
+
+    def handle(self, *args, **options):
+        registry_date = parse_date(options['date'])
+        if registry_date is None:
+            raise CommandError(f'Неверная дата: {options["date"]}')
+
+        service = SettlementReconciliationService(options['provider'], apply_batch_size=options['apply_batch_size'])
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else None
+        try:
+            with open(options['registry'], encoding=service.registry['encoding'], newline='') as registry:
+                report = service.reconcile(registry, registry_date, apply=options['apply'], discrepancies=output)
+        finally:
+            if output is not None:
+                output.close()
+        self.stdout.write(self.style.SUCCESS(
+            'Платежей: {payments}, строк реестра: {rows}, сопоставлено: {matched}, нет в реестре: {missing}, '
+            'нет у нас: {extra}, расхождение суммы: {amount}, не оплачено у нас: {unconfirmed}, '
+            'исправлено: {corrected}, ошибок: {failed}, время: {elapsed} с'.format(**report.as_dict())
+        ))
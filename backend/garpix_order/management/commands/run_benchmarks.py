@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from garpix_order.benchmarks import BENCHMARKS, BenchmarkRunner, compare, load_results
+
+
+def format_seconds(value: float) -> str:
+    if value < 0.001:
+        return f'{value * 1000000:.2f} us'
+    return f'{value * 1000:.2f} ms'
+
+
+class Command(BaseCommand):
+    help = 'Замеры горячих путей (оплата заказа, split_order, уведомления CloudPayments, подпись Robokassa) ' \
+           'с прогревом и статистикой. Данные создаются в транзакции, которая откатывается по завершении замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmarks', nargs='*',
+                            help=f'Какие замеры выполнить (по умолчанию все): {", ".join(BENCHMARKS)}')
+        parser.add_argument('--samples', type=int, default=200, help='Количество замеров')
+        parser.add_argument('--warmup', type=int, default=20, help='Количество вызовов для прогрева')
+        parser.add_argument('--scale', type=int, default=10000, help='Количество фоновых заказов с платежами в БД')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument('--compare', help='JSON с результатами предыдущего запуска для сравнения медиан')
+        parser.add_argument('--max-regression', type=float,
+                            help='Допустимое замедление медианы относительно --compare, например 0.1 (10%%)')
+
+    def print_result(self, name: str, result: dict) -> None:
+        self.stdout.write(
+            f'{name}: median {format_seconds(result["median"])}, p95 {format_seconds(result["p95"])}, '
+            f'p99 {format_seconds(result["p99"])}, {result["ops_per_sec"]:.1f} ops/s'
+        )
+
+    def handle(self, *args, **options):
+        if options['max_regression'] is not None and not options['compare']:
+            raise CommandError('--max-regression используется вместе с --compare')
+        unknown = set(options['benchmarks']) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f'Неизвестные замеры: {", ".join(sorted(unknown))}')
+        baseline = load_results(options['compare']) if options['compare'] else None
+
+        runner = BenchmarkRunner(samples=options['samples'], warmup=options['warmup'], scale=options['scale'])
+        results = runner.run(options['benchmarks'] or None, on_result=self.print_result)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Результаты сохранены в {options["output"]}'))
+
+        if baseline is None:
+            return
+        if baseline.get('parameters') != results['parameters']:
+            self.stdout.write(self.style.WARNING(
+                f'Параметры запусков отличаются: {baseline.get("parameters")} и {results["parameters"]}'
+            ))
+        changes = compare(results, baseline)
+        for name, change in changes.items():
+            self.stdout.write(f'{name}: {change:+.1%} к {baseline["environment"].get("commit") or options["compare"]}')
+        regressions = {
+            name: change for name, change in changes.items()
+            if options['max_regression'] is not None and change > options['max_regression']
+        }
+        if regressions:
+            raise CommandError(f'Замедление больше {options["max_regression"]:.0%}: ' +
+                               ', '.join(f'{name} {change:+.1%}' for name, change in regressions.items()))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from garpix_order.services.webhook_ingestion import webhook_ingestion
+
+
+class Command(BaseCommand):
+    help = 'Показывает очередь уведомлений провайдеров: необработанные события, ошибки и отставание обработки'
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            'Ожидают обработки: {pending}, с ошибкой: {failed}, отставание: {lag:.1f} с'.format(
+                **webhook_ingestion.get_stats()
+            )
+        )
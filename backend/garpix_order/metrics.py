@@ -0,0 +1,258 @@
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+DEFAULT_METRICS_SETTINGS = {
+    'enabled': False,  # Собирать метрики; выключенные метрики сводятся к одной проверке флага
+    'sink': None,  # Путь к классу приемника метрик (inc, observe, render), по умолчанию - MetricsRegistry процесса
+    'buckets': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),  # Границы гистограмм, секунды
+    'token': None,  # Если задан, /metrics/ требует заголовок Authorization: Bearer <token>
+}
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+# Имя метрики -> (тип, описание)
+METRICS = {
+    'garpix_order_provider_request_seconds': (HISTOGRAM, 'Provider HTTP request duration'),
+    'garpix_order_provider_request_errors_total': (COUNTER, 'Provider HTTP requests failed or answered with 4xx/5xx'),
+    'garpix_order_provider_error_codes_total': (COUNTER, 'Provider responses with non-zero errorCode'),
+    'garpix_order_webhook_seconds': (HISTOGRAM, 'Webhook handler duration'),
+    'garpix_order_webhook_responses_total': (COUNTER, 'Webhook handler responses by status code'),
+    'garpix_order_transitions_total': (COUNTER, 'FSM transitions'),
+    'garpix_order_optimistic_attempts_total': (COUNTER, 'Optimistic order updates attempted'),
+    'garpix_order_optimistic_conflicts_total': (COUNTER, 'Optimistic order updates with version conflict'),
+    'garpix_order_optimistic_exhausted_total': (COUNTER, 'Optimistic order updates out of retries'),
+}
+
+
+def get_metrics_settings() -> dict:
+    return {**DEFAULT_METRICS_SETTINGS, **getattr(settings, 'GARPIX_ORDER_METRICS', {})}
+
+
+def endpoint_label(url: str) -> str:
+    """Метка endpoint для запроса к провайдеру: последний сегмент пути (register.do, getOrderStatusExtended.do)"""
+    return urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1] or '/'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class MetricsRegistry:
+    """
+    Счетчики и гистограммы в памяти процесса с выводом в текстовом формате Prometheus.
+    Каждый процесс (воркер uwsgi/gunicorn, Celery) считает свои значения.
+    """
+
+    def __init__(self, buckets=None) -> None:
+        self.buckets = tuple(sorted(buckets or DEFAULT_METRICS_SETTINGS['buckets']))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def inc(self, name: str, value: float, labels: dict) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: dict) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get_value(self, name: str, **labels):
+        """Значение счетчика или количество наблюдений гистограммы (для тестов и отладки)"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key in self._histograms:
+                return self._histograms[key][2]
+            return self._counters.get(key, 0)
+
+    def collect(self) -> dict:
+        """Снимок значений: имя метрики -> [(метки, значение)], для гистограмм значение - (корзины, сумма, количество)"""
+        samples = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append((labels, value))
+            for (name, labels), (buckets, total, count) in self._histograms.items():
+                samples.setdefault(name, []).append((labels, (list(buckets), total, count)))
+        return samples
+
+    def render(self, extra: dict = None) -> str:
+        samples = self.collect()
+        for name, values in (extra or {}).items():
+            samples.setdefault(name, []).extend(values)
+
+        lines = []
+        for name in sorted(samples):
+            kind, description = METRICS.get(name, (COUNTER, ''))
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(samples[name], key=lambda sample: sample[0]):
+                if kind != HISTOGRAM:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+                    continue
+                buckets, total, count = value
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + ('+Inf',), buckets):
+                    cumulative += bucket
+                    lines.append(f'{name}_bucket{_format_labels(labels, (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+                lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, metrics, name: str, labels: dict) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.started_at, **self.labels)
+        return False
+
+
+class Metrics:
+    """
+    Точка входа инструментирования: inc, observe и timer передают значения в приемник из настроек
+    GARPIX_ORDER_METRICS. Настройки читаются один раз и перечитываются при их изменении (override_settings),
+    поэтому при выключенных метриках вызов стоит одной проверки атрибута.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.configure()
+
+    def configure(self) -> None:
+        metrics_settings = get_metrics_settings()
+        sink = None
+        if metrics_settings['enabled']:
+            sink_class = metrics_settings['sink']
+            if sink_class is None:
+                sink = MetricsRegistry(buckets=metrics_settings['buckets'])
+            else:
+                sink = (import_string(sink_class) if isinstance(sink_class, str) else sink_class)()
+        with self._lock:
+            self.sink = sink
+            self.enabled = sink is not None
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if self.enabled:
+            self.sink.inc(name, value, labels)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if self.enabled:
+            self.sink.observe(name, value, labels)
+
+    def timer(self, name: str, **labels):
+        """Контекстный менеджер, записывающий длительность блока в гистограмму name"""
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, name, labels)
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus, вместе со счетчиками оптимистичных блокировок"""
+        if not self.enabled or not hasattr(self.sink, 'render'):
+            return ''
+        from .concurrency import conflict_stats
+
+        stats = conflict_stats.as_dict()
+        return self.sink.render(extra={
+            f'garpix_order_optimistic_{key}_total': [((), stats[key])] for key in ('attempts', 'conflicts', 'exhausted')
+        })
+
+
+metrics = Metrics()
+
+
+@receiver(setting_changed)
+def reconfigure_metrics(setting, **kwargs):
+    if setting == 'GARPIX_ORDER_METRICS':
+        metrics.configure()
+
+
+def instrument_webhook(provider: str):
+    """
+    Декоратор обработчика уведомлений (синхронного или асинхронного): длительность в garpix_order_webhook_seconds
+    и количество ответов по кодам в garpix_order_webhook_responses_total.
+    """
+
+    def decorator(func):
+        handler = func.__name__
+
+        def record(started_at, response):
+            metrics.observe('garpix_order_webhook_seconds', time.perf_counter() - started_at,
+                            provider=provider, handler=handler)
+            metrics.inc('garpix_order_webhook_responses_total', provider=provider, handler=handler,
+                        code=getattr(response, 'status_code', 'error'))
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not metrics.enabled:
+                    return await func(*args, **kwargs)
+                started_at, response = time.perf_counter(), None
+                try:
+                    response = await func(*args, **kwargs)
+                    return response
+                finally:
+                    record(started_at, response)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            started_at, response = time.perf_counter(), None
+            try:
+                response = func(*args, **kwargs)
+                return response
+            finally:
+                record(started_at, response)
+
+        return wrapper
+
+    return decorator
@@ -9,3 +9,6 @@ from .payments import (
     SberPaymentStatus
 )
 from .config import Config
+from .webhook import ProcessedWebhook, WebhookEvent
+from .rollup import PaymentRollup
+from .journal import PaymentEvent
@@ -1,10 +1,49 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from solo.models import SingletonModel
 
 
+CONFIG_VERSION_CACHE_KEY = 'garpix_order:config:version'
+
+# Копия настроек в памяти процесса: сам объект, версия из общего кэша и время, до которого она актуальна
+_process_cache = {'config': None, 'version': None, 'expires_at': 0}
+
+
 class Config(SingletonModel):
     cloudpayments_public_id = models.CharField(max_length=200, verbose_name='publicId из личного кабинета CloudPayments')
     cloudpayments_password_api = models.CharField(max_length=200, default='', verbose_name='Пароль для API из личного кабинета CloudPayments')
 
     def __str__(self):
         return 'Настройки'
+
+    @classmethod
+    def get_cached(cls):
+        """
+        Возвращает настройки из памяти процесса. После истечения GARPIX_ORDER_CONFIG_CACHE_TTL секунд
+        сверяет версию с общим кэшем и перечитывает настройки из БД, только если их изменили.
+        """
+        now = time.monotonic()
+        config = _process_cache['config']
+        if config is not None and now < _process_cache['expires_at']:
+            return config
+
+        version = cache.get(CONFIG_VERSION_CACHE_KEY)
+        if config is None or version != _process_cache['version']:
+            config = cls.get_solo()
+
+        _process_cache.update(
+            config=config,
+            version=version,
+            expires_at=now + getattr(settings, 'GARPIX_ORDER_CONFIG_CACHE_TTL', 5),
+        )
+        return config
+
+    @classmethod
+    def invalidate_cache(cls):
+        """Сбрасывает настройки в памяти текущего процесса и меняет версию в общем кэше для остальных"""
+        cache.set(CONFIG_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        _process_cache.update(config=None, version=None, expires_at=0)
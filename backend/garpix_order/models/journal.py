@@ -0,0 +1,54 @@
+import json
+import zlib
+
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class PaymentEvent(models.Model):
+    """
+    Запись журнала платежа: переход статуса или данные провайдера. Записи только добавляются.
+    Большие данные провайдера хранятся сжатыми в compressed_data.
+    """
+
+    class EventKind(models.TextChoices):
+        TRANSITION = 'transition', _('Переход статуса')
+        PROVIDER_DATA = 'provider_data', _('Данные провайдера')
+
+    payment = models.ForeignKey('garpix_order.BasePayment', on_delete=models.CASCADE, related_name='events',
+                                verbose_name=_('Платеж'))
+    kind = models.CharField(max_length=16, choices=EventKind.choices, verbose_name=_('Тип записи'))
+    name = models.CharField(max_length=64, blank=True, default='', verbose_name=_('Переход'))
+    source = models.CharField(max_length=64, blank=True, default='', verbose_name=_('Исходный статус'))
+    target = models.CharField(max_length=64, blank=True, default='', verbose_name=_('Новый статус'))
+    data = models.JSONField(null=True, blank=True, verbose_name=_('Данные'))
+    compressed_data = models.BinaryField(null=True, blank=True, verbose_name=_('Сжатые данные'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Дата создания'))
+
+    class Meta:
+        verbose_name = _('Запись журнала платежа')
+        verbose_name_plural = _('Журнал платежей')
+        indexes = [
+            models.Index(fields=['payment', 'id'], name='garpix_order_event_pay_idx'),
+        ]
+
+    @classmethod
+    def pack(cls, data, compress_threshold: int = None) -> dict:
+        """Поля data/compressed_data для данных: JSON длиннее compress_threshold байт сжимается zlib"""
+        if data is None or compress_threshold is None:
+            return {'data': data}
+        encoded = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(encoded) <= compress_threshold:
+            return {'data': data}
+        return {'compressed_data': zlib.compress(encoded)}
+
+    @property
+    def payload(self):
+        if self.compressed_data is not None:
+            return json.loads(zlib.decompress(bytes(self.compressed_data)).decode('utf-8'))
+        return self.data
+
+    def __str__(self):
+        if self.kind == self.EventKind.TRANSITION:
+            return f'{self.payment_id}: {self.source} -> {self.target}'
+        return f'{self.payment_id}: {self.get_kind_display()}'
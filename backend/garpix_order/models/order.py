@@ -1,13 +1,21 @@
 import re
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.db import models, transaction
-from django.db.models import F, Sum, DecimalField
+from django.db.models import F, OuterRef, Subquery, Sum, DecimalField, Value
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
-from django_fsm import RETURN_VALUE, FSMField, transition
+from django.utils import timezone
+from django_fsm import RETURN_VALUE, FSMField, TransitionNotAllowed, transition
 from polymorphic.models import PolymorphicModel
+from garpix_order.concurrency import conflict_stats, get_optimistic_retries
+from garpix_order.exceptions import OrderVersionConflictException
 from garpix_order.models.payment import BasePayment
 from garpix_order.models.payments.recurring import Recurring
+from garpix_order.models.querysets import OrderManager
+from garpix_order.utils import bulk_create_polymorphic
 
 
 class BaseOrder(PolymorphicModel):
@@ -36,11 +44,20 @@ class BaseOrder(PolymorphicModel):
     user = models.ForeignKey(get_user_model(), on_delete=models.PROTECT, verbose_name="Пользователь")
     total_amount = models.DecimalField(default=0, **decimalfield_kwargs, verbose_name='Полная стоимость')
     payed_amount = models.DecimalField(default=0, **decimalfield_kwargs, verbose_name='Оплачено')
+    refunded_amount = models.DecimalField(default=0, **decimalfield_kwargs, verbose_name='Возвращено')
+    pending_amount = models.DecimalField(default=0, **decimalfield_kwargs, verbose_name='В процессе оплаты')
     recurring = models.ForeignKey(Recurring, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Рекуррент')
     next_payment_date = models.DateTimeField(verbose_name='Дата слелующего платежа', null=True)
+    version = models.PositiveIntegerField(default=0, verbose_name='Версия')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
 
+    objects = OrderManager()
+
+    # Переходы заказа меняют суммы (pay, refunded, open_billing_period), поэтому для выборки не выполняются.
+    # Наследник может перечислить здесь свои переходы без побочных действий
+    bulk_transitions = ()
+
     def make_full_payment(self, **kwargs):
         return BasePayment.objects.create(order=self, amount=self.total_amount, **kwargs)
 
@@ -55,6 +72,75 @@ class BaseOrder(PolymorphicModel):
             return 0
         return amount.get('total', 0)
 
+    def recalculate_total(self):
+        """
+        Пересчитывает total_amount по позициям заказа одним UPDATE с подзапросом.
+        """
+        items_total = self.baseorderitem_set.model.objects.non_polymorphic().filter(order=OuterRef('pk')).values(
+            'order').annotate(total=Sum(F('amount') * F('quantity'), output_field=DecimalField())).values('total')
+        BaseOrder.objects.filter(pk=self.pk).update(
+            total_amount=Coalesce(
+                Subquery(items_total, output_field=DecimalField(**self.decimalfield_kwargs)),
+                Value(0),
+                output_field=DecimalField(**self.decimalfield_kwargs),
+            ),
+            updated_at=timezone.now(),
+            version=F('version') + 1,
+        )
+        self.total_amount, self.updated_at, self.version = BaseOrder.objects.filter(pk=self.pk).values_list(
+            'total_amount', 'updated_at', 'version'
+        ).get()
+
+    @transaction.atomic
+    def add_items(self, items, batch_size=1000):
+        """
+        Добавляет позиции в заказ пачками (bulk_create для каждого класса позиций) и пересчитывает total_amount.
+        """
+        items = list(items)
+        items_by_class = {}
+        for item in items:
+            item.order = self
+            items_by_class.setdefault(type(item), []).append(item)
+        for class_items in items_by_class.values():
+            bulk_create_polymorphic(class_items, batch_size=batch_size)
+        self.recalculate_total()
+        return items
+
+    @transaction.atomic
+    def remove_items(self, items):
+        """
+        Удаляет позиции заказа (объекты или первичные ключи) и пересчитывает total_amount.
+        """
+        pks = [getattr(item, 'pk', item) for item in items]
+        self.baseorderitem_set.filter(pk__in=pks).delete()
+        self.recalculate_total()
+
+    @transaction.atomic
+    def replace_items(self, items, fields=('amount', 'quantity'), batch_size=1000):
+        """
+        Приводит состав заказа к items: сохраненные позиции обновляются (bulk_update по fields), новые добавляются,
+        остальные позиции заказа удаляются. total_amount пересчитывается один раз.
+        Сохраненные позиции других заказов не переносятся: для них выбрасывается ValueError.
+        """
+        items = list(items)
+        existing = [item for item in items if item.pk is not None]
+        new_items = [item for item in items if item.pk is None]
+
+        foreign = [item.pk for item in existing if item.order_id != self.pk]
+        if foreign:
+            raise ValueError(f'Позиции {foreign} не принадлежат заказу {self.pk}')
+
+        self.baseorderitem_set.exclude(pk__in=[item.pk for item in existing]).delete()
+
+        items_by_class = {}
+        for item in existing:
+            items_by_class.setdefault(type(item), []).append(item)
+        for model, class_items in items_by_class.items():
+            model._base_manager.bulk_update(class_items, fields, batch_size=batch_size)
+
+        self.add_items(new_items, batch_size=batch_size)
+        return items
+
     def payment_amount(self):
         payments = self.payments.all().filter(status=BasePayment.PaymentStatus.SUCCEEDED)
         result = payments.aggregate(
@@ -65,14 +151,111 @@ class BaseOrder(PolymorphicModel):
             return 0
         return result.get('total')
 
+    @staticmethod
+    def is_incremental_balance():
+        """Включен ли режим инкрементального ведения баланса заказа (settings.GARPIX_ORDER_INCREMENTAL_BALANCE)"""
+        return getattr(settings, 'GARPIX_ORDER_INCREMENTAL_BALANCE', False)
+
+    def change_balance(self, payed=0, refunded=0, pending=0):
+        """
+        Атомарно изменяет счетчики оплаты заказа через F-выражения, не пересчитывая агрегаты по платежам,
+        и подтягивает актуальные значения из БД.
+        """
+        changes = {}
+        if payed:
+            changes['payed_amount'] = F('payed_amount') + payed
+        if refunded:
+            changes['refunded_amount'] = F('refunded_amount') + refunded
+        if pending:
+            changes['pending_amount'] = F('pending_amount') + pending
+        if not changes:
+            return
+        BaseOrder.objects.filter(pk=self.pk).update(**changes)
+        self.refresh_from_db(fields=list(changes))
+
+    @staticmethod
+    def is_optimistic_locking():
+        """
+        Включен ли режим оптимистичной блокировки заказа (settings.GARPIX_ORDER_OPTIMISTIC_LOCKING).
+        В инкрементальном режиме баланс и так меняется атомарно, поэтому оптимистичная блокировка не используется.
+        """
+        return getattr(settings, 'GARPIX_ORDER_OPTIMISTIC_LOCKING', False) and not BaseOrder.is_incremental_balance()
+
+    def save_versioned(self):
+        """
+        Сохраняет статус и суммы заказа условным UPDATE, только если версия в БД не изменилась с момента чтения.
+        """
+        self.updated_at = timezone.now()
+        updated = BaseOrder.objects.filter(pk=self.pk, version=self.version).update(
+            status=self.status,
+            total_amount=self.total_amount,
+            payed_amount=self.payed_amount,
+            refunded_amount=self.refunded_amount,
+            pending_amount=self.pending_amount,
+            updated_at=self.updated_at,
+            version=F('version') + 1,
+        )
+        if not updated:
+            raise OrderVersionConflictException
+        self.version += 1
+
+    def run_optimistic(self, operation):
+        """
+        Выполняет operation() над заказом и сохраняет его через save_versioned. При конфликте версий заказ
+        перечитывается из БД и операция повторяется, но не более GARPIX_ORDER_OPTIMISTIC_RETRIES раз.
+        """
+        retries = get_optimistic_retries()
+        for attempt in range(retries + 1):
+            conflict_stats.add(attempts=1)
+            try:
+                with transaction.atomic():
+                    result = operation()
+                    self.save_versioned()
+                return result
+            except OrderVersionConflictException:
+                conflict_stats.add(conflicts=1)
+                if attempt == retries:
+                    conflict_stats.add(exhausted=1)
+                    raise
+                self.refresh_from_db()
+
+    def save_after_transition(self):
+        """
+        Сохраняет заказ после перехода. В инкрементальном режиме счетчики уже записаны в БД,
+        поэтому перезаписываются только статус и дата изменения.
+        """
+        if self.is_incremental_balance():
+            self.save(update_fields=['status', 'updated_at'])
+        else:
+            self.save()
+
     @transaction.atomic
     @transition(field=status, source=(OrderStatus.CREATED, OrderStatus.PAYED_PARTIAL,), target=RETURN_VALUE(OrderStatus.PAYED_FULL, OrderStatus.PAYED_PARTIAL))
     def pay(self, payment):
-        self.payed_amount = self.payment_amount() + payment.amount
+        if self.is_incremental_balance():
+            self.change_balance(payed=payment.amount)
+        elif self.is_optimistic_locking():
+            # Счетчик перечитан вместе с версией, а save_versioned проверяет ее: сумма по платежам
+            # не учла бы оплату, которая уже записана в заказ, но строка платежа которой еще не сохранена
+            self.payed_amount += payment.amount
+        else:
+            self.payed_amount = self.payment_amount() + payment.amount
         if self.payed_amount == self.total_amount:
+            self.fulfill_items()
             return self.OrderStatus.PAYED_FULL
         return self.OrderStatus.PAYED_PARTIAL
 
+    def fulfill_items(self):
+        """
+        Вызывает bulk_pay для позиций заказа: позиции группируются по классу (polymorphic_ctype),
+        каждый класс получает QuerySet своих позиций одним вызовом.
+        """
+        items = self.baseorderitem_set.model.objects.non_polymorphic().filter(order=self)
+        ctype_ids = items.order_by().values_list('polymorphic_ctype_id', flat=True).distinct()
+        for ctype_id in ctype_ids:
+            model = ContentType.objects.get_for_id(ctype_id).model_class()
+            model.bulk_pay(model.objects.non_polymorphic().filter(order=self, polymorphic_ctype_id=ctype_id))
+
     @transaction.atomic
     @transition(
         field=status,
@@ -80,17 +263,27 @@ class BaseOrder(PolymorphicModel):
         target=RETURN_VALUE(OrderStatus.REFUNDED, OrderStatus.PAYED_PARTIAL)
     )
     def refunded(self, payment):
-        self.payed_amount = self.payed_amount - payment.amount
+        if self.is_incremental_balance():
+            self.change_balance(payed=-payment.amount, refunded=payment.amount)
+        else:
+            self.payed_amount = self.payed_amount - payment.amount
         if self.payed_amount == 0:
             return self.OrderStatus.REFUNDED
         return self.OrderStatus.PAYED_PARTIAL
 
+    @transition(field=status, source=OrderStatus.PAYED_FULL, target=OrderStatus.PAYED_PARTIAL)
+    def open_billing_period(self, amount):
+        """Новый период рекуррентного заказа: сумма заказа увеличивается на сумму периода, которую предстоит оплатить"""
+        self.total_amount += amount
+
     def cancel(self):
         pass
 
     @classmethod
     def split_order(cls, number, item):
         old_order = item.order
+        if cls.is_optimistic_locking():
+            return cls._split_order_optimistic(number, item)
         if old_order.status == cls.OrderStatus.CREATED:
             order = cls.objects.create(number=number, user=old_order.user, total_amount=item.full_amount())
             item.order = order
@@ -100,6 +293,26 @@ class BaseOrder(PolymorphicModel):
             return order
         return None
 
+    @classmethod
+    def _split_order_optimistic(cls, number, item):
+        old_order = item.order
+
+        def recalculate_total():
+            if old_order.status != cls.OrderStatus.CREATED:
+                raise TransitionNotAllowed(f'Заказ {old_order.pk} уже не в статусе {cls.OrderStatus.CREATED}')
+            old_order.total_amount = old_order.items_amount()
+
+        try:
+            with transaction.atomic():
+                order = cls.objects.create(number=number, user=old_order.user, total_amount=item.full_amount())
+                item.order = order
+                item.save()
+                old_order.run_optimistic(recalculate_total)
+        except TransitionNotAllowed:
+            item.order = old_order
+            return None
+        return order
+
     def __str__(self):
         return self.number
 
@@ -107,3 +320,11 @@ class BaseOrder(PolymorphicModel):
         verbose_name = _('Базовый заказ')
         verbose_name_plural = _('Базовые заказы')
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(
+                fields=['recurring', 'next_payment_date'],
+                name='garpix_order_recurring_idx',
+                condition=models.Q(recurring__isnull=False),
+            ),
+            models.Index(fields=['created_at', 'id'], name='garpix_order_order_created_idx'),
+        ]
@@ -13,6 +13,20 @@ class BaseOrderItem(PolymorphicModel):
     def full_amount(self) -> Decimal:
         return self.amount * self.quantity
 
+    def pay(self):
+        """Вызывается при полной оплате заказа"""
+        pass
+
+    @classmethod
+    def bulk_pay(cls, items):
+        """
+        Вызывается при полной оплате заказа один раз для всех его позиций класса cls (items - QuerySet).
+        По умолчанию вызывает pay() у каждой позиции, наследники могут переопределить его, например,
+        одним items.update(...).
+        """
+        for item in items:
+            item.pay()
+
     class Meta:
         verbose_name = _('Объект заказа')
         verbose_name_plural = _('Объекты заказа')
@@ -1,10 +1,10 @@
-import json
-
-from django.db import models
+from django.db import models, transaction
 from polymorphic.models import PolymorphicModel
-from django_fsm import RETURN_VALUE, FSMField, transition
+from django_fsm import RETURN_VALUE, FSMField, TransitionNotAllowed, transition
 from django.utils.translation import gettext_lazy as _
 
+from .querysets import TransitionManager
+
 
 class BasePayment(PolymorphicModel):
     """
@@ -35,6 +35,8 @@ class BasePayment(PolymorphicModel):
             (CLOSED, 'CLOSED')
         )
 
+        IN_PROGRESS = (PENDING, WAITING_FOR_CAPTURE)
+
     class PaymentType(models.TextChoices):
         """Тип платежа"""
         MANUAL = 'MANUAL', _('Ручной')
@@ -47,11 +49,21 @@ class BasePayment(PolymorphicModel):
     status = FSMField(choices=PaymentStatus.CHOICES, default=PaymentStatus.CREATED)
     client_data = models.JSONField(verbose_name=_('Данные процесса оплаты клиента'), blank=True, null=True)
     provider_data = models.JSONField(verbose_name=_('Данные процесса оплаты провайдера'), blank=True, null=True)
+    provider_event = models.ForeignKey('garpix_order.PaymentEvent', on_delete=models.SET_NULL, null=True, blank=True,
+                                       related_name='+', verbose_name=_('Последние данные провайдера'))
     payment_type = models.CharField(max_length=6, choices=PaymentType.choices, default=PaymentType.MANUAL,
                                     verbose_name=_('Тип платежа'))
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, unique=True,
+                                       verbose_name=_('Ключ идемпотентности'))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Дата создания'))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Дата изменения'))
 
+    # Переходы без побочных действий, которые можно выполнить для выборки: QuerySet.transition(name).
+    # Наследник, переопределивший тело такого перехода, должен убрать его из своего bulk_transitions
+    bulk_transitions = ('pending', 'waiting_for_capture', 'canceled', 'failed', 'timeout', 'closed')
+
+    objects = TransitionManager()
+
     @classmethod
     def make_refunded(cls, instance):
         payment = cls.objects.create(
@@ -62,8 +74,18 @@ class BasePayment(PolymorphicModel):
         return payment
 
     def pay_full(self):
-        self.order.pay(payment=self)
-        self.order.save()  # сохраняем для верности
+        order = self.order
+        if order.is_optimistic_locking():
+            def pay():
+                # При повторе после конфликта заказ перечитан, проверяем сумму заново
+                if not self.can_succeeded():
+                    raise TransitionNotAllowed(f'Платеж {self.pk} превышает сумму заказа {order.pk}')
+                order.pay(payment=self)
+
+            order.run_optimistic(pay)
+            return
+        order.pay(payment=self)
+        order.save_after_transition()  # сохраняем для верности
 
     @transition(field=status, source=[PaymentStatus.CREATED, ], target=PaymentStatus.PENDING)
     def pending(self):
@@ -114,8 +136,12 @@ class BasePayment(PolymorphicModel):
         conditions=[can_refund]
     )
     def refunded(self):
-        self.order.refunded(payment=self)
-        self.order.save()
+        order = self.order
+        if order.is_optimistic_locking():
+            order.run_optimistic(lambda: order.refunded(payment=self))
+            return
+        order.refunded(payment=self)
+        order.save_after_transition()
 
     @transition(field=status, source=[PaymentStatus.CREATED, PaymentStatus.PENDING, PaymentStatus.WAITING_FOR_CAPTURE],
                 target=PaymentStatus.FAILED)
@@ -131,9 +157,45 @@ class BasePayment(PolymorphicModel):
     def closed(self):
         pass
 
-    def set_provider_data(self, data):
-        self.provider_data = json.dumps(data)
-        self.save()
+    def save(self, *args, **kwargs):
+        """
+        Переходы статусов попадают в журнал и сводки при сохранении платежа, в одной транзакции с ним:
+        переход без сохранения или с неудачным сохранением не оставляет записи.
+        """
+        from ..services.journal import payment_journal
+        from ..services.rollup import payment_rollups
+
+        if not getattr(self, '_pending_transitions', None) and not getattr(self, '_pending_rollup_transitions', None):
+            return super().save(*args, **kwargs)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            payment_journal.record_pending_transitions(self)
+            payment_rollups.record_pending_transitions(self)
+
+    def set_provider_data(self, data, save=True):
+        """
+        Добавляет данные провайдера в журнал платежа и запоминает ссылку на запись в provider_event.
+        При save=False ссылка сохранится следующим save() платежа (например, после перехода статуса).
+        """
+        from ..services.journal import payment_journal
+
+        if self.pk is None:
+            self.save()
+        self.provider_event = payment_journal.record_provider_data(self, data)
+        if save:
+            self.save(update_fields=['provider_event', 'updated_at'])
+
+    def get_provider_data(self):
+        """Последние данные провайдера: из журнала или, для старых платежей, из поля provider_data"""
+        if self.provider_event_id is not None:
+            return self.provider_event.payload
+        return self.provider_data
+
+    def get_timeline(self):
+        """Журнал платежа: переходы статусов и данные провайдера в порядке добавления"""
+        from ..services.journal import payment_journal
+
+        return payment_journal.timeline(self.pk)
 
     def __str__(self):
         return self.title
@@ -141,3 +203,7 @@ class BasePayment(PolymorphicModel):
     class Meta:
         verbose_name = _('Базовый платеж')
         verbose_name_plural = _('Базовые платежи')
+        indexes = [
+            models.Index(fields=['order', 'status'], name='garpix_order_pay_order_st_idx'),
+            models.Index(fields=['created_at', 'id'], name='garpix_order_pay_created_idx'),
+        ]
@@ -21,8 +21,8 @@ class CloudPayment(BasePayment):
         PAYMENT_STATUS_CANCELLED: BasePayment.PaymentStatus.CANCELED,
         PAYMENT_STATUS_DECLINED: BasePayment.PaymentStatus.FAILED,
     }
-    payment_uuid = models.CharField(max_length=64, verbose_name='UUID', default=generate_uuid)
-    order_number = models.CharField(max_length=200, verbose_name='Номер заказа')
+    payment_uuid = models.CharField(max_length=64, verbose_name='UUID', default=generate_uuid, unique=True)
+    order_number = models.CharField(max_length=200, verbose_name='Номер заказа', db_index=True)
     transaction_id = models.CharField(max_length=200, default='', blank=True, verbose_name='Номер транзакции')
     is_test = models.BooleanField(default=False, verbose_name='Тестовый платеж')
 
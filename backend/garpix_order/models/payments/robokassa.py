@@ -1,7 +1,6 @@
-from datetime import datetime
-
 from ..payment import BasePayment
 from garpix_order.services.robokassa import robokassa_service
+from garpix_order.tracing import traced, tracer
 
 
 class RobokassaPayment(BasePayment):
@@ -9,42 +8,49 @@ class RobokassaPayment(BasePayment):
         verbose_name = 'Платеж Robokassa'
         verbose_name_plural = 'Платежи Robokassa'
 
+    @traced('robokassa.pay')
     def pay(self, data, auto=False):
         if self.status != BasePayment.PaymentStatus.CREATED:
             return False, 'Invoice already in process'
         self.pending()
         self.save()
+        return self.process_payment(data, auto=auto)
+
+    @traced('robokassa.process_payment')
+    def process_payment(self, data, auto=False):
+        """Проводит платеж, уже переведенный в статус PENDING"""
         if self.amount == 0:
             msg = 'It is not possible to pay 0 amount'
-            self.set_provider_data({'msg': msg})
+            self.set_provider_data({'msg': msg}, save=False)
             self.failed()
             self.save()
             return False, msg
 
-        res, msg = robokassa_service.check_success_payment(self, data)
+        with tracer.span('robokassa.check_payment', auto=auto):
+            res, msg = robokassa_service.check_success_payment(self, data, auto=auto)
         if not res:
-            self.set_provider_data({'msg': msg})
+            self.set_provider_data({'msg': msg}, save=False)
             self.failed()
             self.save()
             return False, msg
         self.succeeded()
-        self.order.pay(self.amount)
         if auto:
             self.order.next_payment_date = self.order.recurring.get_next_payment_date()
-        self.order.save()
-        self.set_provider_data({'msg': 'Payment is successful'})
+            self.order.save(update_fields=['next_payment_date', 'updated_at'])
+        self.set_provider_data({'msg': 'Payment is successful'}, save=False)
         self.save()
-        return True
+        return True, ''
 
     def refund(self):
-        self.set_provider_data({'msg': f'Payment is refunded {self.amount}'})
+        self.set_provider_data({'msg': f'Payment is refunded {self.amount}'}, save=False)
         self.refunded()
         self.save()
 
     def cancel(self):
-        self.set_provider_data({'msg': 'Payment is canceled'})
+        self.set_provider_data({'msg': 'Payment is canceled'}, save=False)
         self.canceled()
         self.save()
 
+    @traced('robokassa.payment_link')
     def generate_payment_link(self):
         return robokassa_service.generate_payment_link(self)
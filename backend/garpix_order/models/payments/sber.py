@@ -36,8 +36,20 @@ class AbstractSberPayment(BasePayment):
         verbose_name=_('Ссылка на оплату'),
         default='',
     )
+    status_checked_at = models.DateTimeField(
+        verbose_name=_('Дата последней проверки статуса'),
+        null=True,
+        blank=True,
+    )
 
     class Meta:
         abstract = True
         verbose_name = _('Платеж в Сбере')
         verbose_name_plural = _('Платежи в Сбере')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['external_payment_id'],
+                condition=~models.Q(external_payment_id=''),
+                name='%(app_label)s_%(class)s_external_id_uniq',
+            ),
+        ]
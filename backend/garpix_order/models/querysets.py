@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django_fsm import TransitionNotAllowed
+from polymorphic.managers import PolymorphicManager
+from polymorphic.query import PolymorphicQuerySet
+
+
+class TransitionQuerySet(PolymorphicQuerySet):
+    """
+    QuerySet с переходами статуса для всей выборки: transition('timeout') переводит все подходящие объекты
+    в целевой статус UPDATE-запросами по порциям, не загружая объекты по одному.
+    """
+
+    def get_bulk_transition(self, name: str):
+        """
+        Поле статуса и целевой статус для каждого исходного статуса перехода name по декларациям @transition.
+        Тело метода для выборки не выполняется, поэтому разрешены только переходы из bulk_transitions модели
+        и всех ее наследников. Переходы с условиями (conditions) и с целевым статусом, который вычисляет метод
+        (RETURN_VALUE, GET_STATE), зависят от конкретного объекта, поэтому для выборки не поддерживаются.
+        """
+        meta = getattr(getattr(self.model, name, None), '_django_fsm', None)
+        if meta is None:
+            raise TransitionNotAllowed(f'{self.model.__name__}.{name} не является переходом статуса')
+        for model in self.get_bulk_models():
+            if name not in getattr(model, 'bulk_transitions', ()):
+                raise TransitionNotAllowed(f'Переход {model.__name__}.{name} не выполняется для выборки')
+        field = meta.field
+        if isinstance(field, str):
+            field = self.model._meta.get_field(field)
+        states = [value for value, _ in field.flatchoices]
+
+        targets = {}
+        wildcards = []
+        for source, declaration in meta.transitions.items():
+            if declaration.conditions or not isinstance(declaration.target, str):
+                raise TransitionNotAllowed(f'Переход {name} зависит от объекта и не выполняется для выборки')
+            if source in ('*', '+'):
+                wildcards.append((source, declaration.target))
+            else:
+                targets[source] = declaration.target
+        # Как в FSMMeta.get_transition: явный исходный статус важнее "*", а "*" важнее "+"
+        for source, target in sorted(wildcards):
+            for state in states:
+                if source == '*' or state != target:
+                    targets.setdefault(state, target)
+        return field, {source: target for source, target in targets.items() if source != target}
+
+    def get_bulk_models(self) -> list:
+        """Модель выборки и все ее наследники: polymorphic-выборка может содержать объекты любого из них"""
+        models = [self.model]
+        for model in models:
+            models.extend(model.__subclasses__())
+        return models
+
+    def get_bulk_transition_changes(self, model) -> dict:
+        """Поля, которые меняются вместе со статусом: даты с auto_now"""
+        now = timezone.now()
+        return {field.attname: now for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)}
+
+    def transition(self, name: str, chunk_size: int = 1000) -> dict:
+        """
+        Выполняет переход name для всех объектов выборки, которые находятся в одном из его исходных статусов.
+        Для каждого исходного статуса объекты блокируются и обновляются порциями по chunk_size в отдельных
+        транзакциях: SELECT ... FOR UPDATE и один UPDATE на порцию. Тело метода перехода не вызывается
+        и post_transition не отправляется, вместо него после каждой порции отправляется сигнал
+        post_bulk_transition. Возвращает количество переведенных объектов по исходным статусам.
+        """
+        from ..signals import post_bulk_transition
+
+        field, targets = self.get_bulk_transition(name)
+        model = field.model  # статус хранится в таблице модели, где объявлено поле
+        rows = self.non_polymorphic().order_by()
+        if self.model is not model:
+            rows = model.objects.non_polymorphic().filter(pk__in=rows.values('pk'))
+
+        counts = {}
+        for source, target in targets.items():
+            last_pk = None
+            while True:
+                chunk = rows.filter(**{field.name: source})
+                if last_pk is not None:
+                    chunk = chunk.filter(pk__gt=last_pk)
+                with transaction.atomic(using=self.db):
+                    pks = list(chunk.select_for_update(of=('self',)).order_by('pk').values_list(
+                        'pk', flat=True
+                    )[:chunk_size])
+                    if not pks:
+                        break
+                    updated = model.objects.non_polymorphic().filter(pk__in=pks).update(
+                        **{field.name: target}, **self.get_bulk_transition_changes(model)
+                    )
+                    post_bulk_transition.send(
+                        sender=self.model, name=name, source=source, target=target, pks=pks, using=self.db
+                    )
+                counts[source] = counts.get(source, 0) + updated
+                last_pk = pks[-1]
+        return counts
+
+
+class OrderQuerySet(TransitionQuerySet):
+    def get_bulk_transition_changes(self, model) -> dict:
+        # Версия увеличивается, чтобы параллельный save_versioned не перезаписал новый статус
+        return {**super().get_bulk_transition_changes(model), 'version': F('version') + 1}
+
+
+TransitionManager = PolymorphicManager.from_queryset(TransitionQuerySet)
+OrderManager = PolymorphicManager.from_queryset(OrderQuerySet)
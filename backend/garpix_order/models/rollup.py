@@ -0,0 +1,25 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class PaymentRollup(models.Model):
+    """
+    Количество и сумма платежей за день (по дате создания платежа) по типу платежа и статусу.
+    Обновляется при создании, удалении и переходах статуса платежей, пересчитывается командой backfill_payment_rollups.
+    """
+    day = models.DateField(verbose_name=_('День'))
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, verbose_name=_('Тип платежа'))
+    status = models.CharField(max_length=64, verbose_name=_('Статус'))
+    count = models.BigIntegerField(default=0, verbose_name=_('Количество'))
+    amount = models.DecimalField(decimal_places=2, max_digits=18, default=0, verbose_name=_('Сумма'))
+
+    class Meta:
+        verbose_name = _('Сводка по платежам')
+        verbose_name_plural = _('Сводки по платежам')
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'content_type', 'status'], name='garpix_order_rollup_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.day} {self.content_type_id} {self.status}: {self.count}'
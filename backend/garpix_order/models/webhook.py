@@ -0,0 +1,56 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class ProcessedWebhook(models.Model):
+    """
+    Обработанное уведомление платежного провайдера. Повторные уведомления с тем же
+    (провайдер, id транзакции, статус) подтверждаются без повторной обработки.
+    """
+    provider = models.CharField(max_length=32, verbose_name=_('Провайдер'))
+    transaction_id = models.CharField(max_length=255, verbose_name=_('Id транзакции'))
+    status = models.CharField(max_length=64, verbose_name=_('Статус'))
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name=_('Дата обработки'))
+
+    class Meta:
+        verbose_name = _('Обработанное уведомление')
+        verbose_name_plural = _('Обработанные уведомления')
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'transaction_id', 'status'], name='garpix_order_webhook_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.provider}: {self.transaction_id} ({self.status})'
+
+
+class WebhookEvent(models.Model):
+    """
+    Уведомление провайдера, принятое в режиме асинхронной обработки. Сохраняется сразу после проверки подписи,
+    применяется Celery-задачей последовательно для каждого заказа.
+    """
+
+    class EventStatus(models.TextChoices):
+        RECEIVED = 'received', _('Получено')
+        PROCESSED = 'processed', _('Обработано')
+        FAILED = 'failed', _('Ошибка')
+
+    provider = models.CharField(max_length=32, verbose_name=_('Провайдер'))
+    order_key = models.CharField(max_length=255, verbose_name=_('Ключ заказа'),
+                                 help_text=_('Номер заказа у провайдера, события одного заказа применяются по порядку'))
+    payload = models.JSONField(verbose_name=_('Данные уведомления'))
+    status = models.CharField(max_length=16, choices=EventStatus.choices, default=EventStatus.RECEIVED,
+                              verbose_name=_('Статус'))
+    error = models.TextField(blank=True, default='', verbose_name=_('Ошибка'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Дата получения'))
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Дата обработки'))
+
+    class Meta:
+        verbose_name = _('Уведомление провайдера')
+        verbose_name_plural = _('Уведомления провайдеров')
+        indexes = [
+            models.Index(fields=['provider', 'order_key', 'status'], name='garpix_order_webhook_order_idx'),
+            models.Index(fields=['status', 'created_at'], name='garpix_order_webhook_st_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.provider}: {self.order_key} ({self.status})'
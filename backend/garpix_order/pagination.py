@@ -0,0 +1,117 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+
+
+DEFAULT_PAGINATION_SETTINGS = {
+    'page_size': 100,  # Размер страницы по умолчанию
+    'max_page_size': 5000,  # Максимальный размер страницы (?page_size=)
+    'stream_threshold': 1000,  # Страницы большего размера отдаются потоком, без сборки ответа в памяти
+    'stream_chunk_size': 500,  # Количество строк, читаемых из БД за раз при потоковой отдаче
+}
+
+
+def get_pagination_settings() -> dict:
+    return {**DEFAULT_PAGINATION_SETTINGS, **getattr(settings, 'GARPIX_ORDER_PAGINATION', {})}
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу (created_at, id) от новых к старым: следующая страница выбирается условием
+    (created_at, id) < (последний created_at, последний id), поэтому стоимость запроса не зависит от номера страницы.
+    Курсор непрозрачен для клиента и передается в параметре cursor.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('-created_at', '-id')
+
+    def get_page_size(self, request) -> int:
+        pagination_settings = get_pagination_settings()
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return pagination_settings['page_size']
+        return max(1, min(page_size, pagination_settings['max_page_size']))
+
+    def encode_cursor(self, obj) -> str:
+        position = f'{obj.created_at.isoformat()}|{obj.id}'
+        return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor: str) -> tuple:
+        try:
+            created_at, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound('Неверный курсор')
+        if created_at is None:
+            raise NotFound('Неверный курсор')
+        return created_at, pk
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        # Лишняя строка показывает, есть ли следующая страница
+        return queryset[:self.page_size + 1]
+
+    def is_streaming(self) -> bool:
+        return self.page_size >= get_pagination_settings()['stream_threshold']
+
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.get_page_queryset(queryset, request))
+        self.has_next = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_streaming_response(self, queryset, request, serializer_class, serializer_context=None):
+        """
+        Потоковый ответ для больших страниц: строки читаются из БД порциями через iterator(),
+        каждая сериализуется и отдается сразу. Формат ответа тот же, что у get_paginated_response.
+        """
+        page_queryset = self.get_page_queryset(queryset, request)
+        chunk_size = get_pagination_settings()['stream_chunk_size']
+        encoder = JSONEncoder(ensure_ascii=False)
+
+        def stream():
+            last = None
+            yield '{"results": ['
+            for index, obj in enumerate(page_queryset.iterator(chunk_size=chunk_size)):
+                if index == self.page_size:
+                    self.next_cursor = self.encode_cursor(last)
+                    break
+                item = serializer_class(obj, context=serializer_context).data
+                yield (',' if index else '') + encoder.encode(item)
+                last = obj
+            else:
+                self.next_cursor = None
+            yield '], "next": ' + json.dumps(self.get_next_link()) + '}'
+
+        return StreamingHttpResponse(stream(), content_type='application/json')
@@ -0,0 +1,103 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django_fsm.signals import post_transition
+
+from .metrics import metrics
+from .models import BaseOrder, BasePayment, Config
+from .services.journal import payment_journal
+from .services.rollup import payment_rollups
+from .signals import post_bulk_create, post_bulk_transition
+
+
+@receiver(post_transition)
+def update_order_pending_amount(sender, instance, name, source, target, **kwargs):
+    """
+    Ведет счетчик pending_amount заказа при переходах платежа в статусы ожидания и из них
+    (только в режиме GARPIX_ORDER_INCREMENTAL_BALANCE).
+    """
+    if not isinstance(instance, BasePayment) or not BaseOrder.is_incremental_balance():
+        return
+    in_progress = BasePayment.PaymentStatus.IN_PROGRESS
+    delta = (target in in_progress) - (source in in_progress)
+    if delta:
+        instance.order.change_balance(pending=delta * instance.amount)
+
+
+@receiver(post_transition)
+def record_payment_transition(sender, instance, name, source, target, **kwargs):
+    if isinstance(instance, BasePayment):
+        payment_journal.add_transition(instance, name, source, target)
+
+
+@receiver(post_transition)
+def update_payment_rollup_on_transition(sender, instance, name, source, target, **kwargs):
+    if isinstance(instance, BasePayment):
+        payment_rollups.add_transition(instance, source, target)
+
+
+@receiver(post_transition)
+def count_transition(sender, instance, name, source, target, **kwargs):
+    metrics.inc('garpix_order_transitions_total', model=sender._meta.label_lower, transition=name, source=source,
+                target=target)
+
+
+@receiver(post_bulk_transition)
+def count_bulk_transition(sender, name, source, target, pks, **kwargs):
+    metrics.inc('garpix_order_transitions_total', len(pks), model=sender._meta.label_lower, transition=name,
+                source=source, target=target)
+
+
+@receiver(post_bulk_transition)
+def update_order_pending_amount_on_bulk_transition(sender, name, source, target, pks, **kwargs):
+    """Меняет pending_amount всех заказов порции одним UPDATE на сумму их платежей из pks"""
+    if not issubclass(sender, BasePayment) or not BaseOrder.is_incremental_balance():
+        return
+    in_progress = BasePayment.PaymentStatus.IN_PROGRESS
+    delta = (target in in_progress) - (source in in_progress)
+    if not delta:
+        return
+    payments = BasePayment.objects.non_polymorphic().filter(pk__in=pks)
+    amounts = payments.filter(order=OuterRef('pk')).order_by().values('order').annotate(
+        total=Sum('amount')
+    ).values('total')
+    BaseOrder.objects.filter(pk__in=payments.values('order')).update(
+        pending_amount=F('pending_amount') + delta * Subquery(amounts, output_field=DecimalField())
+    )
+
+
+@receiver(post_bulk_transition)
+def record_payment_bulk_transition(sender, name, source, target, pks, **kwargs):
+    if issubclass(sender, BasePayment):
+        payment_journal.record_bulk_transition(pks, name, source, target)
+        payment_rollups.record_bulk_transition(pks, source, target)
+
+
+@receiver(post_save)
+def update_payment_rollup_on_create(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and isinstance(instance, BasePayment):
+        payment_rollups.record(instance, instance.status, 1)
+
+
+@receiver(post_bulk_create)
+def update_payment_rollup_on_bulk_create(sender, objs, **kwargs):
+    if issubclass(sender, BasePayment):
+        payment_rollups.record_bulk_create(objs)
+
+
+@receiver(post_delete)
+def update_payment_rollup_on_delete(sender, instance, **kwargs):
+    # При удалении наследника сигнал приходит и для строки BasePayment, учитываем платеж один раз
+    if isinstance(instance, BasePayment) and \
+            ContentType.objects.get_for_model(sender, for_concrete_model=False).pk == instance.polymorphic_ctype_id:
+        payment_rollups.record(instance, instance.status, -1)
+
+
+@receiver(post_save, sender=Config)
+@receiver(post_delete, sender=Config)
+def invalidate_config_cache(sender, created=False, **kwargs):
+    if not created:  # только что созданные настройки еще никем не закэшированы
+        # До фиксации транзакции другие процессы перечитали бы из БД старые настройки
+        transaction.on_commit(Config.invalidate_cache)
@@ -0,0 +1,89 @@
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_module, import_string
+
+from .exceptions import UndefinedModelPaymentException, InvalidModelPaymentException
+
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentRegistry:
+    """
+    Реестр платежных провайдеров: модели платежей и callback смены статуса.
+    Настройки разрешаются и проверяются один раз при старте (GarpixOrderConfig.ready),
+    горячие пути получают готовые объекты без импорта и проверок.
+    """
+
+    def __init__(self) -> None:
+        self._payment_models = {}
+        self._status_changed_callback = None
+
+    def configure(self) -> None:
+        from .models import AbstractSberPayment, CloudPayment, RobokassaPayment
+
+        payment_models = {
+            'cloudpayments': CloudPayment,
+            'robokassa': RobokassaPayment,
+        }
+
+        sber_payment_model_path = getattr(settings, 'SBER_PAYMENT_MODEL', None)
+        if sber_payment_model_path is not None:
+            try:
+                sber_payment_model = import_string(sber_payment_model_path)
+            except ImportError as e:
+                raise ImproperlyConfigured(f'Не удалось импортировать SBER_PAYMENT_MODEL: {e}') from e
+            if not isinstance(sber_payment_model, type) or not issubclass(sber_payment_model, AbstractSberPayment):
+                raise InvalidModelPaymentException
+            self._check_credentials('SBER', ('api_url', 'token', 'cryptographic_key'))
+            payment_models['sber'] = sber_payment_model
+
+        robokassa_settings = self._check_credentials(
+            'ROBOKASSA', ('LOGIN', 'PASSWORD_1', 'PASSWORD_2', 'IS_TEST', 'ALGORITHM')
+        )
+        if robokassa_settings and robokassa_settings['ALGORITHM'].lower() not in hashlib.algorithms_available:
+            raise ImproperlyConfigured(f'Неизвестный алгоритм подписи ROBOKASSA: {robokassa_settings["ALGORITHM"]}')
+
+        self._payment_models = payment_models
+        self._status_changed_callback = self._resolve_status_changed_callback()
+
+    @staticmethod
+    def _check_credentials(name: str, keys: tuple):
+        provider_settings = getattr(settings, name, None)
+        if provider_settings is None:
+            return None
+        missing = [key for key in keys if key not in provider_settings]
+        if missing:
+            raise ImproperlyConfigured(f'В settings.{name} не заданы ключи: {", ".join(missing)}')
+        return provider_settings
+
+    @staticmethod
+    def _resolve_status_changed_callback():
+        callback_path = getattr(settings, 'GARPIX_PAYMENT_STATUS_CHANGED_CALLBACK', None)
+        if callback_path is None:
+            return None
+        try:
+            callback = import_module(callback_path).callback
+        except (ImportError, AttributeError) as e:
+            raise ImproperlyConfigured(f'Не удалось импортировать GARPIX_PAYMENT_STATUS_CHANGED_CALLBACK: {e}') from e
+        if not callable(callback):
+            raise ImproperlyConfigured('GARPIX_PAYMENT_STATUS_CHANGED_CALLBACK.callback должен быть вызываемым')
+        return callback
+
+    def get_payment_model(self, provider: str):
+        try:
+            return self._payment_models[provider]
+        except KeyError:
+            if provider == 'sber':
+                raise UndefinedModelPaymentException
+            raise
+
+    @property
+    def status_changed_callback(self):
+        return self._status_changed_callback
+
+
+payment_registry = PaymentRegistry()
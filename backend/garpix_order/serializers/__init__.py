@@ -1 +1,6 @@
-from .robokassa import RobokassaPaymentSerializer, RobokassaResultSerializer
+from .robokassa import (
+    RobokassaPaymentSerializer,
+    RobokassaPaymentListSerializer,
+    RobokassaPaymentFilterSerializer,
+    RobokassaResultSerializer,
+)
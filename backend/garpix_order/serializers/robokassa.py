@@ -10,6 +10,20 @@ class RobokassaPaymentSerializer(serializers.ModelSerializer):
         fields = ('title', 'order', 'amount',)
 
 
+class RobokassaPaymentListSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = RobokassaPayment
+        fields = ('id', 'title', 'order', 'amount', 'status', 'created_at',)
+
+
+class RobokassaPaymentFilterSerializer(serializers.Serializer):
+    order = serializers.IntegerField(required=False)
+    status = serializers.ChoiceField(choices=RobokassaPayment.PaymentStatus.CHOICES, required=False)
+    created_from = serializers.DateTimeField(required=False)
+    created_to = serializers.DateTimeField(required=False)
+
+
 class RobokassaResultSerializer(serializers.Serializer):
     OutSum = serializers.FloatField(required=True)
     SignatureValue = serializers.CharField(required=True)
@@ -0,0 +1,118 @@
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+
+from django.db import transaction
+from django_fsm import TransitionNotAllowed, can_proceed
+
+from ..models import CloudPayment
+from ..registry import payment_registry
+from ..tracing import traced, tracer
+from .deduplication import webhook_deduplicator
+
+
+PaymentStatus = CloudPayment.PaymentStatus
+
+
+class CloudPaymentsService:
+    PROVIDER = 'cloudpayments'
+
+    # Коды ответа на уведомления CloudPayments
+    CODE_SUCCESS = 0
+    CODE_INVALID_INVOICE = 10
+    CODE_INVALID_AMOUNT = 12
+    CODE_REJECTED = 13
+
+    # Переход платежа и его целевой статус для статуса из уведомления
+    STATUS_TRANSITIONS = {
+        CloudPayment.PAYMENT_STATUS_COMPLETED: ('succeeded', PaymentStatus.SUCCEEDED),
+        CloudPayment.PAYMENT_STATUS_CANCELLED: ('failed', PaymentStatus.FAILED),
+        CloudPayment.PAYMENT_STATUS_DECLINED: ('failed', PaymentStatus.FAILED),
+    }
+
+    @staticmethod
+    def _parse_amount(data: dict) -> Optional[Decimal]:
+        try:
+            return Decimal(data.get('Amount', ''))
+        except InvalidOperation:
+            return None
+
+    @traced('cloudpayments.validate')
+    def validate_notification(self, data: dict) -> int:
+        """
+        Проверяет номер счета и сумму уведомления без блокировки платежа. В режиме асинхронной обработки
+        уведомление с неверными данными отклоняется в HTTP-запросе, до того как CloudPayments получит код 0.
+        """
+        amount = self._parse_amount(data)
+        if amount is None:
+            return self.CODE_INVALID_AMOUNT
+        amounts = list(CloudPayment.objects.non_polymorphic().filter(
+            order_number=data.get('InvoiceId')
+        ).values_list('amount', flat=True)[:2])
+        if not amounts:
+            return self.CODE_INVALID_INVOICE
+        if len(amounts) > 1:
+            return self.CODE_REJECTED
+        if amounts[0] != amount:
+            return self.CODE_INVALID_AMOUNT
+        return self.CODE_SUCCESS
+
+    @traced('cloudpayments.process')
+    def process_notification(self, data: dict, status: str) -> int:
+        """
+        Применяет уведомление с проверенной подписью: платеж вместе с заказом загружается и блокируется
+        одним запросом, затем выполняется переход статуса. Повтор уведомления отсекается отметкой об обработке,
+        которая ставится первым запросом той же транзакции и снимается, если уведомление не применено.
+        Возвращает код ответа CloudPayments.
+        """
+        transaction_id = data.get('TransactionId', '')
+        if webhook_deduplicator.is_cached(self.PROVIDER, transaction_id, status):
+            return self.CODE_SUCCESS
+
+        amount = self._parse_amount(data)
+        if amount is None:
+            return self.CODE_INVALID_AMOUNT
+
+        try:
+            with transaction.atomic():
+                if not webhook_deduplicator.claim(self.PROVIDER, transaction_id, status):
+                    return self.CODE_SUCCESS
+                with tracer.span('cloudpayments.lookup'):
+                    payment = CloudPayment.objects.non_polymorphic().select_related('order').select_for_update().get(
+                        order_number=data.get('InvoiceId')
+                    )
+                if payment.amount != amount:
+                    transaction.set_rollback(True)
+                    return self.CODE_INVALID_AMOUNT
+
+                transition_name, target = self.STATUS_TRANSITIONS.get(status, (None, None))
+                payment.is_test = data.get('TestMode') == '1'
+                payment.transaction_id = transaction_id
+                # Повторное уведомление о том же статусе подтверждается без перехода
+                with tracer.span('cloudpayments.transition', transition=transition_name or ''):
+                    if transition_name is not None and payment.status != target:
+                        transition_method = getattr(payment, transition_name)
+                        if not can_proceed(transition_method):
+                            transaction.set_rollback(True)
+                            return self.CODE_REJECTED
+                        transition_method()
+                    payment.save(update_fields=['status', 'is_test', 'transaction_id', 'updated_at'])
+        except CloudPayment.DoesNotExist:
+            return self.CODE_INVALID_INVOICE
+        except (CloudPayment.MultipleObjectsReturned, TransitionNotAllowed):
+            return self.CODE_REJECTED
+
+        callback = payment_registry.status_changed_callback
+        if callback is not None:
+            # Вне транзакции вызывается сразу, в транзакции (например, в задаче асинхронной обработки) -
+            # после ее фиксации, чтобы callback не видел незафиксированный статус и не задерживал блокировки
+            transaction.on_commit(lambda: self._run_status_callback(callback, payment))
+
+        return self.CODE_SUCCESS
+
+    @staticmethod
+    def _run_status_callback(callback, payment) -> None:
+        with tracer.span('cloudpayments.status_callback'):
+            callback(payment)
+
+
+cloudpayments_service = CloudPaymentsService()
@@ -0,0 +1,139 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from ..models import ProcessedWebhook
+
+
+DEFAULT_WEBHOOK_DEDUP_SETTINGS = {
+    'enabled': True,
+    'lru_size': 10000,  # Количество последних уведомлений, которые помнит каждый процесс
+    'retention': timedelta(days=30),  # Сколько хранить обработанные уведомления в БД
+}
+
+
+def get_dedup_settings() -> dict:
+    return {**DEFAULT_WEBHOOK_DEDUP_SETTINGS, **getattr(settings, 'GARPIX_ORDER_WEBHOOK_DEDUP', {})}
+
+
+class WebhookDeduplicator:
+    """
+    Дедупликация уведомлений провайдеров по ключу (провайдер, id транзакции, статус).
+    Недавние ключи хранятся в LRU в памяти процесса, остальные проверяются по уникальной таблице ProcessedWebhook.
+    В LRU ключ попадает только после фиксации транзакции, в которой уведомление было обработано.
+    """
+
+    def __init__(self) -> None:
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return get_dedup_settings()['enabled']
+
+    def _remember_in_process(self, key: tuple) -> None:
+        max_size = get_dedup_settings()['lru_size']
+        with self._lock:
+            self._keys[key] = True
+            self._keys.move_to_end(key)
+            while len(self._keys) > max_size:
+                self._keys.popitem(last=False)
+
+    def is_cached(self, provider: str, transaction_id: str, status: str) -> bool:
+        """Проверка только по памяти процесса, без запросов к БД"""
+        if not transaction_id or not self.enabled:
+            return False
+        key = (provider, str(transaction_id), str(status))
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+        return True
+
+    def is_duplicate(self, provider: str, transaction_id: str, status: str) -> bool:
+        if not transaction_id or not self.enabled:
+            return False
+        if self.is_cached(provider, transaction_id, status):
+            return True
+        key = (provider, str(transaction_id), str(status))
+        exists = ProcessedWebhook.objects.filter(
+            provider=key[0], transaction_id=key[1], status=key[2]
+        ).exists()
+        if exists:
+            self._remember_in_process(key)
+        return exists
+
+    def remember(self, provider: str, transaction_id: str, status: str) -> None:
+        """
+        Отмечает уведомление обработанным. Вызывается в транзакции, в которой применены изменения платежа,
+        поэтому при ее откате уведомление будет обработано повторно.
+        """
+        if not transaction_id or not self.enabled:
+            return
+        key = (provider, str(transaction_id), str(status))
+        ProcessedWebhook.objects.bulk_create(
+            [ProcessedWebhook(provider=key[0], transaction_id=key[1], status=key[2])], ignore_conflicts=True
+        )
+        transaction.on_commit(lambda: self._remember_in_process(key))
+
+    def claim(self, provider: str, transaction_id: str, status: str) -> bool:
+        """
+        Отмечает уведомление обработанным одним INSERT с пропуском конфликта и возвращает False, если отметка уже есть
+        (повтор). Заменяет пару is_duplicate и remember без лишнего запроса. Вызывается первым запросом транзакции,
+        в которой применяются изменения платежа: при ее откате отметка снимается, а параллельный повтор ждет
+        ее завершения на уникальном индексе.
+        """
+        if not transaction_id or not self.enabled:
+            return True
+        key = (provider, str(transaction_id), str(status))
+        using = router.db_for_write(ProcessedWebhook)
+        connection = connections[using]
+        opts = ProcessedWebhook._meta
+        fields = [opts.get_field(name) for name in ('provider', 'transaction_id', 'status', 'created_at')]
+        if django.VERSION >= (4, 1):
+            from django.db.models.constants import OnConflict
+
+            prefix = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)
+            suffix = connection.ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None)
+        else:
+            prefix = connection.ops.insert_statement(ignore_conflicts=True)
+            suffix = connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        params = [field.get_db_prep_save(value, connection) for field, value in zip(fields, key + (timezone.now(),))]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'{prefix} {connection.ops.quote_name(opts.db_table)} ({columns}) VALUES (%s, %s, %s, %s) {suffix}',
+                params
+            )
+            claimed = cursor.rowcount == 1
+        if claimed:
+            transaction.on_commit(lambda: self._remember_in_process(key), using=using)
+        else:
+            self._remember_in_process(key)
+        return claimed
+
+    def forget_all(self) -> None:
+        with self._lock:
+            self._keys.clear()
+
+    def cleanup(self, retention: timedelta = None, batch_size: int = 1000) -> int:
+        """Удаляет уведомления старше retention порциями по batch_size. Возвращает количество удаленных"""
+        retention = retention if retention is not None else get_dedup_settings()['retention']
+        border = timezone.now() - retention
+        deleted = 0
+        while True:
+            pks = list(
+                ProcessedWebhook.objects.filter(created_at__lt=border).order_by('pk').values_list('pk', flat=True)[
+                    :batch_size]
+            )
+            if not pks:
+                return deleted
+            deleted += ProcessedWebhook.objects.filter(pk__in=pks).delete()[0]
+
+
+webhook_deduplicator = WebhookDeduplicator()
@@ -0,0 +1,247 @@
+import csv
+import io
+import itertools
+import json
+from collections import namedtuple
+from datetime import date, datetime
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+from ..models import BaseOrder, BaseOrderItem, BasePayment
+
+
+DEFAULT_EXPORT_SETTINGS = {
+    'chunk_size': 2000,  # Количество строк, читаемых из БД за раз (размер выборки серверного курсора)
+}
+
+
+def get_export_settings() -> dict:
+    return {**DEFAULT_EXPORT_SETTINGS, **getattr(settings, 'GARPIX_ORDER_EXPORT', {})}
+
+
+# name - имя колонки в выгрузке, lookup - путь для values(), field - поле модели (None для колонки типа)
+Column = namedtuple('Column', ('name', 'lookup', 'field'))
+
+TYPE_COLUMN = 'type'
+
+
+def _polymorphic_children(model, prefix: str = '', classes=None):
+    """
+    Конкретные наследники модели с путем к ним от базовой модели через обратные связи parent_link,
+    например ('cloudpayment', CloudPayment). Наследники наследников идут сразу за своим родителем,
+    абстрактные промежуточные классы (AbstractSberPayment) пропускаются.
+    """
+    for child in (classes if classes is not None else model.__subclasses__()):
+        if child._meta.abstract:
+            yield from _polymorphic_children(model, prefix, child.__subclasses__())
+            continue
+        if child._meta.proxy or not child._meta.managed:
+            continue
+        parent_link = child._meta.get_ancestor_link(model)
+        if parent_link is None:
+            continue
+        path = f'{prefix}{parent_link.related_query_name()}'
+        yield path, child
+        yield from _polymorphic_children(child, f'{path}__')
+
+
+def get_columns(model) -> list:
+    """
+    Колонки выгрузки: поля базовой модели, тип объекта и поля всех полиморфных наследников.
+    Поля наследника называются по пути к нему, например cloudpayment__order_number,
+    поэтому одноименные поля разных наследников не смешиваются.
+    """
+    columns = []
+    for field in model._meta.concrete_fields:
+        if field.name == 'polymorphic_ctype':
+            columns.append(Column(TYPE_COLUMN, field.attname, None))  # app_label.model вместо id ContentType
+            continue
+        columns.append(Column(field.attname, field.attname, field))
+    for path, child in _polymorphic_children(model):
+        for field in child._meta.local_concrete_fields:
+            if field.remote_field is not None and field.remote_field.parent_link:
+                continue
+            lookup = f'{path}__{field.attname}'
+            columns.append(Column(lookup, lookup, field))
+    return columns
+
+
+def _type_name(ctype_id) -> str:
+    if ctype_id is None:
+        return ''
+    content_type = ContentType.objects.get_for_id(ctype_id)  # кэшируется ContentType-менеджером
+    return f'{content_type.app_label}.{content_type.model}'
+
+
+class CsvWriter:
+    binary = False
+
+    def __init__(self, stream, columns: list) -> None:
+        self.writer = csv.writer(stream)
+        self.writer.writerow([column.name for column in columns])
+
+    @staticmethod
+    def format_value(value):
+        if value is None:
+            return ''
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False, cls=DjangoJSONEncoder)
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        return value
+
+    def write_rows(self, rows: list) -> None:
+        self.writer.writerows([self.format_value(value) for value in row] for row in rows)
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlWriter:
+    binary = False
+
+    def __init__(self, stream, columns: list) -> None:
+        self.stream = stream
+        self.names = [column.name for column in columns]
+        self.encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+    def write_rows(self, rows: list) -> None:
+        self.stream.write(''.join(self.encoder.encode(dict(zip(self.names, row))) + '\n' for row in rows))
+
+    def close(self) -> None:
+        pass
+
+
+class ParquetWriter:
+    """
+    Колоночная выгрузка в Parquet, каждая порция строк записывается отдельной группой строк.
+    Требует pyarrow (pip install garpix_order[parquet]).
+    """
+    binary = True
+
+    def __init__(self, stream, columns: list) -> None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImproperlyConfigured('Для выгрузки в Parquet установите pyarrow: pip install garpix_order[parquet]')
+        self.pa = pyarrow
+        self.json_columns = [isinstance(column.field, models.JSONField) for column in columns]
+        self.schema = pyarrow.schema([(column.name, self.get_arrow_type(column.field)) for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(stream, self.schema)
+
+    def get_arrow_type(self, field):
+        pa = self.pa
+        if field is None:
+            return pa.string()
+        if field.remote_field is not None:
+            field = field.target_field
+        if isinstance(field, models.DecimalField):
+            return pa.decimal128(field.max_digits, field.decimal_places)
+        if isinstance(field, models.DateTimeField):
+            return pa.timestamp('us', tz='UTC')
+        if isinstance(field, models.DateField):
+            return pa.date32()
+        if isinstance(field, models.BooleanField):
+            return pa.bool_()
+        if isinstance(field, (models.IntegerField, models.AutoField)):
+            return pa.int64()
+        if isinstance(field, models.FloatField):
+            return pa.float64()
+        return pa.string()
+
+    def write_rows(self, rows: list) -> None:
+        values = list(zip(*rows)) if rows else [() for _ in self.json_columns]
+        arrays = []
+        for column_values, is_json, arrow_field in zip(values, self.json_columns, self.schema):
+            if is_json:
+                column_values = [
+                    None if value is None else json.dumps(value, ensure_ascii=False, cls=DjangoJSONEncoder)
+                    for value in column_values
+                ]
+            elif arrow_field.type == self.pa.string():
+                column_values = [None if value is None else str(value) for value in column_values]
+            arrays.append(self.pa.array(column_values, type=arrow_field.type))
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class DataExporter:
+    """
+    Потоковая выгрузка платежей, заказов и позиций заказов. Строки читаются через values().iterator(chunk_size),
+    на PostgreSQL это серверный курсор, поэтому память не зависит от объема выгрузки.
+    Полиморфные наследники присоединяются к базовой таблице в том же запросе, объекты моделей не создаются.
+    """
+    models = {
+        'payments': BasePayment,
+        'orders': BaseOrder,
+        'items': BaseOrderItem,
+    }
+    writers = {
+        'csv': CsvWriter,
+        'jsonl': JsonlWriter,
+        'parquet': ParquetWriter,
+    }
+
+    def get_queryset(self, name: str, created_from: datetime = None, created_to: datetime = None):
+        """
+        Выборка для выгрузки с фильтром по дате создания [created_from, created_to).
+        Платежи и заказы фильтруются и сортируются по индексу (created_at, id), позиции - по дате создания заказа.
+        """
+        model = self.models[name]
+        created_at = 'order__created_at' if model is BaseOrderItem else 'created_at'
+        queryset = model.objects.non_polymorphic()
+        if created_from is not None:
+            queryset = queryset.filter(**{f'{created_at}__gte': created_from})
+        if created_to is not None:
+            queryset = queryset.filter(**{f'{created_at}__lt': created_to})
+        return queryset.order_by('pk') if model is BaseOrderItem else queryset.order_by('created_at', 'pk')
+
+    def iter_chunks(self, queryset, columns: list, chunk_size: int):
+        type_index = [column.name for column in columns].index(TYPE_COLUMN)
+        rows = queryset.values_list(*[column.lookup for column in columns]).iterator(chunk_size=chunk_size)
+        chunk = []
+        for row in rows:
+            row = list(row)
+            row[type_index] = _type_name(row[type_index])
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def write_chunks(self, queryset, fmt: str, stream, chunk_size: int = None):
+        """
+        Пишет выборку queryset (платежи, заказы или позиции) в stream в формате fmt порциями,
+        после каждой порции отдает количество записанных в нее строк.
+        Для csv и jsonl stream текстовый, для parquet - бинарный.
+        """
+        chunk_size = chunk_size or get_export_settings()['chunk_size']
+        columns = get_columns(queryset.model)
+        writer = self.writers[fmt](stream, columns)
+        for chunk in self.iter_chunks(queryset.non_polymorphic(), columns, chunk_size):
+            writer.write_rows(chunk)
+            yield len(chunk)
+        writer.close()
+
+    def export(self, queryset, fmt: str, stream, chunk_size: int = None) -> int:
+        """Выгружает queryset в stream. Возвращает количество выгруженных строк"""
+        return sum(self.write_chunks(queryset, fmt, stream, chunk_size))
+
+    def iter_export(self, queryset, fmt: str, chunk_size: int = None):
+        """Текстовая выгрузка (csv, jsonl) частями для StreamingHttpResponse: в памяти не больше одной порции"""
+        buffer = io.StringIO()
+        for _ in itertools.chain(self.write_chunks(queryset, fmt, buffer, chunk_size), [0]):
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+
+data_exporter = DataExporter()
@@ -0,0 +1,221 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import time
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from ..models import BasePayment, RobokassaPayment
+from ..registry import payment_registry
+from ..utils import bulk_create_polymorphic
+from .journal import payment_journal
+from .robokassa import RobokassaService
+from .sber_async import async_sber_service
+from .transport import AsyncRateLimiter
+
+
+logger = logging.getLogger(__name__)
+
+PaymentStatus = BasePayment.PaymentStatus
+
+DEFAULT_INVOICING_SETTINGS = {
+    'chunk_size': 1000,  # Количество заказов, обрабатываемых за раз (один bulk INSERT на таблицу)
+    'sber_concurrency': 20,  # Максимальное количество одновременных регистраций заказов в Сбере
+    'sber_rate_limit': 20,  # Максимальное количество регистраций в Сбере в секунду
+}
+
+
+def get_invoicing_settings() -> dict:
+    return {**DEFAULT_INVOICING_SETTINGS, **getattr(settings, 'GARPIX_ORDER_INVOICING', {})}
+
+
+class RobokassaSigner:
+    """
+    Подпись ссылок на оплату Robokassa без повторной обработки постоянных частей:
+    хэш от "логин:" и неизменяемые части ссылки вычисляются один раз, сумма форматируется через Decimal.quantize.
+    Ссылки совпадают с RobokassaService.generate_payment_link.
+    """
+    CENTS = Decimal('0.01')
+
+    def __init__(self, service=RobokassaService) -> None:
+        self.password_1 = service.password_1
+        self._hash = getattr(hashlib, service.algorithm.lower(), hashlib.md5)(f'{service.login}:'.encode())
+        self._prefix = f'{service.payment_url}?{urlencode({"MerchantLogin": service.login})}&OutSum='
+        self._suffix = f'&{urlencode({"IsTest": service.is_test})}'
+
+    def format_amount(self, amount: Decimal) -> str:
+        return str(Decimal(amount).quantize(self.CENTS))
+
+    def sign(self, out_sum: str, invoice_id) -> str:
+        signature = self._hash.copy()
+        signature.update(f'{out_sum}:{invoice_id}:{self.password_1}'.encode())
+        return signature.hexdigest()
+
+    def link(self, invoice_id, amount: Decimal) -> str:
+        out_sum = self.format_amount(amount)
+        signature = self.sign(out_sum, invoice_id)
+        return f'{self._prefix}{out_sum}&InvId={invoice_id}&SignatureValue={signature}{self._suffix}'
+
+
+class InvoicingResult:
+    """
+    Итоги выставления счетов: ссылки на оплату (id заказа, id платежа, ссылка), ошибки (id заказа, текст ошибки)
+    и пропускная способность.
+    """
+
+    def __init__(self) -> None:
+        self.links = []
+        self.failures = []
+        self.elapsed = 0.0
+        self._started_at = time.monotonic()
+
+    def finish(self) -> None:
+        self.elapsed = time.monotonic() - self._started_at
+
+    @property
+    def throughput(self) -> float:
+        if not self.elapsed:
+            return 0.0
+        return (len(self.links) + len(self.failures)) / self.elapsed
+
+    def as_dict(self) -> dict:
+        return {
+            'created': len(self.links),
+            'failed': len(self.failures),
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput, 2),
+        }
+
+
+class MassInvoicingService:
+    """
+    Массовое выставление счетов по выборке заказов. Заказы читаются порциями по первичному ключу,
+    платежи каждой порции создаются через bulk_create_polymorphic.
+    """
+
+    def __init__(self, **options) -> None:
+        self.options = {
+            **get_invoicing_settings(),
+            **{key: value for key, value in options.items() if value is not None},
+        }
+
+    def iter_chunks(self, orders):
+        orders = orders.non_polymorphic().only('pk', 'number', 'total_amount').order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(orders.filter(pk__gt=last_pk)[:self.options['chunk_size']])
+            if not chunk:
+                return
+            last_pk = chunk[-1].pk
+            yield chunk
+
+    def invoice_robokassa(self, orders) -> InvoicingResult:
+        """Создает платежи Robokassa на сумму заказов и подписывает ссылки на оплату"""
+        result = InvoicingResult()
+        signer = RobokassaSigner()
+        for chunk in self.iter_chunks(orders):
+            payments = []
+            for order in chunk:
+                if order.total_amount <= 0:
+                    result.failures.append((order.pk, 'It is not possible to pay 0 amount'))
+                    continue
+                payments.append(RobokassaPayment(
+                    title=f'Платеж по заказу № {order.pk}', order=order, amount=order.total_amount
+                ))
+            bulk_create_polymorphic(payments)
+            result.links.extend(
+                (payment.order_id, payment.pk, signer.link(payment.pk, payment.amount)) for payment in payments
+            )
+        result.finish()
+        logger.info(f'Выставлены счета Robokassa: {result.as_dict()}')
+        return result
+
+    async def _register_sber(self, order, limiter: AsyncRateLimiter, semaphore: asyncio.Semaphore, **kwargs):
+        params = async_sber_service._make_params_for_create_payment(order=order, **kwargs)
+        await limiter.acquire()
+        async with semaphore:
+            return params, await async_sber_service._request(url=async_sber_service.URLS['register'], params=params)
+
+    def _save_sber_chunk(self, chunk: list, responses: list, result: InvoicingResult) -> None:
+        """
+        Создает платежи порции через bulk_create_polymorphic, в сводках они учитываются по сигналу post_bulk_create
+        (или post_save, если БД не возвращает ключи из множественного INSERT). Ответы Сбера добавляются в журнал
+        платежей одним INSERT, как данные провайдера. Неуспешные регистрации затем
+        переводятся в FAILED переходом failed, поэтому журнал, сводки и метрики видят их так же, как платежи
+        из SberService.create_payment.
+        """
+        payment_model = async_sber_service.get_payment_model()
+        payments = []
+        provider_data = []
+        failed_payments = []
+        for order, response in zip(chunk, responses):
+            if isinstance(response, Exception):
+                result.failures.append((order.pk, str(response) or response.__class__.__name__))
+                continue
+            params, data = response
+            params = dict(params)
+            params.pop('token', None)
+            error_code = data.get('errorCode')
+            failed = (error_code and int(error_code) != 0) or not data.get('orderId') or not data.get('formUrl')
+            payment = payment_model(
+                title=f'Платеж по заказу № {order.pk}',
+                order=order,
+                amount=order.total_amount,
+                external_payment_id='' if failed else data['orderId'],
+                payment_link='' if failed else data['formUrl'],
+                client_data=params,
+            )
+            payments.append(payment)
+            provider_data.append(data)
+            if failed:
+                failed_payments.append(payment)
+                result.failures.append((order.pk, data.get('errorMessage') or f'errorCode {error_code}'))
+
+        with transaction.atomic():
+            bulk_create_polymorphic(payments)
+            payment_journal.bulk_record_provider_data(payments, provider_data)
+            callback = payment_registry.status_changed_callback
+            for payment in failed_payments:
+                payment.failed()
+                payment.save(update_fields=['status', 'updated_at'])
+                if callback is not None:
+                    transaction.on_commit(functools.partial(callback, payment))
+        result.links.extend(
+            (payment.order_id, payment.pk, payment.payment_link) for payment in payments
+            if payment.status != PaymentStatus.FAILED
+        )
+
+    async def ainvoice_sber(self, orders, **kwargs) -> InvoicingResult:
+        result = InvoicingResult()
+        limiter = AsyncRateLimiter(self.options['sber_rate_limit'])
+        semaphore = asyncio.Semaphore(self.options['sber_concurrency'])
+        chunks = self.iter_chunks(orders)
+
+        while True:
+            chunk = await sync_to_async(next, thread_sensitive=True)(chunks, None)
+            if chunk is None:
+                break
+            responses = await asyncio.gather(
+                *(self._register_sber(order, limiter, semaphore, **kwargs) for order in chunk), return_exceptions=True
+            )
+            await sync_to_async(self._save_sber_chunk, thread_sensitive=True)(chunk, responses, result)
+
+        result.finish()
+        logger.info(f'Выставлены счета Сбера: {result.as_dict()}')
+        return result
+
+    def invoice_sber(self, orders, **kwargs) -> InvoicingResult:
+        """
+        Регистрирует заказы в Сбере конкурентно с ограничением частоты (kwargs передаются в register.do,
+        обязателен returnUrl) и создает платежи порцией. Неуспешные регистрации сохраняются платежами в статусе FAILED,
+        как в SberService.create_payment.
+        """
+        return async_to_sync(self.ainvoice_sber)(orders, **kwargs)
+
+
+mass_invoicing = MassInvoicingService()
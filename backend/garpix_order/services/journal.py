@@ -0,0 +1,76 @@
+from django.conf import settings
+
+from ..models import PaymentEvent
+
+
+EventKind = PaymentEvent.EventKind
+
+DEFAULT_PAYMENT_JOURNAL_SETTINGS = {
+    'transitions': True,  # Записывать в журнал переходы статусов платежей
+    'compress_threshold': 4096,  # Данные провайдера длиннее стольких байт (JSON) сжимаются; None - не сжимать
+}
+
+
+def get_journal_settings() -> dict:
+    return {**DEFAULT_PAYMENT_JOURNAL_SETTINGS, **getattr(settings, 'GARPIX_ORDER_PAYMENT_JOURNAL', {})}
+
+
+class PaymentJournal:
+    """
+    Журнал платежей: переходы статусов и данные провайдеров добавляются отдельными записями PaymentEvent,
+    строка платежа при этом не перезаписывается. Записи для многих платежей создаются одним bulk_create.
+    """
+
+    def make_transition_event(self, payment_id: int, name: str, source: str, target: str) -> PaymentEvent:
+        return PaymentEvent(payment_id=payment_id, kind=EventKind.TRANSITION, name=name, source=source, target=target)
+
+    def make_provider_data_event(self, payment_id: int, data) -> PaymentEvent:
+        return PaymentEvent(
+            payment_id=payment_id, kind=EventKind.PROVIDER_DATA,
+            **PaymentEvent.pack(data, get_journal_settings()['compress_threshold'])
+        )
+
+    def add_transition(self, payment, name: str, source: str, target: str) -> None:
+        """Запоминает переход в объекте платежа, запись добавляется при его сохранении (BasePayment.save)"""
+        if get_journal_settings()['transitions']:
+            payment._pending_transitions = getattr(payment, '_pending_transitions', []) + [(name, source, target)]
+
+    def record_pending_transitions(self, payment) -> None:
+        transitions = payment.__dict__.pop('_pending_transitions', None)
+        if transitions:
+            self.bulk_record([self.make_transition_event(payment.pk, *transition) for transition in transitions])
+
+    def record_bulk_transition(self, pks: list, name: str, source: str, target: str) -> None:
+        if get_journal_settings()['transitions']:
+            self.bulk_record([self.make_transition_event(pk, name, source, target) for pk in pks])
+
+    def record_provider_data(self, payment, data) -> PaymentEvent:
+        event = self.make_provider_data_event(payment.pk, data)
+        event.save(force_insert=True)
+        return event
+
+    def bulk_record_provider_data(self, payments: list, data: list) -> None:
+        """
+        Добавляет данные провайдера для многих сохраненных платежей (по одному элементу data на платеж) и одним UPDATE
+        на порцию запоминает ссылки на записи в provider_event.
+        """
+        from ..models import BasePayment
+        from ..utils import bulk_create_polymorphic
+
+        events = bulk_create_polymorphic(
+            [self.make_provider_data_event(payment.pk, payment_data) for payment, payment_data in zip(payments, data)]
+        )
+        for payment, event in zip(payments, events):
+            payment.provider_event = event
+        BasePayment._base_manager.bulk_update(payments, ['provider_event'], batch_size=1000)
+
+    def bulk_record(self, events: list, batch_size: int = 1000) -> list:
+        """Добавляет записи одним INSERT на порцию"""
+        return PaymentEvent.objects.bulk_create(events, batch_size=batch_size)
+
+    def timeline(self, payment_id: int):
+        """Записи журнала платежа в порядке добавления (индекс garpix_order_event_pay_idx)"""
+        return PaymentEvent.objects.filter(payment_id=payment_id).order_by('pk')
+
+
+payment_journal = PaymentJournal()
@@ -1,12 +1,33 @@
 import decimal
 import hashlib
-from datetime import datetime
+import logging
 from urllib import parse
 
-import requests
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 
 from garpix_order.models.payments.recurring import Recurring
+from garpix_order.utils import CacheSemaphore
+from garpix_order.tracing import traced
+from .transport import get_transport
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RECURRING_SETTINGS = {
+    'chunk_size': 500,  # Количество заказов, выбираемых из БД за один раз
+    'concurrency': 10,  # Максимальное количество одновременных списаний через Robokassa
+    'retry_countdown': 5,  # Через сколько секунд повторить задачу, если все слоты заняты
+    'max_retries': 720,  # Сколько раз повторять задачу, пока слоты заняты; заказ останется к следующему запуску
+    # Сколько секунд живет слот семафора, если воркер не освободил его (упал). Списание должно укладываться в это время.
+    # Семафор хранится в кэше Django: ограничение общее для всех воркеров, только если в CACHES настроен общий кэш
+    'lease_timeout': 300,
+}
+
+
+def get_recurring_settings() -> dict:
+    return {**DEFAULT_RECURRING_SETTINGS, **getattr(settings, 'GARPIX_ORDER_RECURRING', {})}
 
 
 class RobokassaService:
@@ -17,6 +38,7 @@ class RobokassaService:
     password_2 = settings.ROBOKASSA['PASSWORD_2']
     is_test = settings.ROBOKASSA['IS_TEST']
     algorithm = settings.ROBOKASSA['ALGORITHM']
+    transport = get_transport('robokassa', timeout=10)
 
     @classmethod
     def get_amount_with_decimals(cls, amount: decimal) -> str:
@@ -58,33 +80,115 @@ class RobokassaService:
                 return True, ''
             return False, 'Invalid signature'
         prev_payment = payment.order.payments.exclude(id=payment.id).order_by('-id').first()
+        if prev_payment is None:
+            return False, 'Previous payment not found'
         return cls.send_recurring_request(payment, prev_payment)
 
     @classmethod
+    @traced('robokassa.recurring_request')
     def send_recurring_request(cls, payment, prev_payment) -> (bool, str):
+        out_sum = cls.get_amount_with_decimals(payment.amount)
         data = {
             'MerchantLogin': cls.login,
             'InvoiceID': payment.id,
             'PreviousInvoiceID': prev_payment.id,
-            'SignatureValue': cls.calculate_signature(cls.login, payment.total_amount, payment.id, cls.password_1),
-            'OutSum': payment.amount,
+            'SignatureValue': cls.calculate_signature(cls.login, out_sum, payment.id, cls.password_1),
+            'OutSum': out_sum,
             'IsTest': cls.is_test
         }
-        res = requests.post(cls.recurring_payment_url, data=data)
+        res = cls.transport.post(cls.recurring_payment_url, data=data)
         if f"OK{payment.id}" != res.text:
             return False, res.text
         return True, res.text
 
+    @staticmethod
+    def get_billing_cycle(next_payment_date) -> str:
+        """Идентификатор периода списания: дата очередного платежа"""
+        return next_payment_date.strftime('%Y%m%d')
+
     @classmethod
-    def create_recurring_payments(cls):
-        from garpix_order.models import BaseOrder, RobokassaPayment
+    def get_due_recurring_orders(cls, now=None):
+        """Заказы, по которым наступила дата очередного рекуррентного платежа"""
+        from garpix_order.models import BaseOrder
+        now = now or timezone.now()
         recurring_objs = Recurring.active_objects.filter(payment_system=Recurring.RecurringPaymentSystem.ROBOKASSA,
-                                                         end_at__gt=datetime.now())
-        orders_to_pay = BaseOrder.objects.filter(recurring__in=recurring_objs, next_payment_date=datetime.now())
+                                                         end_at__gt=now)
+        return BaseOrder.objects.non_polymorphic().filter(recurring__in=recurring_objs, next_payment_date__lte=now)
+
+    @classmethod
+    def create_recurring_payments(cls, chunk_size=None) -> int:
+        """
+        Выбирает заказы для рекуррентного списания порциями по первичному ключу и ставит
+        списание каждого заказа в очередь Celery. Возвращает количество поставленных задач.
+        """
+        from garpix_order.tasks import charge_recurring_order
+        chunk_size = chunk_size or get_recurring_settings()['chunk_size']
+        orders_to_pay = cls.get_due_recurring_orders().order_by('pk')
+        last_pk = 0
+        dispatched = 0
+
+        while True:
+            chunk = list(orders_to_pay.filter(pk__gt=last_pk).values_list('pk', 'next_payment_date')[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            for order_id, next_payment_date in chunk:
+                charge_recurring_order.delay(order_id, cls.get_billing_cycle(next_payment_date))
+            dispatched += len(chunk)
+
+        return dispatched
+
+    @classmethod
+    def charge_recurring_order(cls, order_id: int, billing_cycle: str):
+        """
+        Списывает рекуррентный платеж по заказу за период billing_cycle.
+        Платеж создается с ключом идемпотентности (заказ, период) и захватывается под блокировкой заказа,
+        поэтому повторный запуск за тот же период не приводит к повторному списанию.
+        Если предыдущий период оплачен полностью, до списания открывается новый: сумма заказа увеличивается
+        на сумму последнего успешного платежа, и новый платеж проходит проверки оплаты заказа.
+        """
+        from garpix_order.models import BaseOrder, BasePayment, RobokassaPayment
+        with transaction.atomic():
+            order = BaseOrder.objects.non_polymorphic().select_for_update().get(pk=order_id)
+            if order.next_payment_date is None or cls.get_billing_cycle(order.next_payment_date) != billing_cycle:
+                return None  # период уже оплачен и дата следующего платежа сдвинута
+            idempotency_key = f'robokassa:recurring:{order_id}:{billing_cycle}'
+            payment = RobokassaPayment.objects.filter(idempotency_key=idempotency_key).first()
+            if payment is None:
+                if order.status == BaseOrder.OrderStatus.PAYED_FULL:
+                    period_amount = BasePayment.objects.non_polymorphic().filter(
+                        order=order, status=BasePayment.PaymentStatus.SUCCEEDED
+                    ).order_by('-pk').values_list('amount', flat=True).first()
+                    order.open_billing_period(period_amount)
+                    order.save_versioned()
+                payment = RobokassaPayment.objects.create(
+                    idempotency_key=idempotency_key,
+                    order=order,
+                    amount=order.total_amount - order.payed_amount,
+                    payment_type=RobokassaPayment.PaymentType.AUTO,
+                    title=f'Рекуррентный платеж по заказу № {order_id} за {billing_cycle}',
+                )
+            if payment.status != RobokassaPayment.PaymentStatus.CREATED:
+                return payment
+            if not payment.can_succeeded():
+                msg = f'Сумма платежа {payment.amount} превышает остаток по заказу'
+                logger.warning(f'Рекуррентный платеж {payment.pk} по заказу {order_id} не проведен: {msg}')
+                payment.set_provider_data({'msg': msg}, save=False)
+                payment.failed()
+                payment.save()
+                return payment
+            payment.pending()
+            payment.save()
+
+        result, msg = payment.process_payment(data={}, auto=True)
+        if not result:
+            logger.warning(f'Рекуррентный платеж {payment.pk} по заказу {order_id} не прошел: {msg}')
+        return payment
 
-        for obj in orders_to_pay:
-            payment = RobokassaPayment.objects.create(order=obj, amount=obj.total_amount, payment_type=RobokassaPayment.PaymentType.AUTO)
-            payment.pay(data={}, auto=True)
+    @staticmethod
+    def get_concurrency_semaphore() -> CacheSemaphore:
+        options = get_recurring_settings()
+        return CacheSemaphore('robokassa:recurring', limit=options['concurrency'], timeout=options['lease_timeout'])
 
 
 robokassa_service = RobokassaService()
@@ -0,0 +1,184 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from ..models import BasePayment, PaymentRollup
+
+
+PaymentStatus = BasePayment.PaymentStatus
+
+DEFAULT_PAYMENT_ROLLUP_SETTINGS = {
+    'enabled': False,  # Обновлять сводки при создании, удалении и переходах статуса платежей
+    'dashboard_days': 30,  # За сколько дней показывать выручку на панели в админке
+}
+
+
+def get_rollup_settings() -> dict:
+    return {**DEFAULT_PAYMENT_ROLLUP_SETTINGS, **getattr(settings, 'GARPIX_ORDER_PAYMENT_ROLLUPS', {})}
+
+
+class PaymentRollupService:
+    """
+    Сводки по платежам за день, тип платежа и статус. Изменения применяются после фиксации транзакции
+    отдельным коротким UPDATE, чтобы строка сводки не оставалась заблокированной на время транзакции платежа,
+    а откат транзакции не менял сводку. Платежи, созданные стандартным bulk_create или измененные через update(),
+    в сводки не попадают, их учитывает backfill.
+    """
+
+    @property
+    def enabled(self) -> bool:
+        return get_rollup_settings()['enabled']
+
+    def apply_delta(self, day: date, content_type_id: int, status: str, count: int, amount: Decimal) -> None:
+        key = {'day': day, 'content_type_id': content_type_id, 'status': status}
+        changes = {'count': F('count') + count, 'amount': F('amount') + amount}
+        if PaymentRollup.objects.filter(**key).update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                PaymentRollup.objects.create(**key, count=count, amount=amount)
+        except IntegrityError:
+            # Строку создали параллельно
+            PaymentRollup.objects.filter(**key).update(**changes)
+
+    def record(self, payment, status: str, sign: int) -> None:
+        """Учитывает платеж в сводке по статусу status (sign=1) или убирает его оттуда (sign=-1)"""
+        if not self.enabled or payment.pk is None or payment.created_at is None:
+            return
+        day = timezone.localdate(payment.created_at)
+        content_type_id = payment.polymorphic_ctype_id
+        amount = payment.amount
+        transaction.on_commit(lambda: self.apply_delta(day, content_type_id, status, sign, sign * amount))
+
+    def record_transition(self, payment, source: str, target: str) -> None:
+        if source == target:
+            return
+        self.record(payment, source, -1)
+        self.record(payment, target, 1)
+
+    def add_transition(self, payment, source: str, target: str) -> None:
+        """
+        Запоминает переход в объекте платежа, сводки меняются при его сохранении (BasePayment.save).
+        Переход еще не сохраненного платежа не запоминается: при создании платеж учитывается по итоговому статусу.
+        """
+        if self.enabled and payment.pk is not None and source != target:
+            payment._pending_rollup_transitions = getattr(payment, '_pending_rollup_transitions', []) + [
+                (source, target)
+            ]
+
+    def record_pending_transitions(self, payment) -> None:
+        for source, target in payment.__dict__.pop('_pending_rollup_transitions', None) or ():
+            self.record_transition(payment, source, target)
+
+    def record_bulk_create(self, payments: list) -> None:
+        """Учитывает созданные без Model.save() платежи в сводках по их статусам, по одному UPDATE на строку сводки"""
+        if not self.enabled:
+            return
+        deltas = {}
+        for payment in payments:
+            key = (timezone.localdate(payment.created_at), payment.polymorphic_ctype_id, payment.status)
+            count, amount = deltas.get(key, (0, Decimal(0)))
+            deltas[key] = (count + 1, amount + payment.amount)
+
+        def apply():
+            for (day, content_type_id, status), (count, amount) in deltas.items():
+                self.apply_delta(day, content_type_id, status, count, amount)
+
+        transaction.on_commit(apply)
+
+    def record_bulk_transition(self, pks: list, source: str, target: str) -> None:
+        """Переносит платежи pks из сводок по статусу source в сводки по target, один агрегирующий запрос"""
+        if not self.enabled or source == target:
+            return
+        rows = list(BasePayment.objects.non_polymorphic().filter(pk__in=pks).annotate(
+            day=TruncDate('created_at')
+        ).values_list('day', 'polymorphic_ctype_id').annotate(
+            total_count=Count('pk'),
+            total_amount=Coalesce(Sum('amount'), Decimal(0), output_field=DecimalField()),
+        ).order_by())
+
+        def apply():
+            for day, content_type_id, count, amount in rows:
+                self.apply_delta(day, content_type_id, source, -count, -amount)
+                self.apply_delta(day, content_type_id, target, count, amount)
+
+        transaction.on_commit(apply)
+
+    def backfill(self, date_from: date = None, date_to: date = None) -> int:
+        """
+        Пересчитывает сводки за дни [date_from, date_to] (все дни, если не заданы) одним агрегирующим запросом
+        по платежам. Возвращает количество строк сводки.
+        """
+        payments = BasePayment.objects.non_polymorphic()
+        rollups = PaymentRollup.objects.all()
+        if date_from is not None:
+            payments = payments.filter(created_at__gte=self._day_start(date_from))
+            rollups = rollups.filter(day__gte=date_from)
+        if date_to is not None:
+            payments = payments.filter(created_at__lt=self._day_start(date_to + timedelta(days=1)))
+            rollups = rollups.filter(day__lte=date_to)
+
+        rows = payments.annotate(day=TruncDate('created_at')).values(
+            'day', 'polymorphic_ctype_id', 'status'
+        ).annotate(
+            total_count=Count('pk'),
+            total_amount=Coalesce(Sum('amount'), Decimal(0), output_field=DecimalField()),
+        ).order_by()
+
+        with transaction.atomic():
+            rollups.delete()
+            created = PaymentRollup.objects.bulk_create([
+                PaymentRollup(day=row['day'], content_type_id=row['polymorphic_ctype_id'], status=row['status'],
+                              count=row['total_count'], amount=row['total_amount'])
+                for row in rows
+            ], batch_size=1000)
+        return len(created)
+
+    @staticmethod
+    def _day_start(day: date) -> datetime:
+        return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+    def get_dashboard(self, days: int = None) -> dict:
+        """
+        Показатели для панели в админке, считаются только по сводкам: выручка (оплаченные платежи) по дням
+        и по типам платежей за последние days дней, доля возвратов и количество платежей по статусам.
+        """
+        days = days or get_rollup_settings()['dashboard_days']
+        since = timezone.localdate() - timedelta(days=days - 1)
+        rollups = PaymentRollup.objects.filter(day__gte=since)
+        revenue = rollups.filter(status=PaymentStatus.SUCCEEDED)
+
+        revenue_by_day = dict(revenue.values_list('day').annotate(total=Sum('amount')).order_by())
+        by_provider = [
+            (ContentType.objects.get_for_id(content_type_id).model_class(), count, total)
+            for content_type_id, count, total in revenue.values_list('content_type_id').annotate(
+                total_count=Sum('count'), total=Sum('amount')
+            ).order_by('-total')
+        ]
+        statuses = dict(rollups.values_list('status').annotate(total=Sum('count')).order_by())
+
+        succeeded = statuses.get(PaymentStatus.SUCCEEDED, 0)
+        refunded = statuses.get(PaymentStatus.REFUNDED, 0)
+        return {
+            'since': since,
+            'revenue': sum(revenue_by_day.values(), Decimal(0)),
+            'revenue_by_day': [
+                (since + timedelta(days=i), revenue_by_day.get(since + timedelta(days=i), Decimal(0)))
+                for i in range(days)
+            ],
+            'revenue_by_provider': [
+                (model._meta.verbose_name if model is not None else '-', count, total)
+                for model, count, total in by_provider
+            ],
+            'refund_rate': refunded / (succeeded + refunded) if succeeded + refunded else 0,
+            'status_counts': sorted(statuses.items()),
+        }
+
+
+payment_rollups = PaymentRollupService()
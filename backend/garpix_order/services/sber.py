@@ -1,25 +1,27 @@
 import logging
 import time
-import requests
 from requests import RequestException
 import json
-from typing import Optional, TypedDict, Type
+from typing import Optional, Tuple, TypedDict, Type
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, hmac
 
 from django.conf import settings
-from django.utils.module_loading import import_string
+from django.db import transaction
 
 from rest_framework.response import Response
 from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
 
-from ..models import BaseOrder, BasePayment, SberPaymentStatus, AbstractSberPayment
+from ..models import BaseOrder, BasePayment, SberPaymentStatus
 from ..types.sber import (
     CreatePaymentData, GetPaymentData, PaymentCreationData, FailedPaymentCreationData
 )
-from ..exceptions import (
-    UndefinedModelPaymentException, InvalidModelPaymentException, InvalidOrderStatusPaymentException
-)
+from ..exceptions import InvalidOrderStatusPaymentException
+from ..metrics import endpoint_label, metrics
+from ..tracing import traced, tracer
+from ..registry import payment_registry
+from .deduplication import webhook_deduplicator
+from .transport import get_transport
 
 
 logger = logging.getLogger(__name__)
@@ -28,6 +30,7 @@ logger = logging.getLogger(__name__)
 # Sber REST Docs - https://securecardpayment.ru/wiki/doku.php/integration:api:rest:start
 
 class SberService:
+    PROVIDER = 'sber'
     API_URL = settings.SBER.get('api_url')
     TOKEN = settings.SBER.get('token')
     CRYPTOGRAPHIC_KEY = settings.SBER.get('cryptographic_key')
@@ -36,22 +39,22 @@ class SberService:
         'get_order_status_extended': f'{API_URL}/getOrderStatusExtended.do',
     }
     TIMEOUT = 5
+    # Статус Сбера -> (переход платежа, статус платежа после перехода)
+    STATUS_TRANSITIONS = {
+        SberPaymentStatus.PENDING: ('pending', BasePayment.PaymentStatus.PENDING),
+        SberPaymentStatus.WAITING_FOR_CAPTURE: ('waiting_for_capture', BasePayment.PaymentStatus.WAITING_FOR_CAPTURE),
+        SberPaymentStatus.FULL_PAID: ('succeeded', BasePayment.PaymentStatus.SUCCEEDED),
+        SberPaymentStatus.CANCELLED: ('canceled', BasePayment.PaymentStatus.CANCELED),
+        SberPaymentStatus.REFUNDED: ('refunded', BasePayment.PaymentStatus.REFUNDED),
+        SberPaymentStatus.DECLINED: ('failed', BasePayment.PaymentStatus.FAILED),
+    }
 
     def __init__(self) -> None:
         super().__init__()
+        self.transport = get_transport('sber', timeout=self.TIMEOUT)
 
     def get_payment_model(self):
-        payment_model_path = getattr(settings, 'SBER_PAYMENT_MODEL', None)
-
-        if payment_model_path is None:
-            raise UndefinedModelPaymentException
-
-        payment_model = import_string(payment_model_path)
-
-        if not issubclass(payment_model, AbstractSberPayment):
-            raise InvalidModelPaymentException
-
-        return payment_model
+        return payment_registry.get_payment_model('sber')
 
     def _make_params_for_create_payment(self, order: BaseOrder, **kwargs) -> CreatePaymentData:
         """
@@ -75,25 +78,18 @@ class SberService:
             **kwargs
         )
 
+    @traced('sber.transition')
     def _change_payment_status(self, payment: BasePayment, order_status: int) -> None:
         """
         Изменяет статус модели SberPayment в зависимости от полученного от Сбера статуса.
+        Если платеж уже в этом статусе (повторное уведомление), переход не выполняется.
         """
-        if order_status == SberPaymentStatus.PENDING:
-            payment.pending()
-        elif order_status == SberPaymentStatus.WAITING_FOR_CAPTURE:
-            payment.waiting_for_capture()
-        elif order_status == SberPaymentStatus.FULL_PAID:
-            payment.succeeded()
-        elif order_status == SberPaymentStatus.CANCELLED:
-            payment.canceled()
-        elif order_status == SberPaymentStatus.REFUNDED:
-            payment.refunded()
-        elif order_status == SberPaymentStatus.DECLINED:
-            payment.failed()
-        else:
+        transition_name, target = self.STATUS_TRANSITIONS.get(order_status, (None, None))
+        if transition_name is None:
             raise InvalidOrderStatusPaymentException
 
+        if payment.status != target:
+            getattr(payment, transition_name)()
         payment.save()
 
     def _compute_my_checksum(self, secret_key: bytes, callback_data: str) -> str:
@@ -117,21 +113,39 @@ class SberService:
 
         return secret_key.encode()
 
+    @staticmethod
+    def _get_verify():
+        """
+        Параметр verify запросов к Сберу: путь к сертификату из SBER['cert_path'] или проверка по системным
+        сертификатам, если путь не задан.
+        """
+        return settings.SBER.get('cert_path') or True
+
     def _request(self, url: str, params: Type[TypedDict]) -> dict:
         """
         Отправляет GET-запрос и возвращает полученные данные в виде словаря.
         Логирует url запроса и ошибку в случае возникновения.
         """
         try:
-            cert_path = settings.SBER.get('cert_path', None)
-            response = requests.get(url=url, params=params, timeout=self.TIMEOUT, verify=cert_path)
+            with tracer.span('sber.request', endpoint=endpoint_label(url)):
+                response = self.transport.get(url, params=params, verify=self._get_verify())
             logger.info(f'Request URL: {response.request.url}')
             response.raise_for_status()
-            return json.loads(response.content)
+            return self._record_error_code(url, json.loads(response.content))
         except RequestException as e:
             logger.error(f'Error processing request: {e}')
             raise e
 
+    def _record_error_code(self, url: str, data: dict) -> dict:
+        """Учитывает в метриках ответ с ненулевым errorCode и возвращает данные ответа"""
+        if metrics.enabled:
+            error_code = data.get('errorCode')
+            if error_code and str(error_code) != '0':
+                metrics.inc('garpix_order_provider_error_codes_total', provider=self.PROVIDER,
+                            endpoint=endpoint_label(url), error_code=error_code)
+        return data
+
+    @traced('sber.create_payment')
     def create_payment(self, order: BaseOrder, **kwargs) -> BasePayment:
         """
         Создает платеж в системе Сбера. Возвращает модель SberPayment со ссылкой на оплату в поле payment_link.
@@ -140,6 +154,14 @@ class SberService:
 
         created_payment_data = self._request(url=self.URLS['register'], params=params)
 
+        return self._save_created_payment(order=order, params=params, created_payment_data=created_payment_data)
+
+    @traced('sber.save_payment')
+    def _save_created_payment(self, order: BaseOrder, params: CreatePaymentData,
+                              created_payment_data: dict) -> BasePayment:
+        """
+        Сохраняет модель SberPayment по ответу Сбера на регистрацию заказа.
+        """
         external_payment_id = created_payment_data.get('orderId')
         payment_link = created_payment_data.get('formUrl')
         error_code = created_payment_data.get('errorCode')  # Если error_code == 0 или не пришел, значит ошибок нет
@@ -147,34 +169,35 @@ class SberService:
         params = dict(params)
         params.pop('token', None)
 
-        # Произошла системная ошибка
-        if (error_code and int(error_code) != 0) or not external_payment_id or not payment_link:
+        failed = (error_code and int(error_code) != 0) or not external_payment_id or not payment_link
+
+        if failed:  # Произошла системная ошибка
             payment_creation_data = FailedPaymentCreationData(
                 order=order,
                 amount=order.total_amount,
-                client_data=json.dumps(params, ensure_ascii=False),
-                provider_data=json.dumps(created_payment_data, ensure_ascii=False),
+                client_data=params,
+                title=f'Платеж по заказу № {order.id}',
+            )
+        else:
+            payment_creation_data = PaymentCreationData(
+                order=order,
+                amount=order.total_amount,
+                external_payment_id=external_payment_id,
+                payment_link=payment_link,
+                client_data=params,
                 title=f'Платеж по заказу № {order.id}',
             )
 
+        with transaction.atomic():
             payment = self.get_payment_model().objects.create(**payment_creation_data)
-            payment.failed()
+            payment.set_provider_data(created_payment_data, save=False)
+            if failed:
+                payment.failed()
             payment.save()
 
-            return payment
-
-        payment_creation_data = PaymentCreationData(
-            order=order,
-            amount=order.total_amount,
-            external_payment_id=external_payment_id,
-            payment_link=payment_link,
-            client_data=json.dumps(params, ensure_ascii=False),
-            provider_data=json.dumps(created_payment_data, ensure_ascii=False),
-            title=f'Платеж по заказу № {order.id}',
-        )
-
-        return self.get_payment_model().objects.create(**payment_creation_data)
+        return payment
 
+    @traced('sber.update_payment')
     def update_payment(self, payment: BasePayment, **kwargs) -> None:
         """
         Обновляет модель SberPayment с соответствующим внешним id платежа в системе Сбера на основании статуса,
@@ -187,43 +210,87 @@ class SberService:
 
         payment_data = self._request(url=self.URLS['get_order_status_extended'], params=params)
 
+        self._apply_payment_data(payment=payment, payment_data=payment_data)
+
+    def _apply_payment_data(self, payment: BasePayment, payment_data: dict) -> None:
+        """
+        Применяет к модели SberPayment данные о статусе платежа, полученные от Сбера.
+        Строка платежа блокируется, а его статус перечитывается из БД, поэтому параллельные уведомления
+        по одному платежу применяются по очереди.
+        """
         order_status = payment_data.get('orderStatus')
-        error_code = payment_data.get('errorCode')  # Если error_code == 0 или не пришел, значит ошибок нет
-        payment.provider_data = json.dumps(payment_data, ensure_ascii=False)
 
-        if order_status:  # Пришел внешний статус заказа
-            order_status = int(order_status)
-            self._change_payment_status(payment=payment, order_status=order_status)
+        with transaction.atomic():
+            payment.status = BasePayment.objects.non_polymorphic().select_for_update().filter(
+                pk=payment.pk
+            ).values_list('status', flat=True).get()
+            payment.set_provider_data(payment_data, save=False)
 
-        if error_code and int(error_code) != 0:  # Произошла системная ошибка
-            payment.save()
+            if order_status:  # Пришел внешний статус заказа
+                order_status = int(order_status)
+                self._change_payment_status(payment=payment, order_status=order_status)
+            else:  # Статуса нет (например, системная ошибка): сохраняем только данные провайдера
+                payment.save(update_fields=['provider_event', 'updated_at'])
 
-    def callback(self, data: dict, **kwargs) -> Response:
+    @traced('sber.checksum')
+    def _get_callback_checksums(self, data: dict) -> Tuple[Optional[str], Optional[str]]:
         """
-        Получает данные из callback-уведомления, сверяет полученную от Сбера чексумму с рассчитанной нами на основании
-        криптографического ключа, если они совпадают, то обновляет статус платежа.
+        Возвращает полученную от Сбера чексумму и рассчитанную нами на основании криптографического ключа.
         """
         data.pop('sign_alias', None)
         checksum = data.pop('checksum', None)
         callback_data = ''.join([f'{k};{v};' for k, v in sorted(list(data.items()))])
 
-        payment = self.get_payment_model().objects.filter(external_payment_id=data.get('mdOrder')).first()
-
-        if not payment:
-            return Response(status=HTTP_400_BAD_REQUEST)
-
         secret_key = self._get_cryptographic_key()
 
         if not secret_key:
-            return Response(status=HTTP_400_BAD_REQUEST)
+            return checksum, None
+
+        return checksum, self._compute_my_checksum(secret_key=secret_key, callback_data=callback_data)
 
-        my_checksum = self._compute_my_checksum(secret_key=secret_key, callback_data=callback_data)
+    def _get_callback_event(self, data: dict) -> Tuple[Optional[str], str]:
+        """
+        Возвращает ключ дедупликации callback-уведомления: внешний id платежа и операцию со статусом.
+        """
+        return data.get('mdOrder'), f'{data.get("operation")}:{data.get("status")}'
+
+    @traced('sber.apply')
+    def _apply_callback_payment_data(self, payment: BasePayment, payment_data: dict, event: tuple) -> None:
+        """
+        Применяет данные о статусе платежа и отмечает callback-уведомление обработанным в одной транзакции.
+        """
+        with transaction.atomic():
+            self._apply_payment_data(payment=payment, payment_data=payment_data)
+            webhook_deduplicator.remember(self.PROVIDER, *event)
 
-        if checksum == my_checksum:
-            self.update_payment(payment=payment, **kwargs)
+    @traced('sber.callback')
+    def callback(self, data: dict, **kwargs) -> Response:
+        """
+        Получает данные из callback-уведомления, сверяет полученную от Сбера чексумму с рассчитанной нами на основании
+        криптографического ключа, если они совпадают, то обновляет статус платежа.
+        Повторные уведомления подтверждаются без обращения к платежу.
+        """
+        checksum, my_checksum = self._get_callback_checksums(data)
+
+        if not my_checksum or checksum != my_checksum:
+            return Response(status=HTTP_400_BAD_REQUEST)
+
+        event = self._get_callback_event(data)
+        if webhook_deduplicator.is_duplicate(self.PROVIDER, *event):
             return Response(status=HTTP_200_OK)
 
-        return Response(status=HTTP_400_BAD_REQUEST)
+        with tracer.span('sber.lookup'):
+            payment = self.get_payment_model().objects.filter(external_payment_id=data.get('mdOrder')).first()
+
+        if not payment:
+            return Response(status=HTTP_400_BAD_REQUEST)
+
+        if payment.external_payment_id:
+            params = self._make_params_for_get_payment_data(external_payment_id=payment.external_payment_id, **kwargs)
+            payment_data = self._request(url=self.URLS['get_order_status_extended'], params=params)
+            self._apply_callback_payment_data(payment=payment, payment_data=payment_data, event=event)
+
+        return Response(status=HTTP_200_OK)
 
 
 sber_service = SberService()
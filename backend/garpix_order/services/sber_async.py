@@ -0,0 +1,112 @@
+import json
+import logging
+from typing import Type, TypedDict
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+
+from ..models import BaseOrder, BasePayment
+from .deduplication import webhook_deduplicator
+from ..metrics import endpoint_label
+from ..tracing import traced, tracer
+from .sber import SberService
+from .transport import get_async_transport
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSberService(SberService):
+    """
+    Асинхронный аналог SberService для ASGI: запросы к Сберу выполняются через httpx.AsyncClient
+    и не занимают поток на время ожидания ответа, работа с ORM вынесена в sync_to_async.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.async_transport = get_async_transport('sber', timeout=self.TIMEOUT)
+
+    async def _request(self, url: str, params: Type[TypedDict]) -> dict:
+        """
+        Отправляет GET-запрос и возвращает полученные данные в виде словаря.
+        Логирует url запроса и ошибку в случае возникновения.
+        """
+        import httpx
+
+        try:
+            with tracer.span('sber.request', endpoint=endpoint_label(url)):
+                response = await self.async_transport.get(
+                    url, params=params, client_kwargs={'verify': self._get_verify()}
+                )
+            logger.info(f'Request URL: {response.request.url}')
+            response.raise_for_status()
+            return self._record_error_code(url, json.loads(response.content))
+        except httpx.HTTPError as e:
+            logger.error(f'Error processing request: {e}')
+            raise e
+
+    @traced('sber.create_payment')
+    async def create_payment(self, order: BaseOrder, **kwargs) -> BasePayment:
+        """
+        Создает платеж в системе Сбера. Возвращает модель SberPayment со ссылкой на оплату в поле payment_link.
+        """
+        params = self._make_params_for_create_payment(order=order, **kwargs)
+
+        created_payment_data = await self._request(url=self.URLS['register'], params=params)
+
+        return await sync_to_async(self._save_created_payment, thread_sensitive=True)(
+            order=order, params=params, created_payment_data=created_payment_data
+        )
+
+    @traced('sber.update_payment')
+    async def update_payment(self, payment: BasePayment, **kwargs) -> None:
+        """
+        Обновляет модель SberPayment на основании статуса, полученного от Сбера.
+        """
+        if not payment.external_payment_id:
+            return None
+
+        params = self._make_params_for_get_payment_data(external_payment_id=payment.external_payment_id, **kwargs)
+
+        payment_data = await self._request(url=self.URLS['get_order_status_extended'], params=params)
+
+        await sync_to_async(self._apply_payment_data, thread_sensitive=True)(
+            payment=payment, payment_data=payment_data
+        )
+
+    @traced('sber.callback')
+    async def callback(self, data: dict, **kwargs) -> HttpResponse:
+        """
+        Асинхронная обработка callback-уведомления Сбера. Возвращает HttpResponse со статусом 200 или 400.
+        Повторные уведомления из памяти процесса подтверждаются без обращения к БД.
+        """
+        checksum, my_checksum = self._get_callback_checksums(data)
+
+        if not my_checksum or checksum != my_checksum:
+            return HttpResponse(status=400)
+
+        event = self._get_callback_event(data)
+        if webhook_deduplicator.is_cached(self.PROVIDER, *event) or await sync_to_async(
+            webhook_deduplicator.is_duplicate, thread_sensitive=True
+        )(self.PROVIDER, *event):
+            return HttpResponse(status=200)
+
+        with tracer.span('sber.lookup'):
+            payment = await sync_to_async(
+                lambda: self.get_payment_model().objects.filter(external_payment_id=data.get('mdOrder')).first(),
+                thread_sensitive=True
+            )()
+
+        if not payment:
+            return HttpResponse(status=400)
+
+        if payment.external_payment_id:
+            params = self._make_params_for_get_payment_data(external_payment_id=payment.external_payment_id, **kwargs)
+            payment_data = await self._request(url=self.URLS['get_order_status_extended'], params=params)
+            await sync_to_async(self._apply_callback_payment_data, thread_sensitive=True)(
+                payment=payment, payment_data=payment_data, event=event
+            )
+        return HttpResponse(status=200)
+
+
+async_sber_service = AsyncSberService()
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django_fsm import TransitionNotAllowed
+
+from ..exceptions import InvalidOrderStatusPaymentException
+from ..models import BasePayment, SberPaymentStatus
+from .sber_async import async_sber_service
+from .transport import AsyncRateLimiter
+
+
+logger = logging.getLogger(__name__)
+
+PaymentStatus = BasePayment.PaymentStatus
+
+DEFAULT_RECONCILIATION_SETTINGS = {
+    'chunk_size': 500,  # Количество платежей, загружаемых из БД за один раз
+    'concurrency': 50,  # Максимальное количество одновременных запросов к Сберу
+    'rate_limit': 20,  # Максимальное количество запросов к Сберу в секунду
+    # Интервалы опроса в зависимости от возраста платежа: (возраст платежа до, интервал опроса).
+    # Платежи старше последнего порога не опрашиваются.
+    'poll_intervals': (
+        (timedelta(minutes=15), timedelta(minutes=1)),
+        (timedelta(hours=2), timedelta(minutes=5)),
+        (timedelta(days=1), timedelta(minutes=30)),
+        (timedelta(days=7), timedelta(hours=6)),
+    ),
+}
+
+
+class SberReconciliationReport:
+    """
+    Итоги сверки: количество проверенных и измененных платежей, ошибки, пропускная способность и отставание.
+    """
+
+    def __init__(self) -> None:
+        self.checked = 0
+        self.changed = 0
+        self.failed = 0
+        self.max_lag = timedelta(0)
+        self.elapsed = 0.0
+        self._started_at = time.monotonic()
+
+    def observe_lag(self, lag: timedelta) -> None:
+        self.max_lag = max(self.max_lag, lag)
+
+    def finish(self) -> None:
+        self.elapsed = time.monotonic() - self._started_at
+
+    @property
+    def throughput(self) -> float:
+        if not self.elapsed:
+            return 0.0
+        return self.checked / self.elapsed
+
+    def as_dict(self) -> dict:
+        return {
+            'checked': self.checked,
+            'changed': self.changed,
+            'failed': self.failed,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput, 2),
+            'max_lag': self.max_lag.total_seconds(),
+        }
+
+
+class SberReconciliationService:
+    """
+    Сверка статусов незавершенных платежей Сбера на случай потерянных callback-уведомлений.
+    Платежи читаются из БД порциями по первичному ключу, статусы запрашиваются в getOrderStatusExtended.do
+    конкурентно с общим ограничением частоты, результаты применяются одной транзакцией на порцию.
+    """
+    NOT_FINAL_STATUSES = (PaymentStatus.CREATED, PaymentStatus.PENDING, PaymentStatus.WAITING_FOR_CAPTURE)
+    SBER_STATUS_MAP = {
+        SberPaymentStatus.PENDING: PaymentStatus.PENDING,
+        SberPaymentStatus.WAITING_FOR_CAPTURE: PaymentStatus.WAITING_FOR_CAPTURE,
+        SberPaymentStatus.FULL_PAID: PaymentStatus.SUCCEEDED,
+        SberPaymentStatus.CANCELLED: PaymentStatus.CANCELED,
+        SberPaymentStatus.REFUNDED: PaymentStatus.REFUNDED,
+        SberPaymentStatus.DECLINED: PaymentStatus.FAILED,
+    }
+    # Статусы Сбера, при которых платеж еще не завершен и менять нечего (авторизация через ACS банка)
+    SBER_IN_PROGRESS_STATUSES = (SberPaymentStatus.AUTHORIZATION_THROUGH_ACS,)
+
+    def __init__(self, service=async_sber_service, **options) -> None:
+        self.service = service
+        self.options = {
+            **DEFAULT_RECONCILIATION_SETTINGS,
+            **getattr(settings, 'GARPIX_ORDER_SBER_RECONCILIATION', {}),
+            **{key: value for key, value in options.items() if value is not None},
+        }
+
+    def get_queryset(self, now):
+        """
+        Незавершенные платежи, которые пора опросить с учетом их возраста.
+        """
+        due = Q()
+        newer_than = now
+        for max_age, interval in self.options['poll_intervals']:
+            due |= Q(created_at__lte=newer_than, created_at__gt=now - max_age) & (
+                Q(status_checked_at__isnull=True) | Q(status_checked_at__lte=now - interval)
+            )
+            newer_than = now - max_age
+
+        return self.service.get_payment_model().objects.non_polymorphic().filter(
+            due, status__in=self.NOT_FINAL_STATUSES
+        ).exclude(external_payment_id='').order_by('pk')
+
+    def _fetch_chunk(self, last_pk: int) -> list:
+        return list(self.get_queryset(timezone.now()).filter(pk__gt=last_pk)[:self.options['chunk_size']])
+
+    async def _poll(self, payment, limiter: AsyncRateLimiter, semaphore: asyncio.Semaphore) -> dict:
+        await limiter.acquire()
+        async with semaphore:
+            params = self.service._make_params_for_get_payment_data(external_payment_id=payment.external_payment_id)
+            return await self.service._request(url=self.service.URLS['get_order_status_extended'], params=params)
+
+    def _apply_chunk(self, chunk: list, results: list, report: SberReconciliationReport) -> None:
+        now = timezone.now()
+        checked_pks = []
+
+        with transaction.atomic():
+            for payment, payment_data in zip(chunk, results):
+                if isinstance(payment_data, Exception):
+                    report.failed += 1
+                    logger.warning(f'Не удалось получить статус платежа {payment.pk}: {payment_data}')
+                    continue
+
+                checked_pks.append(payment.pk)
+                report.checked += 1
+                report.observe_lag(now - (payment.status_checked_at or payment.created_at))
+
+                order_status = payment_data.get('orderStatus')
+                if order_status is None:
+                    continue
+                try:
+                    order_status = int(order_status)
+                except (TypeError, ValueError):
+                    report.failed += 1
+                    logger.warning(f'Неизвестный статус платежа {payment.pk} от Сбера: {order_status!r}')
+                    continue
+                if order_status in self.SBER_IN_PROGRESS_STATUSES:
+                    continue
+                if self.SBER_STATUS_MAP.get(order_status) == payment.status:
+                    continue
+
+                try:
+                    with transaction.atomic():
+                        # Пока шел запрос к Сберу, статус мог изменить callback: перечитываем платеж под блокировкой
+                        locked = self.service.get_payment_model().objects.non_polymorphic().select_for_update().get(
+                            pk=payment.pk
+                        )
+                        if locked.status != payment.status:
+                            continue
+                        locked.set_provider_data(payment_data, save=False)
+                        self.service._change_payment_status(payment=locked, order_status=order_status)
+                except (TransitionNotAllowed, InvalidOrderStatusPaymentException) as e:
+                    report.failed += 1
+                    logger.warning(f'Не удалось изменить статус платежа {payment.pk}: {e}')
+                    continue
+                report.changed += 1
+
+            self.service.get_payment_model().objects.filter(pk__in=checked_pks).update(status_checked_at=now)
+
+    async def arun(self) -> SberReconciliationReport:
+        report = SberReconciliationReport()
+        limiter = AsyncRateLimiter(self.options['rate_limit'])
+        semaphore = asyncio.Semaphore(self.options['concurrency'])
+        last_pk = 0
+
+        while True:
+            chunk = await sync_to_async(self._fetch_chunk, thread_sensitive=True)(last_pk)
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+
+            results = await asyncio.gather(
+                *(self._poll(payment, limiter, semaphore) for payment in chunk), return_exceptions=True
+            )
+            await sync_to_async(self._apply_chunk, thread_sensitive=True)(chunk, results, report)
+
+        report.finish()
+        logger.info(f'Сверка платежей Сбера завершена: {report.as_dict()}')
+        return report
+
+    def run(self) -> SberReconciliationReport:
+        return async_to_sync(self.arun)()
@@ -0,0 +1,232 @@
+import csv
+import logging
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django_fsm import TransitionNotAllowed, can_proceed
+
+from ..models import BasePayment, CloudPayment, RobokassaPayment
+
+
+logger = logging.getLogger(__name__)
+
+PaymentStatus = BasePayment.PaymentStatus
+
+DEFAULT_SETTLEMENT_SETTINGS = {
+    'chunk_size': 5000,  # Количество платежей, читаемых из БД за раз при построении индекса
+    'apply_batch_size': 500,  # Количество платежей, исправляемых в одной транзакции
+    'window_margin': timedelta(days=1),  # Насколько раньше даты реестра искать платежи (оплата после полуночи)
+    # Колонки реестров провайдеров
+    'registries': {
+        'cloudpayments': {'delimiter': ',', 'encoding': 'utf-8-sig', 'amount_column': 'Amount',
+                          'key_columns': ('TransactionId', 'InvoiceId')},
+        'robokassa': {'delimiter': ';', 'encoding': 'utf-8-sig', 'amount_column': 'OutSum',
+                      'key_columns': ('InvId',)},
+    },
+}
+
+
+def get_settlement_settings() -> dict:
+    user_settings = getattr(settings, 'GARPIX_ORDER_SETTLEMENT', {})
+    registries = {
+        provider: {**registry, **user_settings.get('registries', {}).get(provider, {})}
+        for provider, registry in DEFAULT_SETTLEMENT_SETTINGS['registries'].items()
+    }
+    return {**DEFAULT_SETTLEMENT_SETTINGS, **user_settings, 'registries': registries}
+
+
+class Discrepancy:
+    MISSING = 'missing'  # Платеж оплачен у нас, но отсутствует в реестре
+    EXTRA = 'extra'  # Строка реестра без платежа у нас
+    AMOUNT = 'amount'  # Суммы платежа и строки реестра не совпадают
+    UNCONFIRMED = 'unconfirmed'  # Платеж есть в реестре, но не оплачен у нас
+
+    COLUMNS = ('kind', 'key', 'payment_id', 'status', 'amount', 'registry_amount')
+
+
+class SettlementReport:
+    """
+    Итоги сверки с реестром: количество строк и расхождений по видам, исправленные платежи.
+    Сами расхождения в отчете не хранятся, а пишутся построчно в поток discrepancies.
+    """
+
+    def __init__(self) -> None:
+        self.payments = 0
+        self.rows = 0
+        self.matched = 0
+        self.corrected = 0
+        self.failed = 0
+        self.discrepancies = {kind: 0 for kind in (
+            Discrepancy.MISSING, Discrepancy.EXTRA, Discrepancy.AMOUNT, Discrepancy.UNCONFIRMED
+        )}
+        self.elapsed = 0.0
+        self._started_at = time.monotonic()
+
+    def finish(self) -> None:
+        self.elapsed = time.monotonic() - self._started_at
+
+    def as_dict(self) -> dict:
+        return {
+            'payments': self.payments,
+            'rows': self.rows,
+            'matched': self.matched,
+            **self.discrepancies,
+            'corrected': self.corrected,
+            'failed': self.failed,
+            'elapsed': round(self.elapsed, 3),
+        }
+
+
+class SettlementProvider:
+    """
+    Сопоставление платежей провайдера со строками его реестра.
+    key_fields - поля платежа в порядке приоритета, соответствующие колонкам реестра key_columns:
+    строка реестра ищется по первой колонке, затем по следующим (для платежей без значения в первом поле).
+    """
+
+    def __init__(self, name: str, model, key_fields: tuple) -> None:
+        self.name = name
+        self.model = model
+        self.key_fields = key_fields
+
+
+class SettlementReconciliationService:
+    """
+    Сверка платежей с суточным реестром провайдера. Платежи за окно дат загружаются из БД порциями в хэш-индекс
+    по идентификатору (в индексе хранятся только pk, сумма и статус), реестр читается построчно и сверяется с индексом,
+    поэтому память ограничена количеством платежей за окно и не зависит от размера реестра.
+    Платежи, найденные в реестре, но не оплаченные у нас, при apply=True переводятся в SUCCEEDED порциями.
+    """
+    providers = {
+        'cloudpayments': SettlementProvider('cloudpayments', CloudPayment, ('transaction_id', 'order_number')),
+        'robokassa': SettlementProvider('robokassa', RobokassaPayment, ('id',)),
+    }
+    CORRECTABLE_STATUSES = (PaymentStatus.CREATED, PaymentStatus.PENDING, PaymentStatus.WAITING_FOR_CAPTURE)
+
+    def __init__(self, provider: str, **options) -> None:
+        self.provider = self.providers[provider]
+        self.options = {
+            **get_settlement_settings(),
+            **{key: value for key, value in options.items() if value is not None},
+        }
+
+    @property
+    def registry(self) -> dict:
+        return self.options['registries'][self.provider.name]
+
+    def get_window(self, registry_date: date) -> tuple:
+        start = timezone.make_aware(datetime.combine(registry_date, datetime.min.time()))
+        return start - self.options['window_margin'], start + timedelta(days=1)
+
+    def build_index(self, registry_date: date) -> dict:
+        """
+        Хэш-индекс платежей за окно: (номер ключа, значение) -> (pk, сумма, статус).
+        Платеж индексируется по первому непустому полю из key_fields.
+        """
+        window_start, window_end = self.get_window(registry_date)
+        rows = self.provider.model.objects.non_polymorphic().filter(
+            created_at__gte=window_start, created_at__lt=window_end
+        ).order_by('created_at', 'pk').values_list('pk', 'amount', 'status', *self.provider.key_fields)
+
+        index = {}
+        for pk, amount, status, *keys in rows.iterator(chunk_size=self.options['chunk_size']):
+            for position, value in enumerate(keys):
+                if value not in (None, ''):
+                    index[(position, str(value))] = (pk, amount, status)
+                    break
+        return index
+
+    @staticmethod
+    def parse_amount(value: str):
+        try:
+            return Decimal(value.replace(' ', '').replace(',', '.'))
+        except (AttributeError, InvalidOperation):
+            return None
+
+    def reconcile(self, lines, registry_date: date, apply: bool = False, discrepancies=None) -> SettlementReport:
+        """
+        Сверяет реестр (итерируемые строки CSV, например открытый файл) с платежами за registry_date.
+        discrepancies - текстовый поток, в который построчно пишутся расхождения в формате CSV.
+        """
+        report = SettlementReport()
+        registry = self.registry
+        writer = csv.writer(discrepancies) if discrepancies is not None else None
+        if writer is not None:
+            writer.writerow(Discrepancy.COLUMNS)
+
+        def record(kind, key, payment=None, registry_amount=None):
+            report.discrepancies[kind] += 1
+            if writer is not None:
+                pk, amount, status = payment or ('', '', '')
+                writer.writerow((kind, key, pk, status, amount, '' if registry_amount is None else registry_amount))
+
+        index = self.build_index(registry_date)
+        report.payments = len(index)
+        to_correct = []
+
+        for row in csv.DictReader(lines, delimiter=registry['delimiter']):
+            report.rows += 1
+            registry_amount = self.parse_amount(row.get(registry['amount_column']))
+            key, payment = None, None
+            for position, column in enumerate(registry['key_columns']):
+                value = (row.get(column) or '').strip()
+                if not value:
+                    continue
+                key = key or value
+                payment = index.pop((position, value), None)
+                if payment is not None:
+                    key = value
+                    break
+
+            if payment is None:
+                record(Discrepancy.EXTRA, key, registry_amount=registry_amount)
+                continue
+            report.matched += 1
+            pk, amount, status = payment
+            if registry_amount is None or registry_amount != amount:
+                record(Discrepancy.AMOUNT, key, payment, registry_amount)
+                continue
+            if status != PaymentStatus.SUCCEEDED:
+                record(Discrepancy.UNCONFIRMED, key, payment, registry_amount)
+                if apply and status in self.CORRECTABLE_STATUSES:
+                    to_correct.append(pk)
+                    if len(to_correct) >= self.options['apply_batch_size']:
+                        self.apply_batch(to_correct, report)
+                        to_correct = []
+
+        if to_correct:
+            self.apply_batch(to_correct, report)
+
+        for (position, value), payment in index.items():
+            if payment[2] == PaymentStatus.SUCCEEDED:
+                record(Discrepancy.MISSING, value, payment)
+
+        report.finish()
+        logger.info(f'Сверка реестра {self.provider.name} за {registry_date} завершена: {report.as_dict()}')
+        return report
+
+    def apply_batch(self, pks: list, report: SettlementReport) -> None:
+        """
+        Переводит платежи порции в SUCCEEDED одной транзакцией, каждый платеж - в своей точке сохранения,
+        чтобы ошибка одного не откатывала остальные.
+        """
+        with transaction.atomic():
+            payments = self.provider.model.objects.select_related('order').select_for_update().filter(
+                pk__in=pks, status__in=self.CORRECTABLE_STATUSES
+            ).order_by('pk')
+            for payment in payments:
+                try:
+                    with transaction.atomic():
+                        if not can_proceed(payment.succeeded):
+                            raise TransitionNotAllowed(f'Платеж {payment.pk} превышает сумму заказа')
+                        payment.succeeded()
+                        payment.save()
+                except TransitionNotAllowed as e:
+                    report.failed += 1
+                    logger.warning(f'Не удалось подтвердить платеж {payment.pk} по реестру: {e}')
+                    continue
+                report.corrected += 1
@@ -0,0 +1,297 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ..metrics import endpoint_label, metrics
+
+
+DEFAULT_HTTP_SETTINGS = {
+    'pool_connections': 10,  # Количество хостов, для которых держатся пулы соединений
+    'pool_maxsize': 10,  # Максимальное количество keep-alive соединений к одному хосту
+    'max_retries': 3,  # Количество повторов (POST повторяется только при ошибке установки соединения)
+    'backoff_factor': 0.3,  # Базовая задержка между повторами, секунды
+    'status_forcelist': (502, 503, 504),  # Статусы ответа, при которых идемпотентный запрос повторяется
+    'timeouts': {},  # Таймауты по провайдерам, например {'sber': 5, 'robokassa': 10}
+    'async_max_connections': 100,  # Максимальное количество одновременных соединений асинхронного клиента
+}
+
+
+def get_http_settings() -> dict:
+    return {**DEFAULT_HTTP_SETTINGS, **getattr(settings, 'GARPIX_ORDER_HTTP', {})}
+
+
+class JitteredRetry(Retry):
+    """
+    Retry с экспоненциальной задержкой и случайным разбросом (full jitter),
+    чтобы воркеры не повторяли запросы к провайдеру синхронно.
+    """
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        if not backoff:
+            return 0
+        return random.uniform(0, backoff)
+
+
+class ProviderTransport:
+    """
+    HTTP-транспорт для запросов к платежному провайдеру с keep-alive пулом соединений.
+    Сессия создается лениво и пересоздается после fork (uwsgi, celery prefork),
+    поэтому сокеты не разделяются между процессами.
+    """
+
+    def __init__(self, provider: str, timeout: float = None) -> None:
+        self.provider = provider
+        self.default_timeout = timeout
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        return get_http_settings()['timeouts'].get(self.provider, self.default_timeout)
+
+    def _make_session(self) -> requests.Session:
+        http_settings = get_http_settings()
+        retry = JitteredRetry(
+            total=http_settings['max_retries'],
+            connect=http_settings['max_retries'],
+            read=http_settings['max_retries'],
+            status=http_settings['max_retries'],
+            backoff_factor=http_settings['backoff_factor'],
+            status_forcelist=http_settings['status_forcelist'],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=http_settings['pool_connections'],
+            pool_maxsize=http_settings['pool_maxsize'],
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self._make_session()
+                    self._pid = pid
+        return self._session
+
+    def close(self) -> None:
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = None
+            self._pid = None
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        if not metrics.enabled:
+            return self.session.request(method, url, **kwargs)
+        labels = {'provider': self.provider, 'endpoint': endpoint_label(url)}
+        with metrics.timer('garpix_order_provider_request_seconds', **labels):
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                metrics.inc('garpix_order_provider_request_errors_total', error=e.__class__.__name__, **labels)
+                raise
+        if response.status_code >= 400:
+            metrics.inc('garpix_order_provider_request_errors_total', error=f'http_{response.status_code}', **labels)
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+
+class AsyncProviderTransport:
+    """
+    Асинхронный HTTP-транспорт провайдера на httpx.AsyncClient.
+    Клиент привязан к event loop, поэтому транспорт держит один долгоживущий цикл в фоновом потоке процесса,
+    и запросы из любых циклов (в том числе временных, которые создает async_to_sync под WSGI) выполняются
+    в нем через общий пул соединений. Цикл и клиент пересоздаются после fork.
+    Идемпотентные запросы повторяются по тем же правилам, что и в ProviderTransport.
+    """
+    idempotent_methods = frozenset({'HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'})
+
+    def __init__(self, provider: str, timeout: float = None) -> None:
+        self.provider = provider
+        self.default_timeout = timeout
+        self._loop = None
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        return get_http_settings()['timeouts'].get(self.provider, self.default_timeout)
+
+    def _make_client(self, **client_kwargs):
+        import httpx
+
+        http_settings = get_http_settings()
+        limits = httpx.Limits(
+            max_connections=http_settings['async_max_connections'],
+            max_keepalive_connections=http_settings['async_max_connections'],
+        )
+        return httpx.AsyncClient(limits=limits, timeout=self.timeout, **client_kwargs)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Цикл транспорта, запущенный в фоновом потоке процесса"""
+        pid = os.getpid()
+        if self._loop is None or self._pid != pid:
+            with self._lock:
+                if self._loop is None or self._pid != pid:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name=f'garpix-order-{self.provider}-http',
+                                     daemon=True).start()
+                    self._loop, self._client, self._pid = loop, None, pid
+        return self._loop
+
+    def get_client(self, **client_kwargs):
+        """
+        Возвращает клиент транспорта, вызывается в цикле транспорта.
+        Параметры клиента (например, verify) применяются при его создании.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = self._make_client(**client_kwargs)
+        return self._client
+
+    async def _aclose_client(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+    def close(self) -> None:
+        """Закрывает клиент и его соединения, следующий запрос создаст новый"""
+        with self._lock:
+            loop = self._loop if self._pid == os.getpid() else None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._aclose_client(), loop).result()
+
+    async def aclose(self) -> None:
+        with self._lock:
+            loop = self._loop if self._pid == os.getpid() else None
+        if loop is not None:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._aclose_client(), loop))
+
+    async def request(self, method: str, url: str, client_kwargs: dict = None, **kwargs):
+        if not metrics.enabled:
+            return await self._request(method, url, client_kwargs, **kwargs)
+        import httpx
+
+        labels = {'provider': self.provider, 'endpoint': endpoint_label(url)}
+        with metrics.timer('garpix_order_provider_request_seconds', **labels):
+            try:
+                response = await self._request(method, url, client_kwargs, **kwargs)
+            except httpx.HTTPError as e:
+                metrics.inc('garpix_order_provider_request_errors_total', error=e.__class__.__name__, **labels)
+                raise
+        if response.status_code >= 400:
+            metrics.inc('garpix_order_provider_request_errors_total', error=f'http_{response.status_code}', **labels)
+        return response
+
+    async def _request(self, method: str, url: str, client_kwargs: dict = None, **kwargs):
+        loop = self.loop
+        if asyncio.get_running_loop() is loop:
+            return await self._send(method, url, client_kwargs, **kwargs)
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self._send(method, url, client_kwargs, **kwargs), loop)
+        )
+
+    async def _send(self, method: str, url: str, client_kwargs: dict = None, **kwargs):
+        import httpx
+
+        http_settings = get_http_settings()
+        client = self.get_client(**(client_kwargs or {}))
+        retryable = method.upper() in self.idempotent_methods
+        max_retries = http_settings['max_retries']
+
+        for attempt in range(max_retries + 1):
+            is_last = attempt == max_retries
+            if attempt:
+                backoff = http_settings['backoff_factor'] * (2 ** (attempt - 1))
+                await asyncio.sleep(random.uniform(0, backoff))
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.ConnectError:
+                # Запрос не был отправлен, повтор безопасен для любого метода
+                if is_last:
+                    raise
+                continue
+            except httpx.TransportError:
+                if is_last or not retryable:
+                    raise
+                continue
+            if is_last or not retryable or response.status_code not in http_settings['status_forcelist']:
+                return response
+
+    async def get(self, url: str, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+
+class AsyncRateLimiter:
+    """
+    Ограничитель частоты запросов для корутин одного event loop:
+    выдает не более rate разрешений в секунду, равномерно распределяя их во времени.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate if rate else 0
+        self._next_at = 0
+
+    async def acquire(self) -> None:
+        if not self.interval:
+            return
+        now = time.monotonic()
+        wait = self._next_at - now
+        self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(provider: str, timeout: float = None) -> ProviderTransport:
+    """
+    Возвращает общий для процесса транспорт провайдера.
+    """
+    transport = _transports.get(provider)
+    if transport is None:
+        with _transports_lock:
+            transport = _transports.setdefault(provider, ProviderTransport(provider, timeout=timeout))
+    return transport
+
+
+_async_transports = {}
+
+
+def get_async_transport(provider: str, timeout: float = None) -> AsyncProviderTransport:
+    """
+    Возвращает общий для процесса асинхронный транспорт провайдера.
+    """
+    transport = _async_transports.get(provider)
+    if transport is None:
+        with _transports_lock:
+            transport = _async_transports.setdefault(provider, AsyncProviderTransport(provider, timeout=timeout))
+    return transport
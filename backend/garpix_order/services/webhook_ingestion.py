@@ -0,0 +1,117 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from ..models import WebhookEvent
+
+
+logger = logging.getLogger(__name__)
+
+EventStatus = WebhookEvent.EventStatus
+
+DEFAULT_WEBHOOK_INGESTION_SETTINGS = {
+    'enabled': False,  # Сохранять уведомления и применять их в Celery вместо обработки в HTTP-запросе
+    'batch_size': 100,  # Количество событий одного заказа, применяемых за один запуск задачи
+    'stale_after': timedelta(minutes=1),  # Через сколько переотправлять в очередь необработанные события
+}
+
+
+def get_ingestion_settings() -> dict:
+    return {**DEFAULT_WEBHOOK_INGESTION_SETTINGS, **getattr(settings, 'GARPIX_ORDER_WEBHOOK_INGESTION', {})}
+
+
+def _process_cloudpayments(payload: dict) -> str:
+    from .cloudpayments import cloudpayments_service
+
+    code = cloudpayments_service.process_notification(payload, payload.get('Status'))
+    return '' if code == cloudpayments_service.CODE_SUCCESS else f'Код ответа {code}'
+
+
+class WebhookIngestion:
+    """
+    Асинхронная обработка уведомлений: HTTP-обработчик только сохраняет проверенное уведомление,
+    Celery-задача применяет события заказа по порядку, блокируя их на время обработки,
+    поэтому события одного заказа не обрабатываются параллельно.
+    """
+    # Обработчики событий по провайдерам: принимают данные уведомления, возвращают текст ошибки или пустую строку
+    processors = {
+        'cloudpayments': _process_cloudpayments,
+    }
+
+    @property
+    def enabled(self) -> bool:
+        return get_ingestion_settings()['enabled']
+
+    def ingest(self, provider: str, order_key: str, payload: dict) -> WebhookEvent:
+        event = WebhookEvent.objects.create(provider=provider, order_key=order_key, payload=payload)
+        transaction.on_commit(lambda: self.schedule(provider, order_key))
+        return event
+
+    def schedule(self, provider: str, order_key: str) -> None:
+        from garpix_order.tasks import process_webhook_events
+
+        process_webhook_events.delay(provider, order_key)
+
+    def process_order_events(self, provider: str, order_key: str) -> int:
+        """
+        Применяет порцию необработанных событий заказа. Возвращает количество обработанных событий.
+        """
+        batch_size = get_ingestion_settings()['batch_size']
+        processor = self.processors[provider]
+
+        with transaction.atomic():
+            events = list(
+                WebhookEvent.objects.select_for_update().filter(
+                    provider=provider, order_key=order_key, status=EventStatus.RECEIVED
+                ).order_by('pk')[:batch_size]
+            )
+            for event in events:
+                try:
+                    with transaction.atomic():
+                        event.error = processor(event.payload)
+                except Exception as e:
+                    logger.exception(f'Не удалось обработать уведомление {event.pk}')
+                    event.error = str(e) or e.__class__.__name__
+                event.status = EventStatus.FAILED if event.error else EventStatus.PROCESSED
+                event.processed_at = timezone.now()
+            WebhookEvent.objects.bulk_update(events, ['status', 'error', 'processed_at'])
+
+            if len(events) == batch_size:
+                transaction.on_commit(lambda: self.schedule(provider, order_key))
+        return len(events)
+
+    def schedule_stale(self) -> int:
+        """
+        Ставит в очередь заказы с событиями, задачи для которых не были выполнены (например, потеряны брокером).
+        """
+        border = timezone.now() - get_ingestion_settings()['stale_after']
+        keys = WebhookEvent.objects.filter(status=EventStatus.RECEIVED, created_at__lt=border).values_list(
+            'provider', 'order_key'
+        ).distinct()
+        scheduled = 0
+        for provider, order_key in keys.iterator():
+            self.schedule(provider, order_key)
+            scheduled += 1
+        return scheduled
+
+    def get_stats(self) -> dict:
+        """
+        Глубина очереди (необработанные события), количество ошибок и отставание самого старого события в секундах.
+        """
+        stats = {status: 0 for status in (EventStatus.RECEIVED, EventStatus.FAILED)}
+        stats.update(
+            WebhookEvent.objects.filter(status__in=stats.keys()).values_list('status').annotate(count=Count('pk'))
+        )
+        oldest = WebhookEvent.objects.filter(status=EventStatus.RECEIVED).aggregate(oldest=Min('created_at'))['oldest']
+        return {
+            'pending': stats[EventStatus.RECEIVED],
+            'failed': stats[EventStatus.FAILED],
+            'lag': (timezone.now() - oldest).total_seconds() if oldest else 0,
+        }
+
+
+webhook_ingestion = WebhookIngestion()
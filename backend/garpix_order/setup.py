@@ -34,4 +34,9 @@ setup(
         'djangorestframework >= 3.8',
         'django-fsm == 3.0.0',
     ],
+    extras_require={
+        'async': ['httpx >= 0.23'],
+        'parquet': ['pyarrow >= 7'],
+        'tracing': ['opentelemetry-api >= 1.0'],
+    },
 )
@@ -0,0 +1,12 @@
+from django.dispatch import Signal
+
+
+# Отправляется после каждой порции TransitionQuerySet.transition: sender - модель выборки,
+# name - переход, source и target - статусы, pks - первичные ключи переведенных объектов, using - БД.
+# Сигнал отправляется внутри транзакции порции.
+post_bulk_transition = Signal()
+
+# Отправляется после bulk_create_polymorphic, если строки вставлены множественным INSERT без Model.save()
+# и post_save не отправлялся: sender - модель, objs - созданные объекты, using - БД.
+# Сигнал отправляется внутри транзакции вставки.
+post_bulk_create = Signal()
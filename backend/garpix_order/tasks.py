@@ -0,0 +1,32 @@
+from celery import shared_task
+
+from .services.robokassa import get_recurring_settings, robokassa_service
+from .services.webhook_ingestion import webhook_ingestion
+
+
+@shared_task
+def create_recurring_payments():
+    return robokassa_service.create_recurring_payments()
+
+
+@shared_task(bind=True)
+def charge_recurring_order(self, order_id, billing_cycle):
+    semaphore = robokassa_service.get_concurrency_semaphore()
+    if not semaphore.acquire():
+        options = get_recurring_settings()
+        raise self.retry(countdown=options['retry_countdown'], max_retries=options['max_retries'])
+    try:
+        payment = robokassa_service.charge_recurring_order(order_id, billing_cycle)
+    finally:
+        semaphore.release()
+    return payment.pk if payment else None
+
+
+@shared_task
+def process_webhook_events(provider, order_key):
+    return webhook_ingestion.process_order_events(provider, order_key)
+
+
+@shared_task
+def schedule_stale_webhook_events():
+    return webhook_ingestion.schedule_stale()
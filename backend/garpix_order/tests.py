@@ -1,13 +1,56 @@
+import csv
+import importlib.util
 import json
+import os
+import tempfile
+import threading
 import uuid
-from django.test import TestCase
-from django_fsm import can_proceed
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from urllib.parse import urlencode
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_fsm import TransitionNotAllowed, can_proceed
 from garpix_order.models.payments.cash import CashPayment
 from garpix_order.models.payments.cloudpayments import CloudPayment
 from garpix_order.models.payment import BasePayment
 from garpix_order.models.order import BaseOrder
 from django.contrib.auth import get_user_model
 from garpix_order.models.order_item import BaseOrderItem
+from garpix_order.models.config import Config
+from garpix_order.models.journal import PaymentEvent
+from garpix_order.models.rollup import PaymentRollup
+from garpix_order.models.webhook import ProcessedWebhook, WebhookEvent
+from garpix_order.models.payments.sber import AbstractSberPayment
+from garpix_order.admin.export import export_csv
+from garpix_order.benchmarks import BENCHMARKS, Benchmark, BenchmarkRunner, percentile, summarize
+from garpix_order.concurrency import conflict_stats
+from garpix_order.exceptions import InvalidModelPaymentException, OrderVersionConflictException
+from garpix_order.metrics import MetricsRegistry, metrics
+from garpix_order.registry import PaymentRegistry
+from garpix_order.models.payments.recurring import Recurring
+from garpix_order.models.payments.robokassa import RobokassaPayment
+from garpix_order.services.journal import payment_journal
+from garpix_order.services.invoicing import MassInvoicingService, RobokassaSigner
+from garpix_order.services.robokassa import robokassa_service
+from garpix_order.services.sber import sber_service
+from garpix_order.signals import post_bulk_transition
+from garpix_order.tracing import tracer
+from garpix_order.services.export import data_exporter
+from garpix_order.services.deduplication import WebhookDeduplicator, webhook_deduplicator
+from garpix_order.services.sber_async import async_sber_service
+from garpix_order.services.sber_reconciliation import SberReconciliationReport, SberReconciliationService
+from garpix_order.services.settlement import SettlementReconciliationService
+from garpix_order.services.transport import AsyncProviderTransport, JitteredRetry, ProviderTransport
+from garpix_order.services.webhook_ingestion import webhook_ingestion
+from garpix_order.utils import CacheSemaphore, bulk_create_polymorphic, hmac_sha256
 from rest_framework.test import APIClient
 
 
@@ -17,6 +60,21 @@ User = get_user_model()
 PaymentStatus = BasePayment.PaymentStatus
 
 
+def set_cloudpayments_password(password='secret'):
+    config = Config.get_solo()
+    config.cloudpayments_password_api = password
+    config.save()
+
+
+def post_cloudpayments_notification(client, url, data, password='secret', **extra):
+    """Отправляет уведомление CloudPayments, подписанное по сырому телу запроса"""
+    body = urlencode(data)
+    return client.post(
+        url, body, content_type='application/x-www-form-urlencoded',
+        HTTP_CONTENT_HMAC=hmac_sha256(body, password).decode('utf-8'), **extra
+    )
+
+
 class PreBuildTestCase(TestCase):
     def setUp(self):
         self.data_user = {
@@ -128,24 +186,20 @@ class PreBuildTestCase(TestCase):
         BaseOrderItem.objects.create(order=order, amount=50, quantity=1)
 
         order_number = f'{order.pk}_order_number'
+        set_cloudpayments_password()
         cloudpayment_payment = CloudPayment.objects.create(
             title=order_number,
             order_number=order_number,
             order=order,
             amount=total_amount,
         )
-        response = self.client.post(
-            '/cloudpayments/pay/',
-            {
-                'InvoiceId': order_number,
-                'TestMode': '1',
-                'Amount': total_amount,
-                'TransactionId': transaction_id,
-                'Status': CloudPayment.PAYMENT_STATUS_COMPLETED
-            },
-            # format='json',
-            # HTTP_ACCEPT='application/json'
-        )
+        response = post_cloudpayments_notification(self.client, '/cloudpayments/pay/', {
+            'InvoiceId': order_number,
+            'TestMode': '1',
+            'Amount': total_amount,
+            'TransactionId': transaction_id,
+            'Status': CloudPayment.PAYMENT_STATUS_COMPLETED
+        })
 
         content = json.loads(response.content)
         payment = CloudPayment.objects.get(pk=cloudpayment_payment.pk)
@@ -166,3 +220,1491 @@ class PreBuildTestCase(TestCase):
         order = BaseOrder.objects.get(pk=order.pk)
         self.assertEqual(order.total_amount, 25)
         self.assertEqual(new_order.total_amount, 75)
+
+
+@override_settings(GARPIX_ORDER_INCREMENTAL_BALANCE=True)
+class IncrementalBalanceTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+
+    def test_balance_counters(self):
+        """Проверяем ведение счетчиков оплаты без пересчета агрегатов"""
+        payment = BasePayment.objects.create(title='test', order=self.order, amount=60)
+        payment.pending()
+        payment.save()
+        order = BaseOrder.objects.get(pk=self.order.pk)
+        self.assertEqual(order.pending_amount, 60)
+
+        payment.succeeded()
+        payment.save()
+        order = BaseOrder.objects.get(pk=self.order.pk)
+        self.assertEqual(order.payed_amount, 60)
+        self.assertEqual(order.pending_amount, 0)
+        self.assertEqual(order.status, BaseOrder.OrderStatus.PAYED_PARTIAL)
+
+        payment_refunded = BasePayment.make_refunded(payment)
+        payment_refunded.refunded()
+        payment_refunded.save()
+        order = BaseOrder.objects.get(pk=self.order.pk)
+        self.assertEqual(order.payed_amount, 0)
+        self.assertEqual(order.refunded_amount, 60)
+        self.assertEqual(order.status, BaseOrder.OrderStatus.REFUNDED)
+
+    def test_recompute_balances(self):
+        """Проверяем исправление рассинхронизации счетчиков"""
+        payment = BasePayment.objects.create(title='test', order=self.order, amount=100)
+        payment.succeeded()
+        payment.save()
+        BaseOrder.objects.filter(pk=self.order.pk).update(payed_amount=10, pending_amount=5)
+
+        call_command('recompute_balances', stdout=StringIO())
+
+        order = BaseOrder.objects.get(pk=self.order.pk)
+        self.assertEqual(order.payed_amount, 100)
+        self.assertEqual(order.pending_amount, 0)
+        self.assertEqual(order.refunded_amount, 0)
+
+    def test_recompute_balances_dry_run(self):
+        BaseOrder.objects.filter(pk=self.order.pk).update(payed_amount=10)
+        stdout = StringIO()
+
+        call_command('recompute_balances', '--dry-run', stdout=stdout)
+
+        self.assertIn(f'Заказ {self.order.pk} (будет исправлен)', stdout.getvalue())
+        self.assertIn('будет исправлено (--dry-run, изменения не сохранены): 1', stdout.getvalue())
+        self.assertEqual(BaseOrder.objects.get(pk=self.order.pk).payed_amount, 10)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN-проверки индексов рассчитаны на PostgreSQL')
+class HotQueryIndexTestCase(TestCase):
+    """Проверяем, что горячие запросы вебхуков и фоновых задач не откатываются на Seq Scan"""
+    rows = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='test', password='BlaBla123')
+        now = timezone.now()
+        recurring = Recurring.active_objects.create(start_at=now, end_at=now + timedelta(days=365))
+        sber_payment_model = sber_service.get_payment_model()
+        for i in range(cls.rows):
+            order = BaseOrder.objects.create(
+                number=f'order-{i}', user=user, total_amount=100,
+                recurring=recurring if i % 10 == 0 else None, next_payment_date=now + timedelta(days=i)
+            )
+            CloudPayment.objects.create(title=f'cp-{i}', order=order, order_number=f'cp-{i}', amount=100)
+            sber_payment_model.objects.create(title=f'sber-{i}', order=order, amount=100, external_payment_id=f'sber-{i}')
+        cls.order = order
+        cls.recurring = recurring
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset):
+        with connection.cursor() as cursor:
+            # Без индекса планировщик вынужден выбрать Seq Scan даже при запрете
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan, plan)
+
+    def test_cloudpayment_order_number(self):
+        self.assertUsesIndex(CloudPayment.objects.non_polymorphic().filter(order_number='cp-150'))
+
+    def test_cloudpayment_payment_uuid(self):
+        self.assertUsesIndex(CloudPayment.objects.non_polymorphic().filter(payment_uuid=uuid.uuid4().hex))
+
+    def test_sber_external_payment_id(self):
+        sber_payment_model = sber_service.get_payment_model()
+        self.assertUsesIndex(sber_payment_model.objects.non_polymorphic().filter(external_payment_id='sber-150'))
+
+    def test_recurring_due_orders(self):
+        self.assertUsesIndex(BaseOrder.objects.non_polymorphic().filter(
+            recurring=self.recurring, next_payment_date__lte=timezone.now()
+        ))
+
+    def test_order_payments_by_status(self):
+        self.assertUsesIndex(self.order.payments.non_polymorphic().filter(status=PaymentStatus.SUCCEEDED))
+
+
+class ProviderTransportTestCase(TestCase):
+    @override_settings(GARPIX_ORDER_HTTP={'pool_maxsize': 25, 'max_retries': 2, 'timeouts': {'test': 3}})
+    def test_session_pool(self):
+        """Проверяем настройки пула соединений, повторов и таймаута провайдера"""
+        transport = ProviderTransport('test', timeout=10)
+        adapter = transport.session.get_adapter('https://example.com')
+        self.assertEqual(adapter._pool_maxsize, 25)
+        self.assertIsInstance(adapter.max_retries, JitteredRetry)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertEqual(transport.timeout, 3)
+        self.assertIs(transport.session, transport.session)
+
+    def test_session_recreated_after_fork(self):
+        """Проверяем, что дочерний процесс не использует соединения родителя"""
+        transport = ProviderTransport('test', timeout=10)
+        session = transport.session
+        with mock.patch('garpix_order.services.transport.os.getpid', return_value=-1):
+            self.assertIsNot(transport.session, session)
+
+    def test_request_timeout(self):
+        transport = ProviderTransport('test', timeout=10)
+        with mock.patch.object(transport.session, 'request') as request:
+            transport.get('https://example.com', params={'a': 1})
+        request.assert_called_once_with('GET', 'https://example.com', params={'a': 1}, timeout=10)
+
+    def test_async_client_shared_between_loops(self):
+        """Проверяем, что запросы из временных циклов async_to_sync идут через один клиент транспорта"""
+        import httpx
+        from asgiref.sync import async_to_sync
+
+        transport = AsyncProviderTransport('test', timeout=10)
+        self.addCleanup(transport.close)
+        client_kwargs = {'transport': httpx.MockTransport(lambda request: httpx.Response(200, json={}))}
+        clients = []
+
+        async def request():
+            response = await transport.get('https://example.com', client_kwargs=client_kwargs)
+            clients.append(transport._client)
+            return response.status_code
+
+        self.assertEqual(async_to_sync(request)(), 200)
+        self.assertEqual(async_to_sync(request)(), 200)
+        self.assertIs(clients[0], clients[1])
+        self.assertFalse(clients[0].is_closed)
+        transport.close()
+        self.assertTrue(clients[0].is_closed)
+
+
+class AsyncSberServiceTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+
+    async def test_create_payment(self):
+        """Проверяем асинхронное создание платежа в Сбере"""
+        response_data = {'orderId': 'sber-order-id', 'formUrl': 'https://sber.example/pay'}
+        with mock.patch.object(async_sber_service, '_request', mock.AsyncMock(return_value=response_data)):
+            payment = await async_sber_service.create_payment(order=self.order, returnUrl='https://example.com')
+        self.assertEqual(payment.external_payment_id, 'sber-order-id')
+        self.assertEqual(payment.payment_link, 'https://sber.example/pay')
+        self.assertEqual(payment.status, PaymentStatus.CREATED)
+        self.assertEqual(payment.get_provider_data(), response_data)
+        self.assertEqual(payment.client_data['returnUrl'], 'https://example.com')
+
+    def test_callback_view(self):
+        """Проверяем асинхронный callback Сбера с проверкой чексуммы"""
+        payment = sber_service.get_payment_model().objects.create(
+            title='test', order=self.order, amount=100, external_payment_id='sber-order-id'
+        )
+        data = {'mdOrder': 'sber-order-id', 'orderNumber': 'test', 'operation': 'deposited', 'status': '1'}
+        callback_data = ''.join([f'{k};{v};' for k, v in sorted(data.items())])
+        checksum = async_sber_service._compute_my_checksum(b'secret', callback_data)
+        payment_data = {'orderStatus': 2, 'errorCode': 0}
+
+        with mock.patch.object(async_sber_service, 'CRYPTOGRAPHIC_KEY', 'secret'), \
+                mock.patch.object(async_sber_service, '_request', mock.AsyncMock(return_value=payment_data)):
+            response = self.client.get('/sber/callback/', {**data, 'checksum': checksum})
+            bad_response = self.client.get('/sber/callback/', {**data, 'checksum': 'wrong'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(bad_response.status_code, 400)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.SUCCEEDED)
+
+    def test_callback_for_succeeded_payment(self):
+        """Проверяем, что уведомление по уже оплаченному платежу подтверждается без повторного перехода"""
+        payment = sber_service.get_payment_model().objects.create(
+            title='test', order=self.order, amount=100, external_payment_id='sber-order-id'
+        )
+        payment_data = {'orderStatus': 2, 'errorCode': 0}
+        with mock.patch.object(async_sber_service, 'CRYPTOGRAPHIC_KEY', 'secret'), \
+                mock.patch.object(async_sber_service, '_request', mock.AsyncMock(return_value=payment_data)):
+            for operation in ('approved', 'deposited'):
+                data = {'mdOrder': 'sber-order-id', 'orderNumber': 'test', 'operation': operation, 'status': '1'}
+                callback_data = ''.join([f'{k};{v};' for k, v in sorted(data.items())])
+                checksum = async_sber_service._compute_my_checksum(b'secret', callback_data)
+                response = self.client.get('/sber/callback/', {**data, 'checksum': checksum})
+                self.assertEqual(response.status_code, 200)
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.SUCCEEDED)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payed_amount, 100)
+
+    def test_update_stale_payment(self):
+        """Проверяем, что статус платежа перечитывается из БД перед переходом"""
+        payment_model = sber_service.get_payment_model()
+        payment = payment_model.objects.create(title='test', order=self.order, amount=100,
+                                               external_payment_id='sber-order-id')
+        stale = payment_model.objects.get(pk=payment.pk)
+        sber_service._apply_payment_data(payment=payment, payment_data={'orderStatus': 2, 'errorCode': 0})
+        sber_service._apply_payment_data(payment=stale, payment_data={'orderStatus': 2, 'errorCode': 0})
+
+        self.assertEqual(stale.status, PaymentStatus.SUCCEEDED)
+        self.assertEqual(payment_model.objects.get(pk=payment.pk).get_provider_data(),
+                         {'orderStatus': 2, 'errorCode': 0})
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payed_amount, 100)
+
+
+class SberReconciliationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+        self.payment_model = sber_service.get_payment_model()
+
+    def test_reconcile_pending_payments(self):
+        """Проверяем перевод зависших платежей по статусу из Сбера"""
+        paid = self.payment_model.objects.create(title='paid', order=self.order, amount=100,
+                                                 external_payment_id='paid')
+        declined = self.payment_model.objects.create(title='declined', order=self.order, amount=100,
+                                                     external_payment_id='declined')
+        statuses = {'paid': 2, 'declined': 6}
+
+        async def request(url, params):
+            return {'orderStatus': statuses[params['orderId']], 'errorCode': 0}
+
+        service = SberReconciliationService(rate_limit=0)
+        with mock.patch.object(async_sber_service, '_request', side_effect=request):
+            report = service.run()
+            second_report = service.run()
+
+        self.assertEqual(report.checked, 2)
+        self.assertEqual(report.changed, 2)
+        self.assertEqual(second_report.checked, 0)
+        paid.refresh_from_db()
+        declined.refresh_from_db()
+        self.assertEqual(paid.status, PaymentStatus.SUCCEEDED)
+        self.assertEqual(paid.get_provider_data(), {'orderStatus': 2, 'errorCode': 0})
+        self.assertEqual(declined.status, PaymentStatus.FAILED)
+        self.assertIsNotNone(declined.status_checked_at)
+
+    def test_invalid_status_counted_as_failed(self):
+        """Проверяем, что нечисловой статус одного платежа не откатывает порцию"""
+        invalid = self.payment_model.objects.create(title='invalid', order=self.order, amount=100,
+                                                    external_payment_id='invalid')
+        paid = self.payment_model.objects.create(title='paid', order=self.order, amount=100,
+                                                 external_payment_id='paid')
+        service = SberReconciliationService()
+        chunk = list(service.get_queryset(timezone.now()))
+
+        report = SberReconciliationReport()
+        service._apply_chunk(chunk, [{'orderStatus': 'unknown'}, {'orderStatus': 2, 'errorCode': 0}], report)
+
+        self.assertEqual((report.checked, report.changed, report.failed), (2, 1, 1))
+        invalid.refresh_from_db()
+        paid.refresh_from_db()
+        self.assertEqual(invalid.status, PaymentStatus.CREATED)
+        self.assertIsNotNone(invalid.status_checked_at)
+        self.assertEqual(paid.status, PaymentStatus.SUCCEEDED)
+
+    def test_skip_changed_and_acs_payments(self):
+        """Проверяем, что платеж, измененный во время опроса, и платеж на авторизации ACS не трогаются"""
+        changed = self.payment_model.objects.create(title='changed', order=self.order, amount=100,
+                                                    external_payment_id='changed')
+        acs = self.payment_model.objects.create(title='acs', order=self.order, amount=100, external_payment_id='acs')
+        service = SberReconciliationService()
+        chunk = list(service.get_queryset(timezone.now()))
+        self.payment_model.objects.filter(pk=changed.pk).update(status=PaymentStatus.CANCELED)
+
+        report = SberReconciliationReport()
+        service._apply_chunk(chunk, [{'orderStatus': 2, 'errorCode': 0}, {'orderStatus': 5, 'errorCode': 0}], report)
+
+        self.assertEqual(report.checked, 2)
+        self.assertEqual(report.changed, 0)
+        self.assertEqual(report.failed, 0)
+        changed.refresh_from_db()
+        acs.refresh_from_db()
+        self.assertEqual(changed.status, PaymentStatus.CANCELED)
+        self.assertEqual(acs.status, PaymentStatus.CREATED)
+        self.assertIsNotNone(acs.status_checked_at)
+
+
+class RecurringPaymentsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        now = timezone.now()
+        self.recurring = Recurring.active_objects.create(start_at=now, end_at=now + timedelta(days=365))
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100,
+                                              recurring=self.recurring, next_payment_date=now - timedelta(hours=1))
+        BaseOrder.objects.create(number='not due', user=self.user, total_amount=100,
+                                 recurring=self.recurring, next_payment_date=now + timedelta(days=1))
+        RobokassaPayment.objects.create(title='first', order=self.order, amount=100)
+        self.billing_cycle = robokassa_service.get_billing_cycle(self.order.next_payment_date)
+
+    def test_dispatch_due_orders(self):
+        """Проверяем выбор заказов по диапазону дат и постановку задач в очередь"""
+        with mock.patch('garpix_order.tasks.charge_recurring_order.delay') as delay:
+            dispatched = robokassa_service.create_recurring_payments(chunk_size=1)
+        self.assertEqual(dispatched, 1)
+        delay.assert_called_once_with(self.order.pk, self.billing_cycle)
+
+    def test_concurrency_semaphore(self):
+        """Проверяем, что истекший слот не позволяет превысить лимит"""
+        self.addCleanup(cache.clear)
+        first, second, third = (CacheSemaphore('test', limit=2) for _ in range(3))
+        self.assertTrue(first.acquire())
+        self.assertTrue(second.acquire())
+        self.assertFalse(third.acquire())
+
+        cache.delete(first.slot)  # слот истек, пока первый воркер еще работает
+        self.assertTrue(third.acquire())
+        first.release()
+        self.assertFalse(CacheSemaphore('test', limit=2).acquire())
+
+        second.release()
+        third.release()
+        self.assertTrue(CacheSemaphore('test', limit=2).acquire())
+
+    def test_charge_is_idempotent(self):
+        """Проверяем, что повторный запуск за тот же период не списывает деньги повторно"""
+        def post(url, data):
+            return mock.Mock(text=f'FAIL{data["InvoiceID"]}')
+
+        with mock.patch.object(robokassa_service.transport, 'post', side_effect=post) as request:
+            payment = robokassa_service.charge_recurring_order(self.order.pk, self.billing_cycle)
+            same_payment = robokassa_service.charge_recurring_order(self.order.pk, self.billing_cycle)
+
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(payment.pk, same_payment.pk)
+        self.assertEqual(payment.status, PaymentStatus.FAILED)
+
+    def test_charge_success(self):
+        def post(url, data):
+            return mock.Mock(text=f'OK{data["InvoiceID"]}')
+
+        with mock.patch.object(robokassa_service.transport, 'post', side_effect=post) as request:
+            payment = robokassa_service.charge_recurring_order(self.order.pk, self.billing_cycle)
+            self.assertIsNone(robokassa_service.charge_recurring_order(self.order.pk, self.billing_cycle))
+
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(payment.status, PaymentStatus.SUCCEEDED)
+        order = BaseOrder.objects.get(pk=self.order.pk)
+        self.assertEqual(order.status, BaseOrder.OrderStatus.PAYED_FULL)
+        self.assertNotEqual(robokassa_service.get_billing_cycle(order.next_payment_date), self.billing_cycle)
+
+    def _charge_two_cycles(self):
+        def post(url, data):
+            return mock.Mock(text=f'OK{data["InvoiceID"]}')
+
+        with mock.patch.object(robokassa_service.transport, 'post', side_effect=post) as request:
+            first = robokassa_service.charge_recurring_order(self.order.pk, self.billing_cycle)
+            BaseOrder.objects.filter(pk=self.order.pk).update(next_payment_date=timezone.now() - timedelta(minutes=1))
+            order = BaseOrder.objects.get(pk=self.order.pk)
+            second_cycle = robokassa_service.get_billing_cycle(order.next_payment_date)
+            second = robokassa_service.charge_recurring_order(self.order.pk, second_cycle)
+            self.assertIsNone(robokassa_service.charge_recurring_order(self.order.pk, second_cycle))
+
+        self.assertEqual(request.call_count, 2)
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertEqual(first.status, PaymentStatus.SUCCEEDED)
+        self.assertEqual(second.status, PaymentStatus.SUCCEEDED)
+        self.assertEqual(second.amount, 100)
+        order = BaseOrder.objects.get(pk=self.order.pk)
+        self.assertEqual(order.status, BaseOrder.OrderStatus.PAYED_FULL)
+        self.assertEqual(order.total_amount, 200)
+        self.assertEqual(order.payed_amount, 200)
+        self.assertEqual(order.payed_amount, order.payment_amount())
+        self.assertNotEqual(robokassa_service.get_billing_cycle(order.next_payment_date), second_cycle)
+
+    def test_charge_consecutive_cycles(self):
+        """Проверяем, что второй период по оплаченному заказу открывается до списания и проводится"""
+        self._charge_two_cycles()
+
+    @override_settings(GARPIX_ORDER_INCREMENTAL_BALANCE=True)
+    def test_charge_consecutive_cycles_incremental(self):
+        self._charge_two_cycles()
+
+
+class ConfigCacheTestCase(TransactionTestCase):
+    def setUp(self):
+        Config.invalidate_cache()
+
+    @override_settings(GARPIX_ORDER_CONFIG_CACHE_TTL=60)
+    def test_cached_config(self):
+        """Проверяем, что настройки читаются из памяти процесса и сбрасываются при изменении"""
+        config = Config.get_cached()
+        with self.assertNumQueries(0):
+            self.assertIs(Config.get_cached(), config)
+
+        config.cloudpayments_public_id = 'new_public_id'
+        config.save()
+        self.assertEqual(Config.get_cached().cloudpayments_public_id, 'new_public_id')
+
+    @override_settings(GARPIX_ORDER_CONFIG_CACHE_TTL=0)
+    def test_version_check(self):
+        """Проверяем, что после истечения TTL БД читается только при смене версии"""
+        Config.get_cached()
+        with self.assertNumQueries(0):
+            Config.get_cached()
+        Config.objects.update(cloudpayments_public_id='updated')
+        Config.invalidate_cache()
+        self.assertEqual(Config.get_cached().cloudpayments_public_id, 'updated')
+
+    @override_settings(GARPIX_ORDER_CONFIG_CACHE_TTL=60)
+    def test_invalidate_on_commit(self):
+        """Проверяем, что кэш сбрасывается только после фиксации транзакции с изменением настроек"""
+        config = Config.get_cached()
+        with transaction.atomic():
+            Config.objects.get().save()
+            self.assertIs(Config.get_cached(), config)
+        self.assertIsNot(Config.get_cached(), config)
+
+
+class PaymentRegistryTestCase(TestCase):
+    def test_models_resolved_at_startup(self):
+        """Проверяем, что модель платежа берется из реестра без повторного импорта"""
+        with mock.patch('garpix_order.registry.import_string') as import_string:
+            payment_model = sber_service.get_payment_model()
+        import_string.assert_not_called()
+        self.assertTrue(issubclass(payment_model, AbstractSberPayment))
+
+    @override_settings(SBER_PAYMENT_MODEL='garpix_order.models.CashPayment')
+    def test_invalid_sber_payment_model(self):
+        self.assertRaises(InvalidModelPaymentException, PaymentRegistry().configure)
+
+    @override_settings(GARPIX_PAYMENT_STATUS_CHANGED_CALLBACK='garpix_order.undefined_callback')
+    def test_invalid_status_changed_callback(self):
+        self.assertRaises(ImproperlyConfigured, PaymentRegistry().configure)
+
+    @override_settings(GARPIX_PAYMENT_STATUS_CHANGED_CALLBACK='garpix_order.tests')
+    def test_status_changed_callback(self):
+        registry = PaymentRegistry()
+        registry.configure()
+        self.assertIs(registry.status_changed_callback, callback)
+
+
+class CloudPaymentsWebhookTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+        self.payment = CloudPayment.objects.create(title='cp', order=self.order, order_number='cp-1', amount=100)
+        set_cloudpayments_password()
+        webhook_deduplicator.forget_all()
+        self.data = {
+            'InvoiceId': 'cp-1',
+            'Amount': '100.00',
+            'TransactionId': '42',
+            'Status': CloudPayment.PAYMENT_STATUS_COMPLETED,
+        }
+
+    def test_invalid_signature(self):
+        response = self.client.post(
+            '/cloudpayments/pay/', urlencode(self.data), content_type='application/x-www-form-urlencoded',
+            HTTP_CONTENT_HMAC='invalid'
+        )
+        self.assertEqual(json.loads(response.content), {'code': 13})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.CREATED)
+
+    def test_single_lookup_query(self):
+        """Проверяем, что платеж и заказ загружаются одним запросом"""
+        Config.get_cached()
+        with CaptureQueriesContext(connection) as queries:
+            response = post_cloudpayments_notification(self.client, '/cloudpayments/pay/', self.data)
+        self.assertEqual(json.loads(response.content), {'code': 0})
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        self.assertFalse([query for query in selects if 'garpix_order_config' in query])
+        self.assertEqual(len([query for query in selects if 'garpix_order_cloudpayment' in query]), 1)
+
+    def test_repeated_notification(self):
+        """Проверяем, что повторное уведомление не проводит оплату второй раз"""
+        for _ in range(2):
+            response = post_cloudpayments_notification(self.client, '/cloudpayments/pay/', self.data)
+            self.assertEqual(json.loads(response.content), {'code': 0})
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payed_amount, 100)
+        self.assertEqual(self.order.status, BaseOrder.OrderStatus.PAYED_FULL)
+
+    def test_wrong_amount(self):
+        response = post_cloudpayments_notification(self.client, '/cloudpayments/pay/', {**self.data, 'Amount': '1'})
+        self.assertEqual(json.loads(response.content), {'code': 12})
+
+    def test_fail_notification(self):
+        data = {key: value for key, value in self.data.items() if key != 'Status'}
+        response = post_cloudpayments_notification(self.client, '/cloudpayments/fail/', data)
+        self.assertEqual(json.loads(response.content), {'code': 0})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.FAILED)
+
+
+class WebhookDeduplicationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+        CloudPayment.objects.create(title='cp', order=self.order, order_number='cp-1', amount=100)
+        set_cloudpayments_password()
+        Config.get_cached()
+        webhook_deduplicator.forget_all()
+        self.data = {'InvoiceId': 'cp-1', 'Amount': '100.00', 'TransactionId': '42',
+                     'Status': CloudPayment.PAYMENT_STATUS_COMPLETED}
+
+    def test_duplicate_notification(self):
+        """Проверяем, что повтор уведомления не обращается к платежу"""
+        post_cloudpayments_notification(self.client, '/cloudpayments/pay/', self.data)
+        self.assertTrue(ProcessedWebhook.objects.filter(provider='cloudpayments', transaction_id='42').exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            response = post_cloudpayments_notification(self.client, '/cloudpayments/pay/', self.data)
+        self.assertEqual(json.loads(response.content), {'code': 0})
+        self.assertFalse([query for query in queries if 'garpix_order_basepayment' in query['sql']])
+
+    def test_rejected_notification_not_remembered(self):
+        """Проверяем, что отметка об обработке снимается, если уведомление не применено"""
+        response = post_cloudpayments_notification(self.client, '/cloudpayments/pay/', {**self.data, 'Amount': '1'})
+        self.assertEqual(json.loads(response.content), {'code': 12})
+        self.assertFalse(ProcessedWebhook.objects.exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            response = post_cloudpayments_notification(self.client, '/cloudpayments/pay/', self.data)
+        self.assertEqual(json.loads(response.content), {'code': 0})
+        self.assertTrue(ProcessedWebhook.objects.filter(provider='cloudpayments', transaction_id='42').exists())
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT') and
+                          'garpix_order_processedwebhook' in query['sql']])
+
+    def test_process_cache(self):
+        deduplicator = WebhookDeduplicator()
+        with override_settings(GARPIX_ORDER_WEBHOOK_DEDUP={'lru_size': 1}):
+            deduplicator._remember_in_process(('sber', '1', 'deposited:1'))
+            deduplicator._remember_in_process(('sber', '2', 'deposited:1'))
+            with self.assertNumQueries(0):
+                self.assertTrue(deduplicator.is_duplicate('sber', '2', 'deposited:1'))
+            self.assertFalse(deduplicator.is_cached('sber', '1', 'deposited:1'))
+
+    def test_cleanup(self):
+        ProcessedWebhook.objects.create(provider='sber', transaction_id='1', status='deposited:1')
+        ProcessedWebhook.objects.create(provider='sber', transaction_id='2', status='deposited:1')
+        ProcessedWebhook.objects.filter(transaction_id='1').update(created_at=timezone.now() - timedelta(days=31))
+
+        call_command('cleanup_processed_webhooks', stdout=StringIO())
+
+        self.assertEqual(list(ProcessedWebhook.objects.values_list('transaction_id', flat=True)), ['2'])
+
+
+@override_settings(GARPIX_ORDER_WEBHOOK_INGESTION={'enabled': True})
+class WebhookIngestionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+        self.payment = CloudPayment.objects.create(title='cp', order=self.order, order_number='cp-1', amount=100)
+        set_cloudpayments_password()
+        webhook_deduplicator.forget_all()
+
+    def post(self, **data):
+        return post_cloudpayments_notification(self.client, '/cloudpayments/pay/', {
+            'InvoiceId': 'cp-1', 'Amount': '100.00', 'Status': CloudPayment.PAYMENT_STATUS_COMPLETED, **data
+        })
+
+    def test_ingest_and_process(self):
+        """Проверяем, что уведомление сохраняется в HTTP-запросе, а применяется задачей"""
+        response = self.post(TransactionId='1')
+        self.assertEqual(json.loads(response.content), {'code': 0})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.CREATED)
+        self.assertEqual(webhook_ingestion.get_stats()['pending'], 1)
+
+        self.assertEqual(webhook_ingestion.process_order_events('cloudpayments', 'cp-1'), 1)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.SUCCEEDED)
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.EventStatus.PROCESSED)
+        self.assertEqual(webhook_ingestion.get_stats(), {'pending': 0, 'failed': 0, 'lag': 0})
+
+    def test_invalid_notification_rejected(self):
+        """Проверяем, что неверные сумма и счет отклоняются в HTTP-запросе, без постановки в очередь"""
+        self.assertEqual(json.loads(self.post(TransactionId='1', Amount='1.00').content), {'code': 12})
+        self.assertEqual(json.loads(self.post(TransactionId='2', InvoiceId='unknown').content), {'code': 10})
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_failed_event(self):
+        CloudPayment.objects.filter(pk=self.payment.pk).update(status=PaymentStatus.FAILED)
+        self.post(TransactionId='1')
+        webhook_ingestion.process_order_events('cloudpayments', 'cp-1')
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.status, WebhookEvent.EventStatus.FAILED)
+        self.assertTrue(event.error)
+        self.assertEqual(webhook_ingestion.get_stats()['failed'], 1)
+
+    def test_schedule_stale(self):
+        self.post(TransactionId='1')
+        WebhookEvent.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        with mock.patch('garpix_order.tasks.process_webhook_events.delay') as delay:
+            self.assertEqual(webhook_ingestion.schedule_stale(), 1)
+        delay.assert_called_once_with('cloudpayments', 'cp-1')
+
+
+@override_settings(GARPIX_ORDER_WEBHOOK_INGESTION={'enabled': True})
+class WebhookIngestionCallbackTestCase(TransactionTestCase):
+    def test_callback_after_commit(self):
+        """Проверяем, что callback смены статуса вызывается после фиксации транзакции порции событий"""
+        user = User.objects.create_user(username='test', password='BlaBla123')
+        order = BaseOrder.objects.create(number='test', user=user, total_amount=100)
+        payment = CloudPayment.objects.create(title='cp', order=order, order_number='cp-1', amount=100)
+        set_cloudpayments_password()
+        webhook_deduplicator.forget_all()
+        with mock.patch('garpix_order.tasks.process_webhook_events.delay'):
+            post_cloudpayments_notification(self.client, '/cloudpayments/pay/', {
+                'InvoiceId': 'cp-1', 'Amount': '100.00', 'TransactionId': '1',
+                'Status': CloudPayment.PAYMENT_STATUS_COMPLETED,
+            })
+
+        calls = []
+
+        def status_changed(changed_payment):
+            calls.append((changed_payment.pk, connection.in_atomic_block,
+                          WebhookEvent.objects.get().status))
+
+        with mock.patch('garpix_order.services.cloudpayments.payment_registry') as registry:
+            registry.status_changed_callback = status_changed
+            webhook_ingestion.process_order_events('cloudpayments', 'cp-1')
+
+        self.assertEqual(calls, [(payment.pk, False, WebhookEvent.EventStatus.PROCESSED)])
+
+
+@override_settings(GARPIX_ORDER_OPTIMISTIC_LOCKING=True)
+class OptimisticLockingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+        conflict_stats.reset()
+
+    def test_retry_after_conflict(self):
+        """Проверяем, что платеж по устаревшему заказу перечитывает его и не теряет параллельную оплату"""
+        first = BasePayment.objects.create(title='first', order=self.order, amount=50)
+        second = BasePayment.objects.create(title='second', order=self.order, amount=50)
+        second.order  # заказ прочитан до параллельной оплаты
+
+        concurrent = BasePayment.objects.get(pk=first.pk)
+        concurrent.succeeded()
+        concurrent.save()
+        second.succeeded()
+        second.save()
+
+        order = BaseOrder.objects.get(pk=self.order.pk)
+        self.assertEqual(order.payed_amount, 100)
+        self.assertEqual(order.status, BaseOrder.OrderStatus.PAYED_FULL)
+        self.assertEqual(order.version, 2)
+        self.assertEqual(conflict_stats.conflicts, 1)
+
+    def test_payment_saved_after_concurrent_payment(self):
+        """Проверяем, что оплата, записанная в заказ до сохранения строки платежа, не теряется"""
+        first = BasePayment.objects.create(title='first', order=self.order, amount=60)
+        second = BasePayment.objects.get(pk=BasePayment.objects.create(title='second', order=self.order, amount=40).pk)
+
+        first.succeeded()
+        second.succeeded()
+        second.save()
+        first.save()
+
+        order = BaseOrder.objects.get(pk=self.order.pk)
+        self.assertEqual(order.payed_amount, 100)
+        self.assertEqual(order.status, BaseOrder.OrderStatus.PAYED_FULL)
+
+    def test_overpayment_rejected(self):
+        """Проверяем, что после конфликта повторно проверяется превышение суммы заказа"""
+        first = BasePayment.objects.create(title='first', order=self.order, amount=50)
+        second = BasePayment.objects.create(title='second', order=self.order, amount=60)
+        second.order
+
+        concurrent = BasePayment.objects.get(pk=first.pk)
+        concurrent.succeeded()
+        concurrent.save()
+        self.assertRaises(TransitionNotAllowed, second.succeeded)
+
+        order = BaseOrder.objects.get(pk=self.order.pk)
+        self.assertEqual(order.payed_amount, 50)
+        self.assertEqual(order.status, BaseOrder.OrderStatus.PAYED_PARTIAL)
+
+    @override_settings(GARPIX_ORDER_OPTIMISTIC_RETRIES=0)
+    def test_retries_exhausted(self):
+        payment = BasePayment.objects.create(title='test', order=self.order, amount=50)
+        payment.order
+        BaseOrder.objects.filter(pk=self.order.pk).update(version=10)
+        self.assertRaises(OrderVersionConflictException, payment.succeeded)
+        self.assertEqual(conflict_stats.as_dict()['exhausted'], 1)
+
+    def test_split_order(self):
+        first_item = BaseOrderItem.objects.create(order=self.order, amount=25, quantity=2)
+        BaseOrderItem.objects.create(order=self.order, amount=50, quantity=1)
+        new_order = BaseOrder.split_order('new', first_item)
+        self.order.refresh_from_db()
+        self.assertEqual(new_order.total_amount, 50)
+        self.assertEqual(self.order.total_amount, 50)
+        self.assertEqual(self.order.version, 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Параллельные транзакции требуют PostgreSQL')
+@override_settings(GARPIX_ORDER_OPTIMISTIC_LOCKING=True, GARPIX_ORDER_OPTIMISTIC_RETRIES=50)
+class OptimisticLockingStressTestCase(TransactionTestCase):
+    """Параллельные callback-уведомления по одному заказу не теряют оплаты и не превышают сумму заказа"""
+    threads = 16
+
+    def test_concurrent_payments(self):
+        user = User.objects.create_user(username='test', password='BlaBla123')
+        order = BaseOrder.objects.create(number='test', user=user, total_amount=self.threads)
+        payment_pks = [
+            BasePayment.objects.create(title=f'p-{i}', order=order, amount=1).pk for i in range(self.threads + 4)
+        ]
+        barrier = threading.Barrier(len(payment_pks))
+
+        def pay(pk):
+            try:
+                barrier.wait()
+                with transaction.atomic():
+                    payment = BasePayment.objects.get(pk=pk)
+                    payment.succeeded()
+                    payment.save()
+            except TransitionNotAllowed:
+                pass
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=pay, args=(pk,)) for pk in payment_pks]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        order.refresh_from_db()
+        succeeded = BasePayment.objects.filter(order=order, status=PaymentStatus.SUCCEEDED).count()
+        self.assertEqual(succeeded, self.threads)
+        self.assertEqual(order.payed_amount, self.threads)
+        self.assertEqual(order.status, BaseOrder.OrderStatus.PAYED_FULL)
+
+
+class BulkItemsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user)
+
+    def test_add_items(self):
+        """Проверяем пакетное добавление позиций и пересчет суммы заказа"""
+        items = self.order.add_items([BaseOrderItem(amount=25, quantity=2), BaseOrderItem(amount=50)])
+        self.assertEqual(self.order.total_amount, 100)
+        self.assertEqual(BaseOrder.objects.get(pk=self.order.pk).total_amount, 100)
+        self.assertTrue(all(item.pk for item in items))
+
+    def test_total_is_recalculated(self):
+        """Проверяем, что total_amount пересчитывается по позициям, а не по расхождению в памяти"""
+        first, second = self.order.add_items([BaseOrderItem(amount=25, quantity=2), BaseOrderItem(amount=50)])
+        BaseOrder.objects.filter(pk=self.order.pk).update(total_amount=1)
+        self.order.remove_items([first.pk])
+        self.assertEqual(self.order.total_amount, 50)
+
+        self.order.remove_items([second])
+        self.assertEqual(self.order.total_amount, 0)
+
+    def test_fulfillment(self):
+        """Проверяем, что при полной оплате у позиций вызывается pay(), а при частичной - нет"""
+        self.order.add_items([BaseOrderItem(amount=50), BaseOrderItem(amount=50)])
+        with mock.patch.object(BaseOrderItem, 'pay') as pay:
+            for title in ('first', 'second'):
+                pay.assert_not_called()
+                payment = BasePayment.objects.create(title=title, order=self.order, amount=50)
+                payment.succeeded()
+                payment.save()
+        self.assertEqual(pay.call_count, 2)
+
+    def test_replace_items(self):
+        """Проверяем обновление, добавление и удаление позиций одним вызовом"""
+        kept, removed = self.order.add_items([BaseOrderItem(amount=25), BaseOrderItem(amount=50)])
+        kept.amount = 30
+        self.order.replace_items([kept, BaseOrderItem(amount=10)])
+        self.assertEqual(self.order.total_amount, 40)
+        self.assertFalse(BaseOrderItem.objects.filter(pk=removed.pk).exists())
+        self.assertEqual(BaseOrderItem.objects.get(pk=kept.pk).amount, 30)
+
+    def test_replace_items_rejects_foreign(self):
+        """Проверяем, что позиция другого заказа не переносится и состав заказа не меняется"""
+        own, = self.order.add_items([BaseOrderItem(amount=25)])
+        other_order = BaseOrder.objects.create(number='other', user=self.user)
+        foreign, = other_order.add_items([BaseOrderItem(amount=50)])
+        self.assertRaises(ValueError, self.order.replace_items, [foreign])
+        self.assertEqual(BaseOrderItem.objects.get(pk=foreign.pk).order_id, other_order.pk)
+        self.assertTrue(BaseOrderItem.objects.filter(pk=own.pk).exists())
+
+    def test_insert_api(self):
+        """bulk_create_polymorphic вызывает закрытый QuerySet._insert: проверяем версию Django и сигнатуру"""
+        import django
+        import inspect
+        from django.db.models.query import QuerySet
+
+        self.assertTrue((3, 1) <= django.VERSION[:2] < (5, 0), django.get_version())
+        parameters = inspect.signature(QuerySet._insert).parameters
+        self.assertLessEqual({'objs', 'fields', 'returning_fields', 'using'}, set(parameters))
+
+
+class RobokassaListTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+        self.other_order = BaseOrder.objects.create(number='other', user=self.user, total_amount=100)
+        for i in range(30):
+            RobokassaPayment.objects.create(title=f'rk-{i}', order=self.order if i % 2 else self.other_order, amount=1)
+        self.client = APIClient()
+
+    def fetch_all(self, url):
+        titles = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            content = json.loads(b''.join(response.streaming_content) if response.streaming else response.content)
+            titles += [payment['title'] for payment in content['results']]
+            url = content['next']
+        return titles
+
+    def test_keyset_pages(self):
+        """Проверяем, что страницы по курсору не теряют и не повторяют платежи"""
+        titles = self.fetch_all('/robokassa/?page_size=7')
+        self.assertEqual(titles, [f'rk-{i}' for i in reversed(range(30))])
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        with CaptureQueriesContext(connection) as small_page:
+            self.client.get('/robokassa/?page_size=2')
+        with CaptureQueriesContext(connection) as large_page:
+            self.client.get('/robokassa/?page_size=30')
+        self.assertEqual(len(small_page), len(large_page))
+
+    def test_filters(self):
+        titles = self.fetch_all(f'/robokassa/?order={self.order.pk}&status={PaymentStatus.CREATED}')
+        self.assertEqual(len(titles), 15)
+        self.assertEqual(self.fetch_all('/robokassa/?created_to=2000-01-01T00:00:00Z'), [])
+        self.assertEqual(self.client.get('/robokassa/?status=unknown').status_code, 400)
+
+    @override_settings(GARPIX_ORDER_PAGINATION={'stream_threshold': 10, 'stream_chunk_size': 4})
+    def test_streaming_pages(self):
+        response = self.client.get('/robokassa/?page_size=10')
+        self.assertTrue(response.streaming)
+        self.assertEqual(self.fetch_all('/robokassa/?page_size=10'), [f'rk-{i}' for i in reversed(range(30))])
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+        CashPayment.objects.create(title='cash', order=self.order, amount=10, provider_data={'msg': 'paid'})
+        CloudPayment.objects.create(title='cloud', order=self.order, amount=20, order_number='cp-1')
+        BaseOrderItem.objects.create(order=self.order, amount=5, quantity=2)
+
+    def export(self, name, fmt, **kwargs):
+        output = StringIO()
+        count = data_exporter.export(data_exporter.get_queryset(name, **kwargs), fmt, output, chunk_size=1)
+        return count, output.getvalue()
+
+    def test_csv_flattens_subclasses(self):
+        count, content = self.export('payments', 'csv')
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(count, 2)
+        self.assertEqual([row['type'] for row in rows], ['garpix_order.cashpayment', 'garpix_order.cloudpayment'])
+        self.assertEqual([row['cloudpayment__order_number'] for row in rows], ['', 'cp-1'])
+        self.assertEqual(json.loads(rows[0]['provider_data']), {'msg': 'paid'})
+
+    def test_jsonl_date_range(self):
+        count, content = self.export('items', 'jsonl', created_from=timezone.now() - timedelta(days=1))
+        self.assertEqual(count, 1)
+        self.assertEqual(json.loads(content)['quantity'], 2)
+        count, content = self.export('orders', 'jsonl', created_to=timezone.now() - timedelta(days=1))
+        self.assertEqual((count, content), (0, ''))
+
+    def test_iter_export_yields_chunks(self):
+        parts = list(data_exporter.iter_export(data_exporter.get_queryset('payments'), 'jsonl', chunk_size=1))
+        self.assertEqual(len([part for part in parts if part]), 2)
+
+    def test_admin_action(self):
+        response = export_csv(None, None, BasePayment.objects.filter(title='cloud'))
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual([row['title'] for row in rows], ['cloud'])
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'orders.csv')
+            call_command('export_order_data', 'orders', '--output', path, '--from', '2000-01-01', stdout=StringIO())
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual([row['number'] for row in csv.DictReader(f)], ['test'])
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'Требуется pyarrow')
+    def test_parquet(self):
+        import pyarrow.parquet
+
+        output = BytesIO()
+        data_exporter.export(data_exporter.get_queryset('payments'), 'parquet', output, chunk_size=1)
+        output.seek(0)
+        table = pyarrow.parquet.read_table(output)
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(table.column('cloudpayment__order_number').to_pylist(), [None, 'cp-1'])
+
+
+class SettlementReconciliationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=1000)
+        self.today = timezone.localdate()
+
+        def cloud(number, amount, status, transaction_id):
+            return CloudPayment.objects.create(title=number, order=self.order, amount=amount, status=status,
+                                               order_number=number, transaction_id=transaction_id)
+
+        self.matched = cloud('inv-1', 10, PaymentStatus.SUCCEEDED, '1')
+        self.unconfirmed = cloud('inv-2', 20, PaymentStatus.PENDING, '')
+        self.missing = cloud('inv-3', 30, PaymentStatus.SUCCEEDED, '3')
+        self.wrong_amount = cloud('inv-4', 40, PaymentStatus.SUCCEEDED, '4')
+        self.registry = StringIO(
+            'TransactionId,InvoiceId,Amount\n'
+            '1,inv-1,10.00\n'
+            '2,inv-2,20.00\n'
+            '4,inv-4,41.00\n'
+            '99,inv-99,5.00\n'
+        )
+
+    def test_report(self):
+        output = StringIO()
+        report = SettlementReconciliationService('cloudpayments').reconcile(
+            self.registry, self.today, discrepancies=output
+        )
+        self.assertEqual(report.as_dict()['rows'], 4)
+        self.assertEqual(report.matched, 3)
+        self.assertEqual(report.discrepancies, {'missing': 1, 'extra': 1, 'amount': 1, 'unconfirmed': 1})
+        rows = {row['kind']: row for row in csv.DictReader(StringIO(output.getvalue()))}
+        self.assertEqual(rows['missing']['payment_id'], str(self.missing.pk))
+        self.assertEqual(rows['extra']['key'], '99')
+        self.assertEqual(rows['amount']['registry_amount'], '41.00')
+        self.assertEqual(rows['unconfirmed']['key'], 'inv-2')
+        self.unconfirmed.refresh_from_db()
+        self.assertEqual(self.unconfirmed.status, PaymentStatus.PENDING)
+
+    def test_apply(self):
+        report = SettlementReconciliationService('cloudpayments', apply_batch_size=1).reconcile(
+            self.registry, self.today, apply=True
+        )
+        self.assertEqual((report.corrected, report.failed), (1, 0))
+        self.unconfirmed.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(self.unconfirmed.status, PaymentStatus.SUCCEEDED)
+        self.assertEqual(self.order.payed_amount, 100)  # сумма всех оплаченных платежей заказа
+
+    def test_window(self):
+        report = SettlementReconciliationService('cloudpayments').reconcile(
+            self.registry, self.today - timedelta(days=5)
+        )
+        self.assertEqual((report.payments, report.matched), (0, 0))
+
+    def test_robokassa_command(self):
+        payment = RobokassaPayment.objects.create(title='rk', order=self.order, amount=15)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'registry.csv')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f'InvId;OutSum\n{payment.pk};15,00\n')
+            out = StringIO()
+            call_command('reconcile_settlement', 'robokassa', path, '--date', self.today.isoformat(), '--apply',
+                         stdout=out)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.SUCCEEDED)
+        self.assertIn('исправлено: 1', out.getvalue())
+
+
+@override_settings(GARPIX_ORDER_PAYMENT_ROLLUPS={'enabled': True})
+class PaymentRollupTestCase(TransactionTestCase):
+    """Сводки обновляются после фиксации транзакции, поэтому тесты выполняются без общей транзакции"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=1000)
+
+    def rollups(self):
+        return {
+            status: (count, amount)
+            for status, count, amount in PaymentRollup.objects.filter(count__gt=0).values_list(
+                'status', 'count', 'amount'
+            )
+        }
+
+    def test_incremental_updates(self):
+        payment = CashPayment.objects.create(title='cash', order=self.order, amount=10)
+        self.assertEqual(self.rollups(), {PaymentStatus.CREATED: (1, 10)})
+
+        payment.succeeded()
+        payment.save()
+        self.assertEqual(self.rollups(), {PaymentStatus.SUCCEEDED: (1, 10)})
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            CashPayment.objects.create(title='rolled back', order=self.order, amount=5)
+            raise ValueError
+        self.assertEqual(self.rollups(), {PaymentStatus.SUCCEEDED: (1, 10)})
+
+        payment.delete()
+        self.assertEqual(self.rollups(), {})
+
+    def test_unsaved_transition(self):
+        payment = CashPayment.objects.create(title='cash', order=self.order, amount=10)
+        payment.pending()
+        self.assertEqual(self.rollups(), {PaymentStatus.CREATED: (1, 10)})
+
+        with mock.patch('django.db.models.Model.save_base', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                payment.save()
+        self.assertEqual(self.rollups(), {PaymentStatus.CREATED: (1, 10)})
+
+        payment.save()
+        self.assertEqual(self.rollups(), {PaymentStatus.PENDING: (1, 10)})
+
+    def test_bulk_transition(self):
+        for _ in range(3):
+            CashPayment.objects.create(title='cash', order=self.order, amount=10)
+        BasePayment.objects.transition('closed')
+        self.assertEqual(self.rollups(), {PaymentStatus.CLOSED: (3, 30)})
+
+    def test_bulk_create(self):
+        orders = [BaseOrder.objects.create(number=str(i), user=self.user, total_amount=10 * i) for i in (1, 2, 3)]
+        MassInvoicingService(chunk_size=2).invoice_robokassa(
+            BaseOrder.objects.filter(pk__in=[order.pk for order in orders])
+        )
+        self.assertEqual(self.rollups(), {PaymentStatus.CREATED: (3, 60)})
+
+        BasePayment.objects.transition('closed')
+        self.assertEqual(self.rollups(), {PaymentStatus.CLOSED: (3, 60)})
+        self.assertFalse(PaymentRollup.objects.filter(count__lt=0).exists())
+
+    def test_backfill_matches_incremental(self):
+        for amount in (10, 20, 30):
+            CloudPayment.objects.create(title=str(amount), order=self.order, amount=amount, order_number=str(amount))
+        payment = CashPayment.objects.create(title='cash', order=self.order, amount=40)
+        payment.succeeded()
+        payment.save()
+        incremental = self.rollups()
+
+        PaymentRollup.objects.update(count=0, amount=0)
+        out = StringIO()
+        call_command('backfill_payment_rollups', stdout=out)
+        self.assertEqual(self.rollups(), incremental)
+        self.assertEqual(incremental[PaymentStatus.CREATED], (3, 60))
+        self.assertIn('Строк сводки: 2', out.getvalue())
+
+    def test_dashboard_reads_only_rollups(self):
+        payment = CashPayment.objects.create(title='cash', order=self.order, amount=10)
+        payment.succeeded()
+        payment.save()
+        admin_user = User.objects.create_superuser(username='admin', password='BlaBla123', email='admin@example.com')
+        self.client.force_login(admin_user, backend='django.contrib.auth.backends.ModelBackend')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/garpix_order/paymentrollup/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['revenue'], 10)
+        self.assertFalse([query for query in queries if 'garpix_order_basepayment' in query['sql']])
+
+
+class FastChangeListTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=1000)
+        bulk_create_polymorphic([CashPayment(title=f'p-{i}', order=self.order, amount=1) for i in range(250)])
+        admin_user = User.objects.create_superuser(username='admin', password='BlaBla123', email='admin@example.com')
+        self.client.force_login(admin_user, backend='django.contrib.auth.backends.ModelBackend')
+
+    def test_keyset_pages(self):
+        titles = []
+        url = '/admin/garpix_order/basepayment/'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            changelist = response.context['cl']
+            titles += [payment.title for payment in changelist.result_list]
+            self.assertFalse([query for query in queries if 'OFFSET' in query['sql']])
+            url = changelist.next_cursor_url and f'/admin/garpix_order/basepayment/{changelist.next_cursor_url}'
+        self.assertEqual(titles, [f'p-{i}' for i in reversed(range(250))])
+
+    def test_list_does_not_downcast(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/garpix_order/basepayment/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'garpix_order_cashpayment' in query['sql']])
+        self.assertIn('garpix_order_baseorder', response.context['cl'].queryset.query.__str__())
+
+    @skipUnless(connection.vendor == 'postgresql', 'Оценка количества строк использует статистику PostgreSQL')
+    @override_settings(GARPIX_ORDER_ADMIN={'estimate_count_threshold': 1})
+    def test_estimated_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE garpix_order_basepayment')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/garpix_order/basepayment/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql'].upper()])
+        self.assertTrue(response.context['cl'].result_count > 0)
+
+
+class MassInvoicingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        for number, total_amount in (('first', 100), ('second', Decimal('10.5')), ('empty', 0)):
+            BaseOrder.objects.create(number=number, user=self.user, total_amount=total_amount)
+        self.orders = BaseOrder.objects.filter(user=self.user)
+
+    def test_signer_matches_service(self):
+        payment = RobokassaPayment.objects.create(title='rk', order=self.orders.first(), amount=Decimal('10.5'))
+        self.assertEqual(RobokassaSigner().link(payment.pk, payment.amount), robokassa_service.generate_payment_link(payment))
+
+    def test_invoice_robokassa(self):
+        result = MassInvoicingService(chunk_size=2).invoice_robokassa(self.orders)
+        self.assertEqual(result.as_dict()['created'], 2)
+        self.assertEqual(result.failures, [(self.orders.get(number='empty').pk, 'It is not possible to pay 0 amount')])
+        payments = {payment.pk: payment for payment in RobokassaPayment.objects.all()}
+        for order_id, payment_id, link in result.links:
+            self.assertEqual(payments[payment_id].order_id, order_id)
+            self.assertEqual(link, robokassa_service.generate_payment_link(payments[payment_id]))
+
+    def test_invoice_sber(self):
+        numbers = {order.number: order.pk for order in self.orders}
+        responses = {
+            'first': {'orderId': 'sber-1', 'formUrl': 'https://sber.example/pay/1'},
+            'second': {'errorCode': '1', 'errorMessage': 'Order already processed'},
+        }
+
+        async def register(url, params):
+            if params['orderNumber'] == 'empty':
+                raise ConnectionError('timeout')
+            return responses[params['orderNumber']]
+
+        with mock.patch.object(async_sber_service, '_request', register):
+            result = MassInvoicingService().invoice_sber(self.orders, returnUrl='https://example.com')
+
+        payment_model = sber_service.get_payment_model()
+        paid = payment_model.objects.get(order_id=numbers['first'])
+        self.assertEqual(result.links, [(numbers['first'], paid.pk, 'https://sber.example/pay/1')])
+        self.assertEqual(sorted(result.failures), sorted([
+            (numbers['second'], 'Order already processed'), (numbers['empty'], 'timeout'),
+        ]))
+        failed = payment_model.objects.get(order_id=numbers['second'])
+        self.assertEqual(failed.status, PaymentStatus.FAILED)
+        self.assertEqual(failed.get_provider_data(), responses['second'])
+        self.assertEqual(paid.get_provider_data(), responses['first'])
+        self.assertEqual(paid.client_data, {'amount': 10000, 'orderNumber': 'first', 'returnUrl': 'https://example.com'})
+        self.assertEqual(
+            list(PaymentEvent.objects.filter(payment=failed).values_list('kind', 'name', 'target')),
+            [(PaymentEvent.EventKind.PROVIDER_DATA, '', ''),
+             (PaymentEvent.EventKind.TRANSITION, 'failed', PaymentStatus.FAILED)]
+        )
+        self.assertFalse(payment_model.objects.filter(order_id=numbers['empty']).exists())
+
+
+class PaymentJournalTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+        self.payment = RobokassaPayment.objects.create(title='rk', order=self.order, amount=100)
+
+    def test_transitions_and_provider_data(self):
+        self.payment.pending()
+        self.payment.save()
+        self.payment.cancel()
+
+        timeline = [(event.kind, event.target, event.payload) for event in self.payment.get_timeline()]
+        self.assertEqual(timeline, [
+            (PaymentEvent.EventKind.TRANSITION, PaymentStatus.PENDING, None),
+            (PaymentEvent.EventKind.PROVIDER_DATA, '', {'msg': 'Payment is canceled'}),
+            (PaymentEvent.EventKind.TRANSITION, PaymentStatus.CANCELED, None),
+        ])
+        payment = BasePayment.objects.get(pk=self.payment.pk)
+        self.assertEqual(payment.get_provider_data(), {'msg': 'Payment is canceled'})
+
+    def test_transition_recorded_on_save(self):
+        """Проверяем, что переход без сохранения или с неудачным сохранением не попадает в журнал"""
+        self.payment.pending()
+        self.assertFalse(self.payment.get_timeline().exists())
+
+        with mock.patch.object(PaymentEvent.objects, 'bulk_create', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.payment.save()
+        self.assertEqual(BasePayment.objects.get(pk=self.payment.pk).status, PaymentStatus.CREATED)
+        self.assertFalse(self.payment.get_timeline().exists())
+
+        unsaved = BasePayment.objects.get(pk=self.payment.pk)
+        unsaved.pending()
+        self.assertFalse(self.payment.get_timeline().exists())
+        unsaved.save()
+        self.assertEqual(list(self.payment.get_timeline().values_list('name', 'target')),
+                         [('pending', PaymentStatus.PENDING)])
+
+    def test_set_provider_data_updates_pointer_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.payment.set_provider_data({'msg': 'ok'})
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"title"', updates[0])
+        self.assertIn('"provider_event_id"', updates[0])
+
+    @override_settings(GARPIX_ORDER_PAYMENT_JOURNAL={'compress_threshold': 100})
+    def test_compression(self):
+        data = {'items': ['x' * 10] * 100}
+        self.payment.set_provider_data(data)
+        event = PaymentEvent.objects.get(pk=self.payment.provider_event_id)
+        self.assertIsNone(event.data)
+        self.assertLess(len(event.compressed_data), 100)
+        self.assertEqual(event.payload, data)
+
+    def test_bulk_record(self):
+        events = [payment_journal.make_transition_event(self.payment.pk, 'closed', 'created', 'closed') for _ in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            payment_journal.bulk_record(events)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 1)
+        self.assertEqual(self.payment.get_timeline().count(), 3)
+
+
+class BulkTransitionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=1000)
+
+    def make_payments(self, model, status, count, amount=10):
+        payments = [model.objects.create(title='p', order=self.order, amount=amount) for _ in range(count)]
+        BasePayment.objects.filter(pk__in=[payment.pk for payment in payments]).update(status=status)
+        return payments
+
+    def test_sources_from_declarations(self):
+        _, targets = BasePayment.objects.get_bulk_transition('timeout')
+        self.assertEqual(targets, {PaymentStatus.PENDING: PaymentStatus.TIMEOUT,
+                                   PaymentStatus.WAITING_FOR_CAPTURE: PaymentStatus.TIMEOUT})
+        _, targets = BasePayment.objects.get_bulk_transition('closed')
+        self.assertEqual(set(targets), {value for value, _ in PaymentStatus.CHOICES} - {PaymentStatus.CLOSED})
+
+    def test_transition(self):
+        self.make_payments(CashPayment, PaymentStatus.PENDING, 5)
+        self.make_payments(CashPayment, PaymentStatus.WAITING_FOR_CAPTURE, 2)
+        succeeded = self.make_payments(CashPayment, PaymentStatus.SUCCEEDED, 1)
+        received = []
+
+        def listener(sender, source, pks, **kwargs):
+            received.append((source, len(pks)))
+
+        post_bulk_transition.connect(listener)
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                counts = BasePayment.objects.all().transition('timeout', chunk_size=2)
+        finally:
+            post_bulk_transition.disconnect(listener)
+
+        self.assertEqual(counts, {PaymentStatus.PENDING: 5, PaymentStatus.WAITING_FOR_CAPTURE: 2})
+        self.assertEqual(received, [(PaymentStatus.PENDING, 2), (PaymentStatus.PENDING, 2), (PaymentStatus.PENDING, 1),
+                                    (PaymentStatus.WAITING_FOR_CAPTURE, 2)])
+        self.assertEqual(BasePayment.objects.filter(status=PaymentStatus.TIMEOUT).count(), 7)
+        self.assertEqual(BasePayment.objects.get(pk=succeeded[0].pk).status, PaymentStatus.SUCCEEDED)
+        self.assertEqual(PaymentEvent.objects.filter(target=PaymentStatus.TIMEOUT).count(), 7)
+        updates = [query for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 4)
+
+    def test_subclass_queryset(self):
+        self.make_payments(CashPayment, PaymentStatus.CREATED, 2)
+        robokassa = self.make_payments(RobokassaPayment, PaymentStatus.CREATED, 1)
+        counts = RobokassaPayment.objects.filter(amount=10).transition('closed')
+        self.assertEqual(counts, {PaymentStatus.CREATED: 1})
+        self.assertEqual(list(BasePayment.objects.filter(status=PaymentStatus.CLOSED).values_list('pk', flat=True)),
+                         [robokassa[0].pk])
+
+    def test_object_dependent_transitions_rejected(self):
+        for queryset, name in ((BasePayment.objects.all(), 'succeeded'), (BaseOrder.objects.all(), 'pay'),
+                               (BasePayment.objects.all(), 'pay_full')):
+            with self.assertRaises(TransitionNotAllowed):
+                queryset.transition(name)
+
+    def test_side_effect_transitions_rejected(self):
+        BaseOrder.objects.filter(pk=self.order.pk).update(status=BaseOrder.OrderStatus.PAYED_FULL)
+        with self.assertRaises(TransitionNotAllowed):
+            BaseOrder.objects.filter(pk=self.order.pk).transition('open_billing_period')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, BaseOrder.OrderStatus.PAYED_FULL)
+        self.assertEqual(self.order.total_amount, 1000)
+
+    @override_settings(GARPIX_ORDER_INCREMENTAL_BALANCE=True)
+    def test_pending_amount(self):
+        self.make_payments(CashPayment, PaymentStatus.PENDING, 3, amount=20)
+        BaseOrder.objects.filter(pk=self.order.pk).update(pending_amount=60)
+        BasePayment.objects.transition('canceled')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.pending_amount, 0)
+
+
+@override_settings(GARPIX_ORDER_METRICS={'enabled': True})
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+
+    def test_disabled(self):
+        with override_settings(GARPIX_ORDER_METRICS={'enabled': False}):
+            self.assertFalse(metrics.enabled)
+            self.assertIs(metrics.timer('garpix_order_webhook_seconds'), metrics.timer('garpix_order_webhook_seconds'))
+            self.assertEqual(self.client.get('/metrics/').status_code, 404)
+        self.assertTrue(metrics.enabled)
+
+    def test_transitions(self):
+        payment = CashPayment.objects.create(title='cash', order=self.order, amount=100)
+        payment.pending()
+        payment.save()
+        BasePayment.objects.transition('timeout')
+        labels = {'model': 'garpix_order.cashpayment', 'transition': 'pending', 'source': PaymentStatus.CREATED,
+                  'target': PaymentStatus.PENDING}
+        self.assertEqual(metrics.sink.get_value('garpix_order_transitions_total', **labels), 1)
+        self.assertEqual(metrics.sink.get_value(
+            'garpix_order_transitions_total', model='garpix_order.basepayment', transition='timeout',
+            source=PaymentStatus.PENDING, target=PaymentStatus.TIMEOUT
+        ), 1)
+
+    def test_provider_request_and_error_code(self):
+        response = mock.Mock(status_code=200, content=b'{"errorCode": "5", "errorMessage": "denied"}')
+        with mock.patch.object(sber_service.transport.session, 'request', return_value=response):
+            sber_service._request(sber_service.URLS['register'], params={})
+        labels = {'provider': 'sber', 'endpoint': 'register.do'}
+        self.assertEqual(metrics.sink.get_value('garpix_order_provider_request_seconds', **labels), 1)
+        self.assertEqual(metrics.sink.get_value('garpix_order_provider_error_codes_total', error_code='5', **labels), 1)
+
+    def test_webhook_and_endpoint(self):
+        CloudPayment.objects.create(title='cp', order=self.order, order_number='cp-1', amount=100)
+        set_cloudpayments_password()
+        webhook_deduplicator.forget_all()
+        post_cloudpayments_notification(self.client, '/cloudpayments/pay/', {
+            'InvoiceId': 'cp-1', 'Amount': '100.00', 'TransactionId': '42', 'Status': CloudPayment.PAYMENT_STATUS_COMPLETED,
+        })
+
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE garpix_order_webhook_seconds histogram', body)
+        self.assertIn('garpix_order_webhook_seconds_count{handler="handle_notification",provider="cloudpayments"} 1',
+                      body)
+        self.assertIn('garpix_order_webhook_responses_total{code="200",handler="handle_notification",'
+                      'provider="cloudpayments"} 1', body)
+        self.assertIn('garpix_order_optimistic_attempts_total', body)
+
+    def test_token(self):
+        with override_settings(GARPIX_ORDER_METRICS={'enabled': True, 'token': 'secret'}):
+            self.assertEqual(self.client.get('/metrics/').status_code, 401)
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_histogram_render(self):
+        registry = MetricsRegistry(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            registry.observe('garpix_order_webhook_seconds', value, {'provider': 'x'})
+        lines = registry.render().splitlines()
+        self.assertIn('garpix_order_webhook_seconds_bucket{provider="x",le="0.1"} 2', lines)
+        self.assertIn('garpix_order_webhook_seconds_bucket{provider="x",le="1"} 3', lines)
+        self.assertIn('garpix_order_webhook_seconds_bucket{provider="x",le="+Inf"} 4', lines)
+        self.assertIn('garpix_order_webhook_seconds_count{provider="x"} 4', lines)
+
+
+@override_settings(GARPIX_ORDER_TRACING={'enabled': True, 'exporter': 'garpix_order.tracing.InMemorySpanExporter'})
+class TracingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test', password='BlaBla123')
+        self.order = BaseOrder.objects.create(number='test', user=self.user, total_amount=100)
+
+    def capture_sql(self):
+        """Перехватывает запросы уже с комментарием: последняя обертка в списке вызывается ближе всех к курсору"""
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        connection.execute_wrappers.append(capture)
+        self.addCleanup(connection.execute_wrappers.remove, capture)
+        return statements
+
+    def test_cloudpayments_webhook(self):
+        CloudPayment.objects.create(title='cp', order=self.order, order_number='cp-1', amount=100)
+        set_cloudpayments_password()
+        webhook_deduplicator.forget_all()
+        statements = self.capture_sql()
+        post_cloudpayments_notification(self.client, '/cloudpayments/pay/', {
+            'InvoiceId': 'cp-1', 'Amount': '100.00', 'TransactionId': '42', 'Status': CloudPayment.PAYMENT_STATUS_COMPLETED,
+        })
+
+        spans = {span.name: span for span in tracer.exporter.get_finished_spans()}
+        self.assertLessEqual({'cloudpayments.webhook', 'cloudpayments.config', 'cloudpayments.hmac',
+                              'cloudpayments.process', 'cloudpayments.lookup', 'cloudpayments.transition'},
+                             set(spans))
+        root = spans['cloudpayments.webhook']
+        self.assertIsNone(root.parent)
+        self.assertIs(spans['cloudpayments.lookup'].parent, spans['cloudpayments.process'])
+        self.assertIs(spans['cloudpayments.process'].parent, root)
+        self.assertEqual({span.trace_id for span in spans.values()}, {root.trace_id})
+
+        lookup = [sql for sql in statements if "garpix_order='cloudpayments.lookup'" in sql]
+        self.assertEqual(len(lookup), 1)
+        self.assertIn(f"trace_id='{root.trace_id}'", lookup[0])
+
+    def test_sber_callback(self):
+        payment = sber_service.get_payment_model().objects.create(
+            title='test', order=self.order, amount=100, external_payment_id='sber-order-id'
+        )
+        data = {'mdOrder': 'sber-order-id', 'orderNumber': 'test', 'operation': 'deposited', 'status': '1'}
+        callback_data = ''.join([f'{k};{v};' for k, v in sorted(data.items())])
+        checksum = async_sber_service._compute_my_checksum(b'secret', callback_data)
+        statements = self.capture_sql()
+
+        with mock.patch.object(async_sber_service, 'CRYPTOGRAPHIC_KEY', 'secret'), \
+                mock.patch.object(async_sber_service, '_request', mock.AsyncMock(return_value={'orderStatus': 2})):
+            self.client.get('/sber/callback/', {**data, 'checksum': checksum})
+
+        spans = {span.name: span for span in tracer.exporter.get_finished_spans()}
+        for name in ('sber.checksum', 'sber.lookup', 'sber.apply'):
+            self.assertIs(spans[name].parent, spans['sber.callback'])
+        self.assertIs(spans['sber.transition'].parent, spans['sber.apply'])
+        self.assertTrue(any("garpix_order='sber.lookup'" in sql for sql in statements))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.SUCCEEDED)
+
+    def test_error_recorded(self):
+        with self.assertRaises(ValueError), tracer.span('test.error'):
+            raise ValueError
+        self.assertEqual(tracer.exporter.get_finished_spans('test.error')[0].error, 'ValueError')
+        self.assertIsNone(tracer.current_span())
+
+    def test_disabled(self):
+        with override_settings(GARPIX_ORDER_TRACING={'enabled': False}):
+            statements = self.capture_sql()
+            with tracer.span('test.disabled') as span:
+                BaseOrder.objects.count()
+            self.assertIsNone(span)
+            self.assertNotIn('garpix_order=', statements[-1])
+
+
+class BenchmarkTestCase(TestCase):
+    def test_run_and_compare(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('run_benchmarks', samples=3, warmup=1, scale=5, output=output, stdout=StringIO())
+            with open(output, encoding='utf-8') as f:
+                results = json.load(f)
+            self.assertEqual(set(results['results']), set(BENCHMARKS))
+            self.assertEqual(results['parameters'], {'samples': 3, 'warmup': 1, 'scale': 5})
+            self.assertEqual(results['results']['order_pay']['samples'], 3)
+            self.assertEqual(results['environment']['database'], connection.vendor)
+            self.assertFalse(BaseOrder.objects.exists())  # данные замеров откатываются
+
+            for result in results['results'].values():
+                result['median'] /= 1000
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(results, f)
+            with self.assertRaises(CommandError):
+                call_command('run_benchmarks', 'robokassa_signature', samples=3, warmup=1, scale=0, compare=output,
+                             max_regression=0.5, stdout=StringIO())
+
+    def test_on_commit_executed_in_measurement(self):
+        """Проверяем, что работа после фиксации транзакции выполняется в своем замере"""
+        executed = []
+
+        class OnCommitBenchmark(Benchmark):
+            def run(self, i):
+                transaction.on_commit(lambda: executed.append(i))
+
+        BenchmarkRunner(samples=3, warmup=1, scale=0).run_benchmark(OnCommitBenchmark(user=None))
+        self.assertEqual(executed, [0, 1, 2, 3])
+
+    def test_statistics(self):
+        stats = summarize([0.004, 0.001, 0.003, 0.002])
+        self.assertEqual((stats['min'], stats['max'], stats['median']), (0.001, 0.004, 0.0025))
+        self.assertEqual(stats['ops_per_sec'], 400)
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+
+
+def callback(payment):
+    """Тестовый GARPIX_PAYMENT_STATUS_CHANGED_CALLBACK"""
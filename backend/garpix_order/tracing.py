@@ -0,0 +1,232 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import re
+import secrets
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACING_SETTINGS = {
+    'enabled': False,  # Открывать спаны на этапах обработки платежей и уведомлений
+    'exporter': None,  # Путь к классу экспортера спанов (on_end(span), необязательный on_start(span)); None - не экспортировать
+    'sql_comments': True,  # Добавлять к SQL-запросам внутри спанов комментарий с названием операции и trace_id
+}
+
+_current_span = contextvars.ContextVar('garpix_order_span', default=None)
+
+_UNSAFE_NAME_CHARS = re.compile(r'[^\w.:-]')
+
+
+def get_tracing_settings() -> dict:
+    return {**DEFAULT_TRACING_SETTINGS, **getattr(settings, 'GARPIX_ORDER_TRACING', {})}
+
+
+class Span:
+    """Этап обработки: название, атрибуты, длительность и ошибка, если этап завершился исключением"""
+
+    def __init__(self, name: str, parent=None, attributes: dict = None) -> None:
+        self.name = _UNSAFE_NAME_CHARS.sub('_', name)
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self.duration = None
+        self.error = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def __repr__(self):
+        return f'<Span {self.name} {self.trace_id}:{self.span_id}>'
+
+
+class InMemorySpanExporter:
+    """Хранит завершенные спаны в памяти процесса: для тестов и локальной отладки"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.spans = []
+
+    def on_end(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def get_finished_spans(self, name: str = None) -> list:
+        with self._lock:
+            return [span for span in self.spans if name is None or span.name == name]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans = []
+
+
+class LoggingSpanExporter:
+    """Пишет завершенные спаны в лог garpix_order.tracing"""
+
+    def on_end(self, span: Span) -> None:
+        logger.info(f'{span.name} {span.duration * 1000:.2f}ms trace_id={span.trace_id} span_id={span.span_id}'
+                    f'{f" error={span.error}" if span.error else ""} {span.attributes or ""}')
+
+
+class OpenTelemetryExporter:
+    """
+    Передает спаны в OpenTelemetry (нужен пакет opentelemetry-api и настроенный TracerProvider).
+    Спаны верхнего уровня становятся дочерними для текущего спана OpenTelemetry, например спана запроса Django.
+    """
+
+    def __init__(self) -> None:
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImproperlyConfigured('Для OpenTelemetryExporter установите opentelemetry-api') from e
+        self.trace = trace
+        self.tracer = trace.get_tracer('garpix_order')
+
+    def on_start(self, span: Span) -> None:
+        parent = getattr(span.parent, 'otel_span', None)
+        context = self.trace.set_span_in_context(parent) if parent is not None else None
+        span.otel_span = self.tracer.start_span(span.name, context=context)
+
+    def on_end(self, span: Span) -> None:
+        otel_span = span.otel_span
+        for key, value in span.attributes.items():
+            otel_span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+        if span.error:
+            otel_span.set_status(self.trace.Status(self.trace.StatusCode.ERROR, span.error))
+        otel_span.end()
+
+
+class _NullSpanContext:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_span_context = _NullSpanContext()
+
+
+class _SpanContext:
+    def __init__(self, tracer, name: str, attributes: dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> Span:
+        self.span = Span(self.name, parent=_current_span.get(), attributes=self.attributes)
+        self.token = _current_span.set(self.span)
+        self._started_at = time.perf_counter()
+        exporter = self.tracer.exporter
+        if exporter is not None and hasattr(exporter, 'on_start'):
+            exporter.on_start(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.span.duration = time.perf_counter() - self._started_at
+        if exc_type is not None:
+            self.span.error = exc_type.__name__
+        _current_span.reset(self.token)
+        exporter = self.tracer.exporter
+        if exporter is not None:
+            exporter.on_end(self.span)
+        return False
+
+
+class Tracer:
+    """
+    Спаны этапов обработки платежей по настройкам GARPIX_ORDER_TRACING. Текущий спан хранится в contextvars,
+    поэтому вложенность сохраняется в корутинах и в sync_to_async. При выключенной трассировке span()
+    возвращает общий пустой контекстный менеджер.
+    """
+
+    def __init__(self) -> None:
+        self.configure()
+
+    def configure(self) -> None:
+        tracing_settings = get_tracing_settings()
+        exporter = None
+        if tracing_settings['enabled'] and tracing_settings['exporter'] is not None:
+            exporter_class = tracing_settings['exporter']
+            exporter = (import_string(exporter_class) if isinstance(exporter_class, str) else exporter_class)()
+        self.exporter = exporter
+        self.enabled = tracing_settings['enabled']
+        self.sql_comments = self.enabled and tracing_settings['sql_comments']
+        if self.sql_comments:
+            for connection in connections.all():
+                install_sql_comments(connection)
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return _null_span_context
+        return _SpanContext(self, name, attributes)
+
+    @staticmethod
+    def current_span():
+        return _current_span.get()
+
+
+tracer = Tracer()
+
+
+def traced(name: str):
+    """Декоратор: выполняет функцию (синхронную или асинхронную) внутри спана name"""
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def sql_comment_wrapper(execute, sql, params, many, context):
+    """
+    execute_wrapper соединения: запросы внутри спана получают комментарий
+    /* garpix_order='<операция>',trace_id='<id>' */, по которому их можно найти в логе медленных запросов.
+    """
+    span = _current_span.get()
+    if span is None or not tracer.sql_comments:
+        return execute(sql, params, many, context)
+    return execute(f"{sql} /* garpix_order='{span.name}',trace_id='{span.trace_id}' */", params, many, context)
+
+
+def install_sql_comments(connection) -> None:
+    if sql_comment_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_comment_wrapper)
+
+
+@receiver(connection_created)
+def install_sql_comments_on_connect(sender, connection, **kwargs):
+    if tracer.sql_comments:
+        install_sql_comments(connection)
+
+
+@receiver(setting_changed)
+def reconfigure_tracing(setting, **kwargs):
+    if setting == 'GARPIX_ORDER_TRACING':
+        tracer.configure()
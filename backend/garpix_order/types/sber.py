@@ -21,14 +21,12 @@ class PaymentCreationData(TypedDict):
     amount: Decimal
     external_payment_id: str
     payment_link: str
-    client_data: str
-    provider_data: str
+    client_data: dict
     title: str
 
 
 class FailedPaymentCreationData(TypedDict):
     order: BaseOrder
     amount: Decimal
-    client_data: str
-    provider_data: str
+    client_data: dict
     title: str
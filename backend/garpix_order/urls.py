@@ -3,6 +3,8 @@ from rest_framework import routers
 
 from . import views
 from .views.cloudpayments import CloudpaymentView
+from .views.metrics import metrics_view
+from .views.sber import sber_callback_view
 
 
 app_name = 'garpix_order'
@@ -15,6 +17,8 @@ urlpatterns = [
     path('cloudpayments/pay/', CloudpaymentView.pay_view),
     path('cloudpayments/fail/', CloudpaymentView.fail_view),
     path('cloudpayments/payment_data/', CloudpaymentView.payment_data_view),
+    path('sber/callback/', sber_callback_view),
+    path('metrics/', metrics_view),
 ]
 
 urlpatterns += router.urls
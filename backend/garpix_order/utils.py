@@ -1,9 +1,112 @@
 import hashlib
 import hmac
 import base64
+import uuid
 
 
 def hmac_sha256(data, key):
-    message = bytes(data, 'utf-8')
+    message = data if isinstance(data, bytes) else bytes(data, 'utf-8')
     secret = bytes(key, 'utf-8')
     return base64.b64encode(hmac.new(secret, message, hashlib.sha256).digest())
+
+
+class CacheSemaphore:
+    """
+    Семафор поверх общего кэша Django: ограничивает количество одновременно выполняемых операций
+    во всех процессах и воркерах. Каждый слот - отдельный ключ кэша, который занимается атомарным cache.add
+    и освобождается удалением. Ключ живет не дольше timeout, чтобы слоты упавших воркеров освобождались, поэтому
+    операция должна завершаться быстрее timeout. Ограничение действует между процессами, только если в CACHES
+    настроен общий кэш (например, Redis): LocMemCache ограничивает каждый процесс отдельно.
+    """
+
+    def __init__(self, name: str, limit: int, timeout: int = 300) -> None:
+        self.key = f'garpix_order:semaphore:{name}'
+        self.limit = limit
+        self.timeout = timeout
+        self.slot = None
+        self.token = None
+
+    def acquire(self) -> bool:
+        from django.core.cache import cache
+
+        token = uuid.uuid4().hex
+        for i in range(self.limit):
+            slot = f'{self.key}:{i}'
+            if cache.add(slot, token, timeout=self.timeout):
+                self.slot, self.token = slot, token
+                return True
+        return False
+
+    def release(self) -> None:
+        from django.core.cache import cache
+
+        if self.slot is None:
+            return
+        # Слот, истекший по timeout, мог занять другой воркер: его аренду не трогаем
+        if cache.get(self.slot) == self.token:
+            cache.delete(self.slot)
+        self.slot = self.token = None
+
+
+def bulk_create_polymorphic(objs: list, batch_size: int = 1000) -> list:
+    """
+    bulk_create для моделей с multi-table наследованием (наследники PolymorphicModel),
+    которые стандартный bulk_create не поддерживает. Все объекты должны быть одного класса.
+    Строки вставляются по таблицам от корневой модели к наследнику: для каждой порции один INSERT на таблицу.
+    Если БД не возвращает первичные ключи из множественного INSERT (SQLite в Django 3.1), объекты сохраняются по одному,
+    чтобы у всех созданных объектов были первичные ключи. Иначе post_save не отправляется, вместо него после вставки
+    отправляется сигнал post_bulk_create.
+    """
+    from django.db import connections, router, transaction
+    from .signals import post_bulk_create
+
+    objs = list(objs)
+    if not objs:
+        return objs
+
+    model = type(objs[0])
+    assert all(type(obj) is model for obj in objs), 'Все объекты должны быть одного класса'
+    for obj in objs:
+        if hasattr(obj, 'pre_save_polymorphic'):
+            obj.pre_save_polymorphic()
+
+    using = router.db_for_write(model)
+    parents = model._meta.get_parent_list()
+    with transaction.atomic(using=using, savepoint=False):
+        if not connections[using].features.can_return_rows_from_bulk_insert:
+            for obj in objs:
+                obj.save(force_insert=True, using=using)
+            return objs
+
+        if not parents:
+            model._base_manager.bulk_create(objs, batch_size=batch_size)
+            post_bulk_create.send(sender=model, objs=objs, using=using)
+            return objs
+
+        chain = list(reversed(parents)) + [model]
+        root = chain[0]
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            for level in chain:
+                for parent, link in level._meta.parents.items():
+                    for obj in batch:
+                        setattr(obj, link.attname, getattr(obj, parent._meta.pk.attname))
+                fields = [field for field in level._meta.local_concrete_fields if field is not level._meta.auto_field]
+                if level is root:
+                    # QuerySet._insert - тот же низкоуровневый INSERT, которым пользуются Model.save() и bulk_create.
+                    # Это закрытый API Django: вызов с objs, fields, returning_fields и using проверен для версий
+                    # из install_requires (3.1 - 4.2), при расширении диапазона нужно проверить сигнатуру и тест
+                    # BulkItemsTestCase.test_insert_api
+                    rows = level._base_manager._insert(
+                        batch, fields=fields, returning_fields=[root._meta.pk], using=using
+                    )
+                    for obj, row in zip(batch, rows):
+                        setattr(obj, root._meta.pk.attname, row[0])
+                else:
+                    level._base_manager._insert(batch, fields=fields, using=using)
+
+        for obj in objs:
+            obj._state.adding = False
+            obj._state.db = using
+        post_bulk_create.send(sender=model, objs=objs, using=using)
+    return objs
@@ -1,41 +1,93 @@
-from django.http import JsonResponse
-from ...models import CloudPayment
-from decimal import Decimal
-from django.db import transaction
+import hmac
+import json
+from typing import Optional
+from urllib.parse import parse_qsl, unquote_plus
 
-from ...utils import hmac_sha256
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from ...metrics import instrument_webhook
+from ...models import CloudPayment
 from ...models import Config
+from ...services.cloudpayments import CloudPaymentsService, cloudpayments_service
+from ...services.deduplication import webhook_deduplicator
+from ...services.webhook_ingestion import webhook_ingestion
+from ...tracing import traced, tracer
+from ...utils import hmac_sha256
 
 
+PROVIDER = CloudPaymentsService.PROVIDER
+
 PAYMENT_STATUS_COMPLETED = CloudPayment.PAYMENT_STATUS_COMPLETED
 PAYMENT_STATUS_CANCELLED = CloudPayment.PAYMENT_STATUS_CANCELLED
 PAYMENT_STATUS_DECLINED = CloudPayment.PAYMENT_STATUS_DECLINED
 
+CODE_SUCCESS = CloudPaymentsService.CODE_SUCCESS
+CODE_INVALID_INVOICE = CloudPaymentsService.CODE_INVALID_INVOICE
+CODE_INVALID_AMOUNT = CloudPaymentsService.CODE_INVALID_AMOUNT
+CODE_REJECTED = CloudPaymentsService.CODE_REJECTED
+
+# Тела ответов кодируются один раз при импорте модуля
+_RESPONSE_BODIES = {
+    code: json.dumps({'code': code}).encode('utf-8')
+    for code in (CODE_SUCCESS, CODE_INVALID_INVOICE, CODE_INVALID_AMOUNT, CODE_REJECTED)
+}
+
+
+def _response(code: int) -> HttpResponse:
+    return HttpResponse(_RESPONSE_BODIES[code], content_type='application/json')
+
+
+def verify_hmac(request, password: str) -> bool:
+    """
+    Проверяет подпись уведомления по сырому телу запроса.
+    Content-HMAC считается от тела как есть, X-Content-HMAC - от url-декодированного тела.
+    """
+    body = request.body
+    content_hmac = request.headers.get('Content-Hmac')
+    if content_hmac:
+        return hmac.compare_digest(hmac_sha256(body, password), content_hmac.encode('utf-8'))
+    x_content_hmac = request.headers.get('X-Content-Hmac')
+    if x_content_hmac:
+        decoded_body = unquote_plus(body.decode('utf-8'))
+        return hmac.compare_digest(hmac_sha256(decoded_body, password), x_content_hmac.encode('utf-8'))
+    return False
+
+
+@instrument_webhook(PROVIDER)
+@traced('cloudpayments.webhook')
+def handle_notification(request, status: Optional[str] = None) -> HttpResponse:
+    """
+    Обработка уведомления CloudPayments за один проход: подпись проверяется по сырому телу,
+    платеж вместе с заказом загружается и блокируется одним запросом, ответ кодируется один раз.
+    В режиме асинхронной обработки уведомление сохраняется и подтверждается сразу, переход выполняет Celery.
+    status переопределяет статус из уведомления (например, для уведомления Fail).
+    """
+    if request.method != 'POST':
+        return _response(CODE_SUCCESS)
+
+    with tracer.span('cloudpayments.config'):
+        config = Config.get_cached()
+    with tracer.span('cloudpayments.hmac'):
+        verified = verify_hmac(request, config.cloudpayments_password_api)
+    if not verified:
+        return _response(CODE_REJECTED)
+
+    data = dict(parse_qsl(request.body.decode('utf-8'), keep_blank_values=True))
+    status = status or data.get('Status')
+
+    if webhook_ingestion.enabled:
+        if webhook_deduplicator.is_duplicate(PROVIDER, data.get('TransactionId', ''), status):
+            return _response(CODE_SUCCESS)
+        # Код 0 подтверждает уведомление для CloudPayments, поэтому счет и сумма проверяются до постановки в очередь
+        code = cloudpayments_service.validate_notification(data)
+        if code == CODE_SUCCESS:
+            webhook_ingestion.ingest(PROVIDER, order_key=data.get('InvoiceId', ''), payload={**data, 'Status': status})
+        return _response(code)
+
+    return _response(cloudpayments_service.process_notification(data, status))
+
 
-@transaction.atomic
+@csrf_exempt
 def default_view(request):
-    if request.method == 'POST':
-        headers = request.headers
-        try:
-            config = Config.get_solo()
-            cloud_hmac = headers.get('X-Content-Hmac')
-            hmac_data = request.body.decode('utf-8')
-            local_hmac = hmac_sha256(hmac_data, config.cloudpayments_password_api).decode('utf-8')
-            if local_hmac != cloud_hmac:
-                return JsonResponse({"code": 13})
-            payment = CloudPayment.objects.get(order_number=request.POST.get('InvoiceId'))
-            status = request.POST.get('Status')
-            payment.is_test = request.POST.get('TestMode') == '1'
-            payment.transaction_id = request.POST.get('TransactionId')
-            if payment.amount != Decimal(request.POST.get('Amount')):
-                raise Exception('Wrong price')
-            if status == PAYMENT_STATUS_COMPLETED:
-                payment.succeeded()
-            elif status in (PAYMENT_STATUS_CANCELLED, PAYMENT_STATUS_DECLINED):
-                payment.failed()
-            payment.save()
-        except CloudPayment.DoesNotExist:
-            return JsonResponse({"code": 1})
-        except Exception:
-            return JsonResponse({"code": 2})
-    return JsonResponse({"code": 0})
+    return handle_notification(request)
@@ -1,5 +1,8 @@
-from .default_view import default_view
+from django.views.decorators.csrf import csrf_exempt
 
+from .default_view import PAYMENT_STATUS_DECLINED, handle_notification
 
+
+@csrf_exempt
 def fail_view(request):
-    return default_view(request)
+    return handle_notification(request, status=PAYMENT_STATUS_DECLINED)
@@ -4,14 +4,14 @@ from ...models import CloudPayment
 
 
 def payment_data_view(request):
-    config = Config.get_solo()
+    config = Config.get_cached()
     payment_uuid = request.GET.get('payment_uuid')
     try:
         payment = CloudPayment.objects.get(payment_uuid=payment_uuid)
         return JsonResponse({
             'publicId': config.cloudpayments_public_id,
             'description': 'Оплата товара',
-            'amount': payment.price,
+            'amount': payment.amount,
             'currency': 'RUB',
             'invoiceId': payment.order_number,
             'skin': "mini",
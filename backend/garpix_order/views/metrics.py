@@ -0,0 +1,21 @@
+import hmac
+
+from django.http import Http404, HttpResponse
+
+from ..metrics import get_metrics_settings, metrics
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def metrics_view(request):
+    """
+    Метрики процесса в текстовом формате Prometheus. Доступны, только если метрики включены;
+    при заданном GARPIX_ORDER_METRICS['token'] требуется заголовок Authorization: Bearer <token>.
+    """
+    if not metrics.enabled:
+        raise Http404
+    token = get_metrics_settings()['token']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE)
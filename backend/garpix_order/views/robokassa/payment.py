@@ -3,21 +3,58 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from garpix_order.metrics import instrument_webhook
 from garpix_order.models import RobokassaPayment
-from garpix_order.serializers import RobokassaPaymentSerializer, RobokassaResultSerializer
+from garpix_order.pagination import KeysetPagination
+from garpix_order.serializers import (
+    RobokassaPaymentSerializer,
+    RobokassaPaymentListSerializer,
+    RobokassaPaymentFilterSerializer,
+    RobokassaResultSerializer,
+)
 
 
 class RobokassaView(mixins.CreateModelMixin, mixins.ListModelMixin, GenericViewSet):
     serializer_class = RobokassaPaymentSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return RobokassaPayment.objects.all()
+        # Наследников RobokassaPayment нет, поэтому приведение типов django-polymorphic не нужно
+        return RobokassaPayment.objects.non_polymorphic()
 
     def get_serializer_class(self):
         if self.action == 'pay':
             return RobokassaResultSerializer
+        if self.action == 'list':
+            return RobokassaPaymentListSerializer
         return RobokassaPaymentSerializer
 
+    def filter_queryset(self, queryset):
+        if self.action != 'list':
+            return queryset
+        filters = RobokassaPaymentFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        data = filters.validated_data
+        if 'order' in data:
+            queryset = queryset.filter(order_id=data['order'])
+        if 'status' in data:
+            queryset = queryset.filter(status=data['status'])
+        if 'created_from' in data:
+            queryset = queryset.filter(created_at__gte=data['created_from'])
+        if 'created_to' in data:
+            queryset = queryset.filter(created_at__lt=data['created_to'])
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        paginator = self.paginator
+        paginator.page_size = paginator.get_page_size(request)
+        if paginator.is_streaming():
+            return paginator.get_streaming_response(
+                queryset, request, self.get_serializer_class(), self.get_serializer_context()
+            )
+        return super().list(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         return serializer.save()
 
@@ -29,6 +66,7 @@ class RobokassaView(mixins.CreateModelMixin, mixins.ListModelMixin, GenericViewS
         return Response(instance.generate_payment_link(), status=status.HTTP_201_CREATED, headers=headers)
 
     @action(detail=True, methods=['post'])
+    @instrument_webhook('robokassa')
     def pay(self, request, pk, *args, **kwargs):
         payment = self.get_object()
         serializer = self.get_serializer(data=request.data)
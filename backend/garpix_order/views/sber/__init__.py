@@ -0,0 +1 @@
+from .callback import sber_callback_view
@@ -0,0 +1,14 @@
+from django.http import HttpResponseNotAllowed
+
+from ...metrics import instrument_webhook
+from ...services.sber_async import async_sber_service
+
+
+@instrument_webhook(async_sber_service.PROVIDER)
+async def sber_callback_view(request):
+    """
+    Асинхронный обработчик callback-уведомлений Сбера.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    return await async_sber_service.callback(request.GET.dict())